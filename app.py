@@ -1,47 +1,109 @@
 import streamlit as st
-import os
 import sys
-import tempfile
+import pandas as pd
+from concurrent.futures.process import BrokenProcessPool
 from src.exception import CustomException
 from src.pipeline.predict_pipeline import PredictionPipeline
+from src.components.result_store import ResultStore
+from src.inference.upload_scoring import UPLOAD_TYPES, expand_uploads, score_uploads, upload_parse_pool
 from src.logger import logging
 
+NORMAL_LABELS = ("NONE", "NORMAL")
+TABLE_COLUMNS = ['filename', 'db_name', 'instance', 'start_time', 'anomaly_type', 'confidence', 'status', 'error']
+
 st.set_page_config(page_title="AWR Anomaly detection", layout="wide")
 st.title("AWR Report Anomaly Detector")
 
+
+@st.cache_resource
+def load_predictor():
+    # loaded once per server process, reruns and other sessions reuse the warm model
+    return PredictionPipeline()
+
+
+@st.cache_resource
+def load_parse_pool(sections):
+    return upload_parse_pool(sections)
+
+
+def results_table(results):
+    return pd.DataFrame(results).reindex(columns=TABLE_COLUMNS)
+
+
 try:
-    predictor = PredictionPipeline()
+    predictor = load_predictor()
+    parse_pool = load_parse_pool(predictor.parser.sections)
     logging.info("Prediction pipeline initialized successfully")
 except Exception as e:
     st.error(f"Error initializing prediction pipeline: {e}")
     logging.error(f"Initialization error: {e}")
     sys.exit(1)
 
-uploaded_file = st.file_uploader("Upload AWR HTML Report (.html)", type=["html"])
+uploaded_files = st.file_uploader("Upload AWR HTML Reports (.html, optionally compressed) or .zip / .tar.* archives of them", type=UPLOAD_TYPES, accept_multiple_files=True)
 
-if uploaded_file is not None:
+if uploaded_files:
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".html") as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_filepath = tmp_file.name
+        # streamlit reruns the script on every interaction, the same uploads are only scored once
+        upload_key = tuple(uploaded_file.file_id for uploaded_file in uploaded_files)
+        if st.session_state.get('upload_key') != upload_key:
+            reports = expand_uploads((uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files)
+            progress = st.progress(0.0, text=f"Analyzing {len(reports)} AWR reports and predicting Anomaly types...")
+            table = st.empty()
+            rows, results = [], []
+            for batch_rows, batch_results in score_uploads(predictor, reports, parse_pool):
+                rows.extend(batch_rows)
+                results.extend(batch_results)
+                table.dataframe(results_table(results), hide_index=True)
+                progress.progress(len(results) / len(reports), text=f"Scored {len(results)} of {len(reports)} reports")
+            table.empty()
+            progress.empty()
+
+            # keep the predictions so they can be looked up later without the HTML
+            with ResultStore() as store:
+                store.record(results, pipeline='supervised')
+            st.session_state.update(upload_key=upload_key, rows=rows, results=results)
 
-        with st.spinner('Analyzing AWR report and predicting Anomaly type...'):
-            predict_anomaly = predictor.predict(html_filepath=tmp_filepath)
+        rows, results = st.session_state['rows'], st.session_state['results']
+        flagged = {i for i, result in enumerate(results) if 'error' not in result and result['anomaly_type'] not in NORMAL_LABELS}
+        failed = sum('error' in result for result in results)
 
         st.divider()
-        st.subheader("Prediction Results")
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Reports scored", len(results) - failed)
+        col2.metric("Anomalies predicted", len(flagged))
+        col3.metric("Failed", failed)
+        st.dataframe(results_table(results), hide_index=True)
+
+        scored = [i for i, result in enumerate(results) if rows[i] is not None and 'error' not in result]
+        if scored:
+            # predicted anomalies first, the most confident at the top
+            scored.sort(key=lambda i: (i not in flagged, -results[i]['confidence']))
+            selected = st.selectbox("Report details", scored, format_func=lambda i: f"{results[i]['filename']} ({results[i]['anomaly_type']})")
+            predict_anomaly = results[selected]['anomaly_type']
+
+            st.subheader("Prediction Results")
+
+            if predict_anomaly in NORMAL_LABELS:
+                st.markdown(f"**Status:** the report indicates **No significant Anomaly**.")
+            else:
+                st.markdown(f"**Predicted Anomaly Type:** {predict_anomaly}")
 
-        if predict_anomaly == "NONE":
-            st.markdown(f"**Status:** the report indicates **No significant Anomaly**.")
-        else:
-            st.markdown(f"**Predicted Anomaly Type:** {predict_anomaly}")
+                # features that pushed the report towards the predicted type, from the forest's decision paths
+                attribution = predictor.predict_records([rows[selected]], explain=True)[0]['attribution']
+                st.subheader("Top contributing features")
+                st.dataframe(
+                    [{'feature': feature, 'contribution to class probability': round(value, 4)} for feature, value in attribution.items()],
+                    hide_index=True
+                )
+    except BrokenProcessPool:
+        # a parser process died, the cached pool is unusable until it is replaced
+        load_parse_pool.clear()
+        st.error("A report parser process crashed, the parser pool was restarted. Retry to score the uploads again.")
+        st.button("Retry")
+        logging.error("parse pool broken, restarting it")
     except CustomException as e:
         st.error(f"Prediction Error: A crucial file is missing or data structure is incorrect. Details: {e}")
         logging.error(f"Prediction Error in App: {e}")
     except Exception as e:
         st.error(f"An unexpected error occurred: {e}")
         logging.error(f"Generic App Error: {e}")
-    finally:
-        # Clean up the temporary file
-        if 'tmp_filepath' in locals() and os.path.exists(tmp_filepath):
-            os.remove(tmp_filepath)
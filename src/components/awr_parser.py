@@ -1,15 +1,31 @@
 import os
 import sys
-from src.logger import logging
-from src.exception import CustomException
+from functools import partial
+from src.logger import get_logger
+from src.exception import CustomException, ReportParseError
+from src.components.report_sources import iter_report_sources, open_report_text
+from src.components.report_schema import ALL_SECTIONS, FLAT_COLUMNS, HEADER_COLUMNS, SECTION_METRICS, SECTION_TITLES, TEXT_COLUMNS, TOP_EVENT_COUNT
+from src.components.batch_flattener import BatchFlattener
+from src.components.streaming_writer import StreamingReportWriter, write_part
 
 from bs4 import BeautifulSoup
 import pandas as pd
 import re
 
+logger = get_logger('parser')
+report_logger = get_logger('parser.reports', sample_every=100)
+
+# every section of the report body is wrapped in its own <div class="sec">
+_SECTION_SPLIT = re.compile(r'(?=<div\s+class="sec"\s*>)')
+_SECTION_TITLE = re.compile(r'<h2[^>]*>(.*?)</h2>', re.S)
+
 class AWRParser:
-    def __init__(self):
+    def __init__(self, sections=None):
         self.parsed_data= []
+        # sections parsed when a call does not ask for specific ones, None parses all of them
+        self.sections = sections
+        # ReportParseError of every report the last parse_all_reports run skipped
+        self.failures = []
     
     def _parse_header(self, soup):
         
@@ -127,6 +143,9 @@ class AWRParser:
                         if j==0:
                             text = text.rstrip(':').strip()
                             row_data.append(text)
+                        elif j < len(header) and header[j] in TEXT_COLUMNS:
+                            # free text such as the SQL text is kept as is
+                            row_data.append(text)
                         else:
                             row_data.append(self._clean_data_value(text))
 
@@ -172,130 +191,97 @@ class AWRParser:
         except Exception as e:
             raise CustomException(e, sys)
         
-    def parse_single_report(self, filepath):
+    def parse_single_report(self, filepath, sections=None):
         """ Parse a single awr HTML report and extract all metrics"""
 
         try:
-            #logging.info(f"Parsing AWR report: {filepath}")
+            #logger.info(f"Parsing AWR report: {filepath}")
 
-            # read HTML file
-            with open(filepath, 'r', encoding='utf-8') as f:
+            # read HTML file, compressed reports are decompressed while reading
+            with open_report_text(filepath) as f:
                 html_content = f.read()
 
+            return self.parse_report_content(html_content, filename=os.path.basename(filepath), sections=sections)
+
+        except Exception as e:
+             raise ReportParseError(e, sys, source=filepath)
+
+    def parse_full_report(self, filepath):
+        """ every section of a report, also on a parser limited to the sections a model needs"""
+        return self.parse_single_report(filepath, sections=ALL_SECTIONS)
+
+    def _select_sections(self, html_content, sections):
+        """ keeps the header and the <div class="sec"> blocks of the requested sections only"""
+        titles = {SECTION_TITLES[section] for section in sections if section in SECTION_TITLES}
+        chunks = _SECTION_SPLIT.split(html_content)
+        kept = [chunks[0]]
+        for chunk in chunks[1:]:
+            title = _SECTION_TITLE.search(chunk)
+            if title is None:
+                # the untitled block carrying the report type
+                if 'anomaly_type' in sections:
+                    kept.append(chunk)
+            elif title.group(1).strip() in titles:
+                kept.append(chunk)
+        return ''.join(kept)
+
+    def parse_report_content(self, html_content, filename=None, sections=None):
+        """
+        Parse AWR HTML that is already in memory and extract all metrics.
+        With `sections` (keys of SECTION_TITLES, plus 'anomaly_type') only the header and
+        those sections are parsed, the rest of the document is never turned into a tree.
+        Without, the sections the parser was created with are parsed
+        """
+
+        try:
+            if sections is None:
+                sections = self.sections
+            if sections is not None and set(sections) >= set(ALL_SECTIONS):
+                sections = None
+            if sections is not None:
+                if not isinstance(html_content, str):
+                    html_content = html_content.read()
+                html_content = self._select_sections(html_content, sections)
+
             # parse with BeautifulSoup
             soup = BeautifulSoup(html_content, 'lxml')
             data = self._parse_header(soup)
 
             # extract different sections
-            data['filename'] = os.path.basename(filepath)
-            data['load_profile'] = self._parse_table('Load Profile', soup)
-            data['instance_efficiency'] = self._parse_table('Instance Efficiency (Target 100%)', soup)
-            data['top_events'] = self._parse_table('Top Foreground Events by Wait Time', soup)
-            data['time_model'] = self._parse_table('Time Model Statistics', soup)
-            data['memory_stats'] = self._parse_table('Memory Statistics', soup)
-            data['os_stats'] = self._parse_table('Operating System Statistics', soup)
-            data['tablespace_io'] = self._parse_table('Tablespace I/O Stats', soup)
-            data['segments'] = self._parse_table('Segments by Physical Reads', soup)
-            data['sql_stats'] = self._parse_table('SQL ordered by Elapsed Time', soup)
-            data['anomaly_type'] = self._parse_anomaly_type(soup)
+            data['filename'] = filename
+            for section, title in SECTION_TITLES.items():
+                if sections is None or section in sections:
+                    data[section] = self._parse_table(title, soup)
+            if sections is None or 'anomaly_type' in sections:
+                data['anomaly_type'] = self._parse_anomaly_type(soup)
             return data
         
 
         except Exception as e:
-             raise CustomException(e,sys)
+             raise ReportParseError(e, sys, source=filename)
         
     def _flatten_report_data(self, data):
         try:
-            flat_data = {}
-
-            flat_data['filename'] = data.get('filename')
-            flat_data['db_name'] = data.get('db_name')
-            flat_data['db_id'] = data.get('db_id')
-            flat_data['instance'] = data.get('instance')
-            flat_data['start_time'] = data.get('start_time')
-            flat_data['end_time'] = data.get('end_time')
-            flat_data['elapsed_min'] = data.get('elapsed_min')
-            flat_data['db_time_min'] = data.get('db_time_min')
-            flat_data['anomaly_type'] = data.get('anomaly_type')
-
-            #flatten load profile
-            load_profile = data.get('load_profile',[])
-            for row in load_profile:
-                metric = row.get('Metric')
-                if metric == 'DB Time(s)':
-                    flat_data['db_time_per_sec'] = row.get('Per_Second')
-                elif metric == 'DB CPU(s)':
-                    flat_data['db_cpu_per_sec'] = row.get('Per_Second')
-                elif metric == 'Redo size':
-                    flat_data['redo_size_per_sec'] = row.get('Per_Second')
-                elif metric == 'Logical reads':
-                    flat_data['logical_reads_per_sec'] = row.get('Per_Second')
-                elif metric == 'Physical reads':
-                    flat_data['physical_reads_per_sec'] = row.get('Per_Second')
-                elif metric == 'Executes':
-                    flat_data['executes_per_sec'] = row.get('Per_Second')
-                elif metric == 'Transactions':
-                    flat_data['transactions_per_sec'] = row.get('Per_Second')
-            
-            #flattern from instance efficiency
-            instance_efficiency = data.get('instance_efficiency')
-            for row in instance_efficiency:
-                metric = row.get('Metric')
-                if metric == 'Buffer Hit %':
-                    flat_data['buffer_hit_pct'] = row.get('Value')
-                elif metric == 'Library Hit %':
-                    flat_data['library_hit_pct'] = row.get('Value')
-                elif metric == 'Soft Parse %':
-                    flat_data['soft_parse_pct'] = row.get('Value')
-                elif metric == 'Latch Hit %':
-                    flat_data['latch_hit_pct'] = row.get('Value')
-            
+            # every flattened report has the same columns in the same order
+            flat_data = dict.fromkeys(FLAT_COLUMNS)
+
+            for column in HEADER_COLUMNS:
+                flat_data[column] = data.get(column)
+
+            # flatten load profile, instance efficiency, time model, memory and os stats
+            for section, key_column, value_column, metric_columns in SECTION_METRICS:
+                for row in data.get(section) or []:
+                    column = metric_columns.get(row.get(key_column))
+                    if column is not None:
+                        flat_data[column] = row.get(value_column)
+
             #flatten top events
             top_events = data.get('top_events', [])
-            for idx, row in enumerate(top_events[:3], 1):
+            for idx, row in enumerate(top_events[:TOP_EVENT_COUNT], 1):
                 flat_data[f'top_event_{idx}_name'] = row.get('Event')
                 flat_data[f'top_event_{idx}_time_sec'] = row.get('Time_s')
                 flat_data[f'top_event_{idx}_avg_ms'] = row.get('Avg_ms')
 
-            #flatten time model
-            time_model = data.get('time_model')
-            for row in time_model:
-                statistic = row.get('Statistic')
-                if statistic == 'parse time elapsed':
-                    flat_data['parse_time_pct'] = row.get('DB_Time')
-                elif statistic == 'hard parse elapsed time':
-                    flat_data['hard_parse_pct'] = row.get('DB_Time')
-            
-            #flatten memory stats
-            memory_stats = data.get('memory_stats')
-            for row in memory_stats:
-                metric = row.get('Metric')
-                if metric == 'SGA Size (MB)':
-                    flat_data['sga_size_mb'] = row.get('Value')
-                elif metric == 'PGA Allocated (MB)':
-                    flat_data['pga_allocated_mb'] = row.get('Value')
-                elif metric == 'PGA Used (MB)':
-                    flat_data['pga_used_mb'] = row.get('Value')
-                elif metric == 'PGA Usage %':
-                    flat_data['pga_usage_pct'] = row.get('Value')
-                elif metric == 'Sorts in Memory':
-                    flat_data['sorts_memory'] = row.get('Value')
-                elif metric == 'Sorts on Disk':
-                    flat_data['sorts_disk'] = row.get('Value')
-            
-            #flattern os stats
-            os_stats = data.get('os_stats')
-            for row in os_stats:
-                metric = row.get('Metric')
-                if metric == 'OS CPU Usage %':
-                    flat_data['os_cpu_usage_pct'] = row.get('Value')
-                elif metric == 'Load Average':
-                    flat_data['load_average'] = row.get('Value')
-                elif metric == 'Physical Memory (GB)':
-                    flat_data['physical_memory_gb'] = row.get('Value')
-                elif metric == 'Num CPUs':
-                    flat_data['num_cpus'] = row.get('Value')
-
             if flat_data.get('db_time_per_sec') and flat_data.get('db_time_per_sec') > 0:
                 flat_data['cpu_pct_of_db_time'] = (flat_data['db_cpu_per_sec'] / flat_data['db_time_per_sec']) * 100
             else:
@@ -308,41 +294,120 @@ class AWRParser:
         
             return flat_data
         except Exception as e:
-            raise CustomException(e, sys)
+            raise ReportParseError(e, sys, source=data.get('filename'))
     
-    def parse_all_reports(self, input_dir, output_csv):
-        """ Parse all AWR reports in directory and save to CSV"""
+    def _commit_group(self, writer, frame, sql_index, sql_reports, metric_baselines):
+        writer.write_group(frame)
+        if sql_index is not None:
+            sql_index.add_reports(sql_reports)
+        if metric_baselines is not None:
+            metric_baselines.update_frame(frame)
+
+    def _parse_shard(self, paths, result_path, heartbeat, output_format):
+        """ parses one work queue shard into a single row group, returns (parsed sources, failures)"""
+        flattener = BatchFlattener(capacity=len(paths))
+        failures = []
+        for path in paths:
+            for source in iter_report_sources(path):
+                heartbeat()
+                try:
+                    with source.open_text() as stream:
+                        flattener.append(self.parse_report_content(stream, filename=source.name))
+                except Exception as e:
+                    error = ReportParseError(e, sys, source=source.name)
+                    report_logger.error("failed to parse %s: %s", source.name, error.error)
+                    self.failures.append(error)
+                    failures.append({'source': source.name, 'error': str(error.error)})
+        frame = flattener.to_frame()
+        write_part(frame, result_path, output_format)
+        return frame['filename'].astype(str).tolist(), failures
+
+    def _parse_with_work_queue(self, work_queue, input_dir, output_csv, return_df):
+        """ works on the shared queue until it is drained, the worker finishing last merges the dataset"""
+        output_format = 'parquet' if output_csv.endswith('.parquet') else 'csv'
+        if input_dir is not None:
+            work_queue.create(input_dir)
+        committed = work_queue.run_worker(partial(self._parse_shard, output_format=output_format), suffix=f".{output_format}")
+        logger.info(f"parsed {committed} work queue shards, {len(self.failures)} reports failed")
+
+        merge_lease = work_queue.claim_merge()
+        if merge_lease is not None:
+            work_queue.merge_parsed(output_csv, merge_lease)
+            logger.info(f"saved parsed data to: {output_csv}")
+        if not return_df or not os.path.exists(output_csv):
+            return None
+        if output_format == 'parquet':
+            return pd.read_parquet(output_csv)
+        return pd.read_csv(output_csv)
+
+    def parse_all_reports(self, input_dir, output_csv, row_group_size=500, resume=True, return_df=True, sql_index=None, metric_baselines=None, work_queue=None):
+        """
+        Parse all AWR reports in directory and save to CSV (or Parquet for a .parquet output).
+        Every `row_group_size` reports are committed to disk, so memory stays bounded and an
+        interrupted run continues where it stopped when called again with resume=True.
+        A report that cannot be parsed is skipped and kept in self.failures as a ReportParseError.
+        With a SqlIndex, the top SQL of every parsed report is indexed along with each row group,
+        with a MetricBaselineStore, the quantile sketches of the normal reports are updated as well.
+        With a WorkQueue, this process is one of many workers sharing the shards of input_dir
+        through the queue directory; whichever worker finishes last writes output_csv
+        """
         try:
-            logging.info(f"Parsing all reports from: {input_dir}")
-
-            all_parsed_data = []
-
-            # get all HTML files
-            html_files = [f for f in os.listdir(input_dir) if f.endswith('.html')]
-
-            logging.info(f"found {len(html_files)} HTML files")
-
-            # parse each file
-            for i, filename in enumerate(html_files, 1):
-                filepath = os.path.join(input_dir, filename)
-
-                #parse the report
-                data = self.parse_single_report(filepath=filepath)
-
-                # flatten the data 
-                flattened_data = self._flatten_report_data(data)
-
-                all_parsed_data.append(flattened_data)
-
-                if i%50 == 0:
-                    logging.info(f"Parsed {i}/{len(html_files)} reports")
-
-            #convert to datafram and save
-            df = pd.DataFrame(all_parsed_data)
-            df.to_csv(output_csv, index=False)
-            logging.info(f"saved parsed data to: {output_csv}")
-            return df
+            if work_queue is not None:
+                if sql_index is not None or metric_baselines is not None:
+                    raise ValueError("sql_index and metric_baselines are not supported with a work_queue, build them from the merged output")
+                self.failures = []
+                return self._parse_with_work_queue(work_queue, input_dir, output_csv, return_df)
+
+            logger.info(f"Parsing all reports from: {input_dir}")
+
+            writer = StreamingReportWriter(output_csv, resume=resume, input_path=input_dir)
+            parsed_count = 0
+            self.failures = []
+
+            # metrics go straight into typed column arrays instead of one dict per report
+            flattener = BatchFlattener(capacity=row_group_size)
+            sql_reports = []
+
+            # plain, compressed and archived reports are streamed without extracting them
+            for source in iter_report_sources(input_dir):
+                if source.name in writer.completed_sources:
+                    continue
+
+                try:
+                    with source.open_text() as stream:
+                        #parse the report
+                        data = self.parse_report_content(stream, filename=source.name)
+                except Exception as e:
+                    # one bad report does not stop the run, failed reports are retried on resume
+                    error = ReportParseError(e, sys, source=source.name)
+                    report_logger.error("failed to parse %s: %s", source.name, error.error)
+                    self.failures.append(error)
+                    continue
+
+                flattener.append(data)
+                parsed_count += 1
+                if sql_index is not None:
+                    sql_reports.append(data)
+
+                if len(flattener) >= row_group_size:
+                    self._commit_group(writer, flattener.to_frame(), sql_index, sql_reports, metric_baselines)
+                    flattener = BatchFlattener(capacity=row_group_size)
+                    sql_reports = []
+                    logger.info(f"Parsed {parsed_count} reports")
+
+            if len(flattener):
+                self._commit_group(writer, flattener.to_frame(), sql_index, sql_reports, metric_baselines)
+
+            logger.info(f"parsed {parsed_count} AWR reports, {len(writer.completed_sources)} in total, {len(self.failures)} failed")
+
+            writer.finalize()
+            logger.info(f"saved parsed data to: {output_csv}")
+
+            if not return_df:
+                return None
+            if output_csv.endswith('.parquet'):
+                return pd.read_parquet(output_csv)
+            return pd.read_csv(output_csv)
             
         except Exception as e:
             raise CustomException(e, sys)
-        
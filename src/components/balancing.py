@@ -0,0 +1,106 @@
+"""
+Class balancing of the supervised training split.
+
+SMOTE done per class: every minority class gets its own nearest-neighbour
+index built on that class only, and the classes are oversampled in parallel
+with joblib. Only the rows picked as interpolation bases are queried. An
+optional per-class cap undersamples large classes first and bounds the size
+of the balanced set on long histories.
+"""
+import sys
+from collections import Counter
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.neighbors import NearestNeighbors
+from src.exception import CustomException
+from src.logger import get_logger
+
+logger = get_logger('training')
+
+
+@dataclass
+class BalancingConfig:
+    k_neighbors: int = 3
+    # rows per class in the balanced set are capped at this, None keeps the majority class size
+    max_samples_per_class: int = None
+    # NearestNeighbors algorithm per class: 'auto' picks a kd/ball tree for low-dimensional
+    # data and blas-backed brute force once there are too many features for trees to prune
+    neighbour_algorithm: str = 'auto'
+    n_jobs: int = -1
+    # the tree queries release the GIL, threads avoid copying every class to worker processes
+    parallel_backend: str = 'threads'
+    random_state: int = 42
+
+
+def _synthetic_samples(X_class, n_samples, k_neighbors, algorithm, seed):
+    """ n_samples SMOTE points interpolated between members of one class and their same-class neighbours"""
+    rng = np.random.default_rng(seed)
+    k = min(k_neighbors, len(X_class) - 1)
+    base = rng.integers(0, len(X_class), n_samples)
+    if k < 1:
+        # a single sample has no neighbour to interpolate towards
+        return X_class[base]
+
+    tree = NearestNeighbors(n_neighbors=k + 1, algorithm=algorithm).fit(X_class)
+    query_rows, inverse = np.unique(base, return_inverse=True)
+    # the first neighbour of every row is the row itself
+    neighbours = tree.kneighbors(X_class[query_rows], return_distance=False)[:, 1:]
+    chosen = neighbours[inverse, rng.integers(0, k, n_samples)]
+
+    gaps = rng.random((n_samples, 1))
+    return X_class[base] + gaps * (X_class[chosen] - X_class[base])
+
+
+class ClassBalancer:
+    def __init__(self, config=None):
+        self.config = config or BalancingConfig()
+
+    def fit_resample(self, X, y):
+        """ returns X, y with every class at the same size, synthetic rows appended after the originals"""
+        try:
+            columns = X.columns if isinstance(X, pd.DataFrame) else None
+            X_values = np.asarray(X, dtype=np.float64)
+            y = np.asarray(y)
+
+            counts = Counter(y)
+            target = max(counts.values())
+            if self.config.max_samples_per_class is not None:
+                target = min(target, self.config.max_samples_per_class)
+
+            rng = np.random.default_rng(self.config.random_state)
+            keep = []
+            jobs = []
+            seeds = np.random.SeedSequence(self.config.random_state).spawn(len(counts))
+            for label, seed in zip(sorted(counts), seeds):
+                rows = np.flatnonzero(y == label)
+                if len(rows) > target:
+                    # undersample classes above the cap, keeping their original order
+                    rows = np.sort(rng.choice(rows, target, replace=False))
+                keep.append(rows)
+                if len(rows) < target:
+                    jobs.append((label, rows, target - len(rows), seed))
+
+            keep = np.sort(np.concatenate(keep))
+            X_parts, y_parts = [X_values[keep]], [y[keep]]
+
+            if jobs:
+                samples = Parallel(n_jobs=self.config.n_jobs, prefer=self.config.parallel_backend)(
+                    delayed(_synthetic_samples)(X_values[rows], n_samples, self.config.k_neighbors, self.config.neighbour_algorithm, seed)
+                    for _, rows, n_samples, seed in jobs
+                )
+                for (label, _, n_samples, _), X_new in zip(jobs, samples):
+                    X_parts.append(X_new)
+                    y_parts.append(np.full(n_samples, label, dtype=y.dtype))
+
+            X_balanced = np.concatenate(X_parts)
+            y_balanced = np.concatenate(y_parts)
+            logger.info(f"balanced {len(y)} rows into {len(y_balanced)}: {target} per class, {len(jobs)} classes oversampled")
+
+            if columns is not None:
+                X_balanced = pd.DataFrame(X_balanced, columns=columns)
+            return X_balanced, y_balanced
+
+        except Exception as e:
+            raise CustomException(e, sys)
@@ -0,0 +1,145 @@
+"""
+Columnar flattening of many parsed reports.
+
+Instead of collecting one dict per report and letting pandas infer columns
+and dtypes at the end, metrics are written straight into a preallocated
+float64 block laid out the way pandas stores it, and header strings are
+interned into categorical codes. to_frame() then wraps these arrays without
+copying the numeric block.
+"""
+import sys
+import numpy as np
+import pandas as pd
+from src.components.report_schema import FLAT_COLUMNS, HEADER_COLUMNS, SECTION_METRICS, STRING_COLUMNS, TOP_EVENT_COUNT
+from src.exception import CustomException
+
+NUMERIC_COLUMNS = [column for column in FLAT_COLUMNS if column not in STRING_COLUMNS]
+# filenames are unique per report, interning them would only add overhead
+CATEGORICAL_COLUMNS = [column for column in STRING_COLUMNS if column != 'filename']
+
+_NUMERIC_INDEX = {column: i for i, column in enumerate(NUMERIC_COLUMNS)}
+
+# SECTION_METRICS with the flattened column names resolved to numeric block rows
+_SECTION_INDEX = [
+    (section, key_column, value_column, {key: _NUMERIC_INDEX[column] for key, column in metric_columns.items()})
+    for section, key_column, value_column, metric_columns in SECTION_METRICS
+]
+_HEADER_NUMERIC = [(column, _NUMERIC_INDEX[column]) for column in HEADER_COLUMNS if column in _NUMERIC_INDEX]
+_HEADER_STRINGS = [column for column in HEADER_COLUMNS if column not in _NUMERIC_INDEX]
+_TOP_EVENT_INDEX = [
+    (f'top_event_{idx}_name', _NUMERIC_INDEX[f'top_event_{idx}_time_sec'], _NUMERIC_INDEX[f'top_event_{idx}_avg_ms'])
+    for idx in range(1, TOP_EVENT_COUNT + 1)
+]
+
+
+class BatchFlattener:
+    def __init__(self, capacity=1024):
+        self._size = 0
+        self._capacity = max(int(capacity), 1)
+        # one row per column: the transpose is the (columns x rows) block layout pandas uses
+        self._numeric = np.full((len(NUMERIC_COLUMNS), self._capacity), np.nan)
+        self._codes = {column: np.full(self._capacity, -1, dtype=np.int32) for column in CATEGORICAL_COLUMNS}
+        self._categories = {column: {} for column in CATEGORICAL_COLUMNS}
+        self._filenames = np.empty(self._capacity, dtype=object)
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self):
+        capacity = self._capacity * 2
+        numeric = np.full((len(NUMERIC_COLUMNS), capacity), np.nan)
+        numeric[:, :self._capacity] = self._numeric
+        self._numeric = numeric
+        for column, codes in self._codes.items():
+            grown = np.full(capacity, -1, dtype=np.int32)
+            grown[:self._capacity] = codes
+            self._codes[column] = grown
+        filenames = np.empty(capacity, dtype=object)
+        filenames[:self._capacity] = self._filenames
+        self._filenames = filenames
+        self._capacity = capacity
+
+    def _set_string(self, column, row, value):
+        if value is None:
+            return
+        if column == 'filename':
+            self._filenames[row] = value
+            return
+        categories = self._categories[column]
+        code = categories.get(value)
+        if code is None:
+            code = categories[value] = len(categories)
+        self._codes[column][row] = code
+
+    def append(self, data):
+        """ writes one parsed report (output of parse_single_report) into the next row"""
+        try:
+            if self._size == self._capacity:
+                self._grow()
+            row = self._size
+
+            # collect the row in a plain list and write it into the block with one assignment
+            values = [np.nan] * len(NUMERIC_COLUMNS)
+            for column, index in _HEADER_NUMERIC:
+                value = data.get(column)
+                if value is not None:
+                    values[index] = value
+            for column in _HEADER_STRINGS:
+                self._set_string(column, row, data.get(column))
+
+            for section, key_column, value_column, metric_index in _SECTION_INDEX:
+                for section_row in data.get(section) or ():
+                    index = metric_index.get(section_row.get(key_column))
+                    if index is not None:
+                        value = section_row.get(value_column)
+                        if value is not None:
+                            values[index] = value
+
+            for (name_column, time_index, avg_index), event in zip(_TOP_EVENT_INDEX, data.get('top_events') or ()):
+                self._set_string(name_column, row, event.get('Event'))
+                if event.get('Time_s') is not None:
+                    values[time_index] = event.get('Time_s')
+                if event.get('Avg_ms') is not None:
+                    values[avg_index] = event.get('Avg_ms')
+
+            self._numeric[:, row] = values
+            self._size += 1
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def _derive_ratios(self, numeric):
+        db_time = numeric[_NUMERIC_INDEX['db_time_per_sec']]
+        logical_reads = numeric[_NUMERIC_INDEX['logical_reads_per_sec']]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            numeric[_NUMERIC_INDEX['cpu_pct_of_db_time']] = np.where(
+                db_time > 0, numeric[_NUMERIC_INDEX['db_cpu_per_sec']] / db_time * 100, np.nan)
+            numeric[_NUMERIC_INDEX['physical_to_logical_ratio']] = np.where(
+                logical_reads > 0, numeric[_NUMERIC_INDEX['physical_reads_per_sec']] / logical_reads, np.nan)
+
+    def to_frame(self):
+        """ the flattened reports as a DataFrame with FLAT_COLUMNS, sharing memory with this batch"""
+        try:
+            size = self._size
+            numeric = self._numeric[:, :size]
+            self._derive_ratios(numeric)
+
+            df = pd.DataFrame(numeric.T, columns=NUMERIC_COLUMNS, copy=False)
+            # insert the string columns at their schema position, left to right
+            for position, column in enumerate(FLAT_COLUMNS):
+                if column == 'filename':
+                    df.insert(position, column, self._filenames[:size])
+                elif column in self._codes:
+                    categories = list(self._categories[column])
+                    df.insert(position, column, pd.Categorical.from_codes(self._codes[column][:size], categories=categories))
+            return df
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    @classmethod
+    def from_reports(cls, reports):
+        flattener = cls(capacity=len(reports) if hasattr(reports, '__len__') else 1024)
+        for data in reports:
+            flattener.append(data)
+        return flattener.to_frame()
@@ -2,10 +2,12 @@ import os
 import sys
 import pandas as pd
 from sklearn.model_selection import train_test_split
-from src.logger import logging
+from src.logger import get_logger
 from src.exception import CustomException
 from dataclasses import dataclass
 
+logger = get_logger('training')
+
 @dataclass
 class DataIngestionConfig:
     raw_data_path: str = os.path.join('data', 'awr_metrics.csv')
@@ -17,18 +19,18 @@ class DataIngestion:
     def initiate_data_ingestion(self):
         """ Load and validate AWR metrics data """
         try:
-            logging.info("Starting data ingestion")
+            logger.info("Starting data ingestion")
 
             #load data
             df = pd.read_csv(self.ingestion_config.raw_data_path)
 
             #basic validation
-            logging.info(f"Columns: {df.columns.tolist()}")
-            logging.info(f"Missing values: {df.isnull().sum().sum()}")
-            logging.info(f"Duplicated values: {df.duplicated().sum()}")
-            logging.info(f"Anomaly distribution:\n {df['anomaly_type'].value_counts()}")
+            logger.info(f"Columns: {df.columns.tolist()}")
+            logger.info(f"Missing values: {df.isnull().sum().sum()}")
+            logger.info(f"Duplicated values: {df.duplicated().sum()}")
+            logger.info(f"Anomaly distribution:\n {df['anomaly_type'].value_counts()}")
 
-            logging.info("Data ingestion completed successfully")
+            logger.info("Data ingestion completed successfully")
             return df
         except Exception as e:
             raise CustomException(e, sys)
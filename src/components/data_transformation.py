@@ -4,30 +4,46 @@ import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder, StandardScaler
-from imblearn.over_sampling import SMOTE
-from src.logger import logging
+from src.components.balancing import ClassBalancer, BalancingConfig
+from src.components.stage_cache import StageCache, StageCacheConfig
+from src.logger import get_logger
 from collections import Counter
-from src.exception import CustomException
-from dataclasses import dataclass
+from src.exception import CustomException, FeatureEngineeringError
+from dataclasses import dataclass, field
 from src.utils import save_object
 
+logger = get_logger('training')
+
 @dataclass
 class DataTransformationConfig:
     label_encoder_path: str = os.path.join('artifacts', 'label_encoder.pkl')
     scaler_path: str = os.path.join('artifacts','scaler.pkl')
+    balancing: BalancingConfig = field(default_factory=BalancingConfig)
+    # intermediate outputs are reused from here while data and settings are unchanged, None disables it
+    stage_cache_dir: str = StageCacheConfig.cache_dir
 
 class DataTransformation:
     def __init__(self):
         self.transformation_config = DataTransformationConfig()
         self.label_encoder = LabelEncoder()
         self.scaler = StandardScaler()
+        self.stage_cache = None
+        if self.transformation_config.stage_cache_dir:
+            self.stage_cache = StageCache(StageCacheConfig(cache_dir=self.transformation_config.stage_cache_dir))
+
+    def _cached(self, stage, key_parts, compute):
+        """ runs compute through the stage cache when enabled and returns (output, cache key)"""
+        if self.stage_cache is None:
+            return compute(), None
+        key = self.stage_cache.key(stage, *key_parts)
+        return self.stage_cache.get_or_compute(key, compute), key
 
     def get_data_transformer_object(self, df):
         try:
-            logging.info("starting feature engineering")
+            logger.info("starting feature engineering")
             drop_columns = ['filename', 'db_name', 'db_id', 'instance','db_time_min', 'top_event_1_time_sec', 'top_event_2_time_sec', 'top_event_2_avg_ms', 'physical_to_logical_ratio', 'top_event_1_name', 'top_event_2_name', 'top_event_3_name']
             df = df.drop(columns=drop_columns, axis=1)
-            logging.info(f"Dropped columns: {drop_columns}")
+            logger.info(f"Dropped columns: {drop_columns}")
 
             ## converts start_time and end_time in datetime format
             df['start_time'] = pd.to_datetime(df['start_time'])
@@ -54,7 +70,7 @@ class DataTransformation:
             #drop original time columns
             df = df.drop(columns=['start_time', 'end_time', 'start_hour', 'day_of_week', 'start_month'])
 
-            logging.info("feature engineering completed")
+            logger.info("feature engineering completed")
             return df
         
         except Exception as e:
@@ -62,51 +78,72 @@ class DataTransformation:
         
     def initiate_data_transformation(self, df):
         try:
-            logging.info("starting data transformation")
+            logger.info("starting data transformation")
 
             #apply feature engineering
-            df = self.get_data_transformer_object(df)
+            df, _ = self._cached('features', (df, self.get_data_transformer_object), lambda: self.get_data_transformer_object(df))
 
             # dependent variables
             X = df.drop(['anomaly_type'], axis=1)
             # independent variable
             y = df['anomaly_type']
 
-            logging.info(f"original data shape - X: {X.shape}, y: {y.shape}")
-            logging.info(f"original class distribution:\n {Counter(y)}")
+            return self.transform_features(X, y)
+
+        except Exception as e:
+            raise CustomException(e, sys)
 
-            #Encode target variable (multi-class)
-            y_encoded = self.label_encoder.fit_transform(y)
-            logging.info(f"Label encoding: {dict(zip(self.label_encoder.classes_, self.label_encoder.transform(self.label_encoder.classes_)))}")
+    def _split(self, X, y):
+        #Encode target variable (multi-class)
+        label_encoder = LabelEncoder()
+        y_encoded = label_encoder.fit_transform(y)
+
+        # stratified train-test split 
+        X_train, X_test, y_train, y_test = train_test_split(X, y_encoded, test_size=0.2, random_state=42, stratify=y_encoded)
+        return X_train, X_test, y_train, y_test, label_encoder
+
+    def _scale(self, X_train, X_test):
+        scaler = StandardScaler()
+        return scaler.fit_transform(X_train), scaler.transform(X_test), scaler
+
+    def transform_features(self, X, y):
+        """ encodes, splits, balances and scales already engineered features"""
+        try:
+            logger.info(f"original data shape - X: {X.shape}, y: {y.shape}")
+            logger.info(f"original class distribution:\n {Counter(y)}")
 
-            # stratified train-test split 
-            X_train, X_test, y_train, y_test = train_test_split(X, y_encoded, test_size=0.2, random_state=42, stratify=y_encoded)
+            # encode and split, balance and scale, each step reused from the stage cache when its inputs are unchanged
+            (X_train, X_test, y_train, y_test, self.label_encoder), split_key = self._cached(
+                'split', (X, y, self._split), lambda: self._split(X, y))
+            logger.info(f"Label encoding: {dict(zip(self.label_encoder.classes_, self.label_encoder.transform(self.label_encoder.classes_)))}")
 
-            logging.info(f"Train set shape: X_train: {X_train.shape}, y_train: {y_train.shape}")
-            logging.info(f"Test set shape: X_test: {X_test.shape}, y_test: {y_test.shape}")
-            logging.info(f"Train set distribution: {Counter(y_train)}")
-            logging.info(f"Test set distribution: {Counter(y_test)}")
+            logger.info(f"Train set shape: X_train: {X_train.shape}, y_train: {y_train.shape}")
+            logger.info(f"Test set shape: X_test: {X_test.shape}, y_test: {y_test.shape}")
+            logger.info(f"Train set distribution: {Counter(y_train)}")
+            logger.info(f"Test set distribution: {Counter(y_test)}")
 
-            ## apply SMOTE for multiclass balancing
-            sm = SMOTE(sampling_strategy='not majority',k_neighbors=3 ,random_state=42)
+            ## apply SMOTE for multiclass balancing, each minority class is oversampled in parallel
+            balancer = ClassBalancer(self.transformation_config.balancing)
 
             ## fit and apply SMOTE to the training df
-            X_train_balanced, y_train_balanced = sm.fit_resample(X_train, y_train)
+            (X_train_balanced, y_train_balanced), balanced_key = self._cached(
+                'balanced', (split_key, self.transformation_config.balancing, balancer.fit_resample),
+                lambda: balancer.fit_resample(X_train, y_train))
 
-            logging.info(f"After SMOTE - train set shape {(X_train_balanced.shape)}")
-            logging.info(f"After SMOTE - distribution: {Counter(y_train_balanced)}")
+            logger.info(f"After SMOTE - train set shape {(X_train_balanced.shape)}")
+            logger.info(f"After SMOTE - distribution: {Counter(y_train_balanced)}")
             
             # scale features
-            X_train_scaled = self.scaler.fit_transform(X_train_balanced)
-            X_test_scaled = self.scaler.transform(X_test)
+            (X_train_scaled, X_test_scaled, self.scaler), _ = self._cached(
+                'scaled', (balanced_key, self._scale), lambda: self._scale(X_train_balanced, X_test))
 
-            logging.info("feature scaling completed")
+            logger.info("feature scaling completed")
 
             # save preprocessing object
             save_object(file_path=self.transformation_config.label_encoder_path, obj=self.label_encoder)
             save_object(file_path=self.transformation_config.scaler_path, obj = self.scaler)
 
-            logging.info("data transformation completed successfully")
+            logger.info("data transformation completed successfully")
 
             return (
                 X_train_scaled,
@@ -117,4 +154,4 @@ class DataTransformation:
             )
         
         except Exception as e:
-            raise CustomException(e, sys)
\ No newline at end of file
+            raise FeatureEngineeringError(e, sys)
\ No newline at end of file
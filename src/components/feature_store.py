@@ -0,0 +1,131 @@
+"""
+Incremental trend features per database instance.
+
+For every (db_id, instance) the store keeps the last `window` snapshots of the
+trend metrics in a ring buffer, so EWMA, rolling z-score and delta features
+cost O(window) per new report and never require the full history to be
+reloaded. Mean and variance are taken from the buffer in two passes, running
+sums of squares lose all precision on metrics like redo size.
+"""
+import os
+import sys
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from src.exception import CustomException
+from src.utils import save_object, load_object
+
+TREND_METRICS = [
+    'db_time_per_sec', 'db_cpu_per_sec', 'redo_size_per_sec', 'logical_reads_per_sec',
+    'physical_reads_per_sec', 'executes_per_sec', 'transactions_per_sec',
+    'os_cpu_usage_pct', 'load_average', 'pga_usage_pct',
+]
+
+
+@dataclass
+class FeatureStoreConfig:
+    store_path: str = os.path.join('artifacts', 'feature_store.pkl')
+    window: int = 24
+    ewma_alpha: float = 0.3
+
+
+class _InstanceHistory:
+    """ ring buffer of the last `window` snapshots of one instance"""
+
+    def __init__(self, window, n_metrics):
+        self.buffer = np.full((window, n_metrics), np.nan)
+        self.position = 0
+        self.ewma = np.full(n_metrics, np.nan)
+        self.last = np.full(n_metrics, np.nan)
+        self.last_start_time = None
+
+    def features(self, values, alpha):
+        """ trend features of `values` against the history, without changing it"""
+        counts = np.sum(~np.isnan(self.buffer), axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(counts > 0, np.nansum(self.buffer, axis=0) / np.maximum(counts, 1), np.nan)
+            variance = np.where(counts > 1, np.nansum((self.buffer - mean) ** 2, axis=0) / np.maximum(counts, 1), np.nan)
+            std = np.sqrt(variance)
+            zscore = np.where(std > 0, (values - mean) / std, np.nan)
+        ewma = np.where(np.isnan(self.ewma), values, alpha * values + (1 - alpha) * self.ewma)
+        ewma = np.where(np.isnan(values), self.ewma, ewma)
+        return ewma, zscore, values - self.last
+
+    def push(self, values, ewma):
+        # the oldest snapshot falls out of the window
+        present = ~np.isnan(values)
+        self.buffer[self.position] = values
+        self.position = (self.position + 1) % len(self.buffer)
+        self.ewma = ewma
+        self.last = np.where(present, values, self.last)
+
+
+class RollingFeatureStore:
+    def __init__(self, config=None):
+        self.config = config or FeatureStoreConfig()
+        self.metrics = list(TREND_METRICS)
+        self.histories = {}
+
+    @staticmethod
+    def _key(row):
+        return (str(row.get('db_id')), str(row.get('instance')))
+
+    def _values(self, row):
+        return np.array([np.nan if row.get(metric) is None else float(row.get(metric)) for metric in self.metrics])
+
+    def _as_dict(self, ewma, zscore, delta):
+        features = {}
+        for i, metric in enumerate(self.metrics):
+            features[f'{metric}_ewma'] = float(ewma[i])
+            features[f'{metric}_zscore'] = float(zscore[i])
+            features[f'{metric}_delta'] = float(delta[i])
+        return features
+
+    def update(self, row):
+        """
+        returns the trend features of a flattened report and adds it to its instance history.
+        reports that are not newer than the latest one seen for the instance (re-scores,
+        late arrivals) are scored against the history without being added to it
+        """
+        try:
+            key = self._key(row)
+            history = self.histories.get(key)
+            if history is None:
+                history = _InstanceHistory(self.config.window, len(self.metrics))
+                self.histories[key] = history
+
+            values = self._values(row)
+            ewma, zscore, delta = history.features(values, self.config.ewma_alpha)
+
+            # reports without a parseable start time are taken in arrival order
+            start_time = pd.to_datetime(row.get('start_time'), errors='coerce')
+            if pd.isna(start_time) or history.last_start_time is None or start_time > history.last_start_time:
+                history.push(values, ewma)
+                if not pd.isna(start_time):
+                    history.last_start_time = start_time
+
+            return self._as_dict(ewma, zscore, delta)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def transform_frame(self, df):
+        """ trend features for a frame of flattened reports, replayed in start_time order per instance"""
+        try:
+            order = pd.to_datetime(df['start_time']).argsort(kind='stable')
+            rows = df.iloc[order].to_dict('records')
+            features = [self.update(row) for row in rows]
+            return pd.DataFrame(features, index=df.index[order]).loc[df.index]
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def save(self, file_path=None):
+        save_object(file_path or self.config.store_path, self)
+
+    @classmethod
+    def load_or_create(cls, file_path=None):
+        file_path = file_path or FeatureStoreConfig().store_path
+        if os.path.exists(file_path):
+            return load_object(file_path)
+        return cls(FeatureStoreConfig(store_path=file_path))
@@ -2,8 +2,8 @@ import os
 import sys
 from sklearn.multiclass import OneVsRestClassifier
 from src.utils import save_object, evaluate_models
-from src.logger import logging
-from src.exception import CustomException
+from src.logger import get_logger
+from src.exception import ModelError
 from dataclasses import dataclass
 
 from sklearn.ensemble import RandomForestClassifier
@@ -14,6 +14,8 @@ from xgboost import XGBClassifier
 
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
 
+logger = get_logger('training')
+
 
 @dataclass
 class ModelTrainerConfig:
@@ -25,7 +27,7 @@ class ModelTrainer:
 
     def initiate_model_trainer(self, X_train, X_test, y_train, y_test):
         try:
-            logging.info("Starting model training")
+            logger.info("Starting model training")
 
             # define models
             models = {
@@ -70,7 +72,7 @@ class ModelTrainer:
                                            models=models,
                                            param=params)
             
-            logging.info(f"Model evaluation report: {model_report}")
+            logger.info(f"Model evaluation report: {model_report}")
             
             # Extract all accuracy scores
             accuracy_scores = {
@@ -86,9 +88,9 @@ class ModelTrainer:
             best_model = models[best_model_name]
 
             if best_model_score < 0.6:
-                raise CustomException("No best model found")
+                raise ModelError("No best model found")
             
-            logging.info(f"Best model: {best_model_name} with accuracy: {best_model_score}")
+            logger.info(f"Best model: {best_model_name} with accuracy: {best_model_score}")
 
             #save the model
             save_object(
@@ -99,14 +101,14 @@ class ModelTrainer:
             y_pred = best_model.predict(X_test)
             accuracy = accuracy_score(y_test, y_pred)
 
-            logging.info(f"\nClassification Report:\n {classification_report(y_test, y_pred)}")
-            logging.info(f"\nConfusion Matrix:\n{confusion_matrix(y_test, y_pred)}")
+            logger.info(f"\nClassification Report:\n {classification_report(y_test, y_pred)}")
+            logger.info(f"\nConfusion Matrix:\n{confusion_matrix(y_test, y_pred)}")
 
             return accuracy, best_model_name
 
 
         except Exception as e:
-            raise CustomException(e, sys)
+            raise ModelError(e, sys)
         
         
 
@@ -0,0 +1,263 @@
+"""
+Mergeable KLL quantile sketches and per-database metric baselines.
+
+A KLLSketch keeps a bounded number of samples (about 3 * k) in levels of
+compactors, each sample on level h standing for 2**h values, so its size does
+not grow with the number of values seen. Sketches of the same metric merge
+into a sketch of the union, e.g. the shards of a parallel backfill.
+
+MetricBaselineStore keeps one sketch per flattened metric and per
+(db_name, instance, hour of week), plus one per (db_name, instance) over all
+hours as the fallback for hours with little history. Only normal reports feed
+it, so percentile() answers "where does this value fall among this instance's
+normal reports at this hour of the week".
+"""
+import bisect
+import math
+import os
+import random
+import sys
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from src.components.report_schema import FLAT_COLUMNS, STRING_COLUMNS
+from src.exception import CustomException
+from src.utils import save_object, load_object
+
+# every numeric flattened metric gets a baseline
+BASELINE_METRICS = [column for column in FLAT_COLUMNS if column not in STRING_COLUMNS]
+
+# anomaly_type / status values that count as normal
+NORMAL_LABELS = ('NORMAL', 'NONE')
+
+
+class KLLSketch:
+    def __init__(self, k=128):
+        self.k = k
+        self.levels = [[]]
+        self.count = 0
+        # sorted (values, cumulative weights) view, rebuilt on the first query after an update
+        self._sorted = None
+
+    def _capacity(self, level):
+        # lower levels hold fewer samples, capacities shrink by 2/3 per level below the top
+        return max(int(math.ceil(self.k * (2 / 3) ** (len(self.levels) - level - 1))), 2)
+
+    def _compress(self):
+        while sum(len(level) for level in self.levels) > sum(self._capacity(h) for h in range(len(self.levels))):
+            for h, level in enumerate(self.levels):
+                if len(level) >= self._capacity(h):
+                    if h + 1 == len(self.levels):
+                        self.levels.append([])
+                    level.sort()
+                    # every other sample moves up with twice the weight, an odd one out stays
+                    keep = [level.pop()] if len(level) % 2 else []
+                    offset = random.getrandbits(1)
+                    self.levels[h + 1].extend(level[offset::2])
+                    self.levels[h] = keep
+                    break
+
+    def update(self, value):
+        if value is None or value != value:
+            return
+        self.levels[0].append(float(value))
+        self.count += 1
+        self._sorted = None
+        if len(self.levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def update_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.levels[0].extend(values.tolist())
+        self.count += len(values)
+        self._sorted = None
+        self._compress()
+
+    def merge(self, other):
+        """ adds every value summarised by another sketch to this one"""
+        for h, level in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append([])
+            self.levels[h].extend(level)
+        self.count += other.count
+        self._sorted = None
+        self._compress()
+        return self
+
+    def _sorted_view(self):
+        if self._sorted is None:
+            values = np.concatenate([np.asarray(level, dtype=np.float64) for level in self.levels])
+            weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+            order = np.argsort(values, kind='stable')
+            self._sorted = (values[order].tolist(), np.cumsum(weights[order]).tolist())
+        return self._sorted
+
+    def rank(self, value):
+        """ approximate share of the values seen that are <= value"""
+        if not self.count:
+            return float('nan')
+        values, cumulative = self._sorted_view()
+        position = bisect.bisect_right(values, value)
+        return cumulative[position - 1] / cumulative[-1] if position else 0.0
+
+    def quantile(self, q):
+        if not self.count:
+            return float('nan')
+        values, cumulative = self._sorted_view()
+        position = bisect.bisect_left(cumulative, q * cumulative[-1])
+        return values[min(position, len(values) - 1)]
+
+    def __len__(self):
+        return sum(len(level) for level in self.levels)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_sorted'] = None
+        return state
+
+
+@dataclass
+class MetricBaselineConfig:
+    store_path: str = os.path.join('artifacts', 'metric_baselines.pkl')
+    k: int = 128
+    # hours of the week with fewer normal reports fall back to the instance's all-hours sketch
+    min_hour_count: int = 8
+
+
+def hour_of_week(start_time):
+    try:
+        start_time = pd.Timestamp(start_time)
+    except (ValueError, TypeError):
+        return None
+    if pd.isna(start_time):
+        return None
+    return int(start_time.dayofweek * 24 + start_time.hour)
+
+
+class MetricBaselineStore:
+    def __init__(self, config=None):
+        self.config = config or MetricBaselineConfig()
+        self.metrics = list(BASELINE_METRICS)
+        # (db_name, instance, hour of week or None for all hours) -> {metric: KLLSketch}
+        self.sketches = {}
+
+    def _sketches(self, key):
+        sketches = self.sketches.get(key)
+        if sketches is None:
+            sketches = {metric: KLLSketch(self.config.k) for metric in self.metrics}
+            self.sketches[key] = sketches
+        return sketches
+
+    @staticmethod
+    def _instance(row):
+        return (str(row.get('db_name')), str(row.get('instance')))
+
+    @staticmethod
+    def is_normal(row):
+        """ unlabelled reports count as normal, labelled ones only with a normal label"""
+        label = row.get('anomaly_type')
+        return label is None or label != label or label in NORMAL_LABELS
+
+    def update(self, row, normal=None):
+        """ adds a flattened report to its baselines if it is normal (by its label unless `normal` is given)"""
+        try:
+            if not (self.is_normal(row) if normal is None else normal):
+                return False
+            instance = self._instance(row)
+            keys = [(*instance, None)]
+            hour = hour_of_week(row.get('start_time'))
+            if hour is not None:
+                keys.append((*instance, hour))
+            for key in keys:
+                for metric, sketch in self._sketches(key).items():
+                    sketch.update(row.get(metric))
+            return True
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def update_frame(self, df):
+        """ adds the normal reports of a frame of flattened reports, one batch per sketch"""
+        try:
+            labels = df['anomaly_type'] if 'anomaly_type' in df else pd.Series(None, index=df.index)
+            df = df[labels.isna() | labels.isin(NORMAL_LABELS)]
+            if df.empty:
+                return 0
+            start_time = pd.to_datetime(df['start_time'], errors='coerce')
+            hours = (start_time.dt.dayofweek * 24 + start_time.dt.hour).astype('Int64')
+            instance_keys = list(zip(df['db_name'].astype(str), df['instance'].astype(str)))
+
+            groups = {}
+            for position, (instance, hour) in enumerate(zip(instance_keys, hours)):
+                groups.setdefault((*instance, None), []).append(position)
+                if not pd.isna(hour):
+                    groups.setdefault((*instance, int(hour)), []).append(position)
+
+            values = df.reindex(columns=self.metrics).to_numpy(dtype=np.float64, na_value=np.nan)
+            for key, positions in groups.items():
+                group_values = values[positions]
+                for i, sketch in enumerate(self._sketches(key).values()):
+                    sketch.update_many(group_values[:, i])
+            return len(df)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def sketch(self, db_name, instance, metric, hour=None):
+        """ the hour-of-week sketch, or the all-hours one when that hour has too little history"""
+        instance_key = (str(db_name), str(instance))
+        if hour is not None:
+            sketches = self.sketches.get((*instance_key, hour))
+            if sketches is not None and sketches[metric].count >= self.config.min_hour_count:
+                return sketches[metric]
+        sketches = self.sketches.get((*instance_key, None))
+        return None if sketches is None else sketches[metric]
+
+    def _percentile(self, row, metric, value, hour):
+        sketch = self.sketch(row.get('db_name'), row.get('instance'), metric, hour)
+        if sketch is None or value is None or value != value:
+            return float('nan')
+        return 100.0 * sketch.rank(float(value))
+
+    def percentile(self, row, metric, value=None):
+        """ percentile (0-100) of the row's value (or `value`) among normal reports of its instance and hour"""
+        try:
+            value = row.get(metric) if value is None else value
+            return self._percentile(row, metric, value, hour_of_week(row.get('start_time')))
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def percentiles(self, row):
+        """ {metric: percentile of normal} for every metric of a flattened report"""
+        try:
+            hour = hour_of_week(row.get('start_time'))
+            return {metric: self._percentile(row, metric, row.get(metric), hour) for metric in self.metrics}
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def merge(self, other):
+        """ folds another store (e.g. from a parallel shard) into this one"""
+        try:
+            for key, sketches in other.sketches.items():
+                own = self._sketches(key)
+                for metric, sketch in sketches.items():
+                    own[metric].merge(sketch)
+            return self
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def save(self, file_path=None):
+        save_object(file_path or self.config.store_path, self)
+
+    @classmethod
+    def load_or_create(cls, file_path=None):
+        file_path = file_path or MetricBaselineConfig().store_path
+        if os.path.exists(file_path):
+            return load_object(file_path)
+        return cls(MetricBaselineConfig(store_path=file_path))
@@ -0,0 +1,234 @@
+"""
+Report-to-report diff for regression triage.
+
+Every parsed metric section of a report (Load Profile, Instance Efficiency,
+Time Model, Memory, OS, top events, tablespace I/O and segments; top SQL is
+served by the SQL_ID index) is turned into one series of numeric metrics
+keyed "section|item|column" (for example "top_events|log file sync|Time_s").
+Two reports, or a report and a baseline aggregated from many, are aligned on
+those keys and the metrics are ranked by their relative change. An item that
+is in the top list of only one of the reports (an event, segment or tablespace)
+counts as 0 in the other one; such items are listed after the changed metrics,
+ranked by their share of the section in the report that has them.
+
+Metric series are cached in memory and on disk by report content hash, so
+comparing one report with hundreds of candidates only parses each file once.
+
+    python -m src.components.report_diff bad.html last_week.html
+    python -m src.components.report_diff bad.html ref1.html ref2.html ...   (median baseline)
+"""
+import argparse
+import hashlib
+import os
+import pickle
+import sys
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from src.components.awr_parser import AWRParser
+from src.exception import CustomException
+from src.utils import file_checksum
+
+# parsed section -> columns identifying one row of it
+DIFF_KEYS = {
+    'load_profile': ('Metric',),
+    'instance_efficiency': ('Metric',),
+    'time_model': ('Statistic',),
+    'memory_stats': ('Metric',),
+    'os_stats': ('Metric',),
+    'top_events': ('Event',),
+    'tablespace_io': ('Tablespace',),
+    'segments': ('Owner', 'Object_Name'),
+}
+
+# sections listing only the top items, whose values of one column share a unit
+TOP_LIST_SECTIONS = ('top_events', 'tablespace_io', 'segments')
+
+# numeric header fields compared as well
+HEADER_METRICS = ('elapsed_min', 'db_time_min')
+
+# cached metric series are only valid for the keys they were extracted with
+_METRICS_VERSION = hashlib.sha1(repr((DIFF_KEYS, HEADER_METRICS)).encode()).hexdigest()[:8]
+
+
+@dataclass
+class ReportDiffConfig:
+    cache_dir: str = os.path.join('artifacts', 'report_metrics')
+    top_n: int = 20
+    # changes smaller than this in absolute terms are noise
+    min_abs_change: float = 1e-6
+    # a metric counts as changed in rank_candidates above this relative change
+    changed_threshold: float = 0.5
+
+
+def report_metrics(report_data):
+    """ all numeric values of a parsed report as one series keyed 'section|item|column'"""
+    metrics = {}
+    for column in HEADER_METRICS:
+        if isinstance(report_data.get(column), (int, float)):
+            metrics[f"header||{column}"] = float(report_data[column])
+
+    for section, key_columns in DIFF_KEYS.items():
+        for row in report_data.get(section) or []:
+            item = '.'.join(str(row.get(column)) for column in key_columns)
+            for column, value in row.items():
+                if column not in key_columns and isinstance(value, (int, float)):
+                    metrics[f"{section}|{item}|{column}"] = float(value)
+    return pd.Series(metrics, dtype=np.float64)
+
+
+def relative_change(target, reference):
+    """ (target - reference) relative to their mean magnitude, bounded to [-2, 2] and 0 when both are 0"""
+    target = np.asarray(target, dtype=np.float64)
+    reference = np.asarray(reference, dtype=np.float64)
+    scale = (np.abs(target) + np.abs(reference)) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(scale > 0, (target - reference) / scale, 0.0)
+
+
+class ReportDiff:
+    def __init__(self, config=None, parser=None):
+        self.config = config or ReportDiffConfig()
+        self.parser = parser or AWRParser(sections=tuple(DIFF_KEYS))
+        self._metrics = {}
+
+    def metrics(self, report):
+        """ metric series of a report path, or the series itself when one is passed"""
+        try:
+            if isinstance(report, pd.Series):
+                return report
+
+            checksum = file_checksum(report)
+            metrics = self._metrics.get(checksum)
+            if metrics is not None:
+                return metrics
+
+            cache_path = os.path.join(self.config.cache_dir, f"{checksum}-{_METRICS_VERSION}.pkl") if self.config.cache_dir else None
+            if cache_path and os.path.exists(cache_path):
+                with open(cache_path, 'rb') as f:
+                    metrics = pickle.load(f)
+            else:
+                metrics = report_metrics(self.parser.parse_single_report(report))
+                if cache_path:
+                    os.makedirs(self.config.cache_dir, exist_ok=True)
+                    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                    with open(tmp_path, 'wb') as f:
+                        pickle.dump(metrics, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    os.replace(tmp_path, cache_path)
+
+            self._metrics[checksum] = metrics
+            return metrics
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def metrics_frame(self, reports, fill_value=0.0):
+        """ one row per report, one column per metric key; items missing from a report are fill_value"""
+        try:
+            names = [report.name if isinstance(report, pd.Series) else os.path.basename(report) for report in reports]
+            frame = pd.DataFrame([self.metrics(report) for report in reports])
+            frame.index = names
+            return frame if fill_value is None else frame.fillna(fill_value)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def baseline(self, reports, statistic='median'):
+        """
+        aggregate metric series of several reference reports, e.g. the same hour over past weeks.
+        items missing from more than half of them are left out, so diff lists them as new
+        """
+        try:
+            frame = self.metrics_frame(reports, fill_value=None)
+            baseline = frame.loc[:, frame.notna().mean() >= 0.5].fillna(0.0).agg(statistic)
+            baseline.name = f"{statistic} of {len(reports)} reports"
+            return baseline
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def diff(self, target, reference, top_n=None):
+        """
+        metrics of target vs reference (path or metric series). metrics in both reports come first,
+        largest relative change first, then up to top_n items found in only one of them
+        """
+        try:
+            target, reference = self.metrics(target), self.metrics(reference)
+            aligned = pd.concat([target.rename('target'), reference.rename('reference')], axis=1)
+            # new/gone by key, a metric both reports have that was or becomes 0 is a change
+            status = np.select([aligned['reference'].isna(), aligned['target'].isna()], ['new', 'gone'], 'changed')
+            aligned = aligned.fillna(0.0)
+            aligned['change'] = aligned['target'] - aligned['reference']
+            aligned['relative_change'] = relative_change(aligned['target'], aligned['reference'])
+
+            keys = aligned.index.to_series().str.split('|', n=2, expand=True)
+            aligned.insert(0, 'section', keys[0])
+            aligned.insert(1, 'item', keys[1])
+            aligned.insert(2, 'metric', keys[2])
+
+            # items in only one report saturate at +-2, so they are ranked on their own: top list
+            # items by the share of their column they hold in the report they appear in, then the rest
+            aligned.insert(3, 'status', status)
+            columns = [aligned['section'], aligned['metric']]
+            gone = aligned['status'] == 'gone'
+            present = aligned['target'].where(~gone, aligned['reference']).abs()
+            totals = aligned['target'].abs().groupby(columns).transform('sum').where(~gone, aligned['reference'].abs().groupby(columns).transform('sum'))
+            top_list = aligned['section'].isin(TOP_LIST_SECTIONS) & (aligned['status'] != 'changed')
+            aligned['share'] = (present / totals.where(totals > 0)).where(top_list)
+            aligned = aligned[aligned['change'].abs() > self.config.min_abs_change]
+
+            magnitude = aligned['relative_change'].abs().where(aligned['status'] == 'changed', aligned['share'])
+            order = np.lexsort((-magnitude.fillna(0.0).to_numpy(), (aligned['status'] != 'changed').to_numpy()))
+            aligned = aligned.iloc[order]
+            return aligned.groupby(aligned['status'] != 'changed', sort=False).head(top_n or self.config.top_n).reset_index(drop=True)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def rank_candidates(self, target, candidates):
+        """
+        compares one report with many in a single vectorised pass. one row per candidate with
+        the mean absolute relative change, the number of changed metrics and the metric that
+        changed most, closest candidate first
+        """
+        try:
+            frame = self.metrics_frame(candidates)
+            target = self.metrics(target)
+            columns = frame.columns.union(target.index)
+            frame = frame.reindex(columns=columns, fill_value=0.0)
+            changes = relative_change(target.reindex(columns, fill_value=0.0).to_numpy()[None, :], frame.to_numpy())
+            magnitudes = np.abs(changes)
+
+            ranking = pd.DataFrame({
+                'candidate': frame.index,
+                'mean_relative_change': magnitudes.mean(axis=1),
+                'changed_metrics': (magnitudes > self.config.changed_threshold).sum(axis=1),
+                'top_metric': columns[magnitudes.argmax(axis=1)],
+                'top_relative_change': changes[np.arange(len(changes)), magnitudes.argmax(axis=1)],
+            })
+            return ranking.sort_values('mean_relative_change').reset_index(drop=True)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.components.report_diff", description="Rank the largest changes between AWR reports")
+    parser.add_argument("target", help="AWR report to triage")
+    parser.add_argument("references", nargs="+", help="reference report, or several for a median baseline")
+    parser.add_argument("--top", type=int, default=ReportDiffConfig().top_n, help="number of changes to list")
+    parser.add_argument("--rank", action="store_true", help="rank the references by similarity instead of diffing against them")
+    args = parser.parse_args(argv)
+
+    report_diff = ReportDiff()
+    with pd.option_context('display.width', 200, 'display.max_colwidth', 60):
+        if args.rank:
+            print(report_diff.rank_candidates(args.target, args.references).to_string(index=False))
+        else:
+            reference = args.references[0] if len(args.references) == 1 else report_diff.baseline(args.references)
+            print(report_diff.diff(args.target, reference, top_n=args.top).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
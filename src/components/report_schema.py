@@ -0,0 +1,108 @@
+"""
+Schema of a flattened AWR report, shared by the parser and the batch flattener.
+"""
+
+# parsed section key -> <h2> title of that section in the AWR HTML
+SECTION_TITLES = {
+    'load_profile': 'Load Profile',
+    'instance_efficiency': 'Instance Efficiency (Target 100%)',
+    'top_events': 'Top Foreground Events by Wait Time',
+    'time_model': 'Time Model Statistics',
+    'memory_stats': 'Memory Statistics',
+    'os_stats': 'Operating System Statistics',
+    'tablespace_io': 'Tablespace I/O Stats',
+    'segments': 'Segments by Physical Reads',
+    'sql_stats': 'SQL ordered by Elapsed Time',
+}
+
+# header fields copied as is into the flattened report
+HEADER_COLUMNS = ['filename', 'db_name', 'db_id', 'instance', 'start_time', 'end_time', 'elapsed_min', 'db_time_min', 'anomaly_type']
+
+# (parsed section, row key column, value column, {row key: flattened column})
+SECTION_METRICS = [
+    ('load_profile', 'Metric', 'Per_Second', {
+        'DB Time(s)': 'db_time_per_sec',
+        'DB CPU(s)': 'db_cpu_per_sec',
+        'Redo size': 'redo_size_per_sec',
+        'Logical reads': 'logical_reads_per_sec',
+        'Physical reads': 'physical_reads_per_sec',
+        'Executes': 'executes_per_sec',
+        'Transactions': 'transactions_per_sec',
+    }),
+    ('instance_efficiency', 'Metric', 'Value', {
+        'Buffer Hit %': 'buffer_hit_pct',
+        'Library Hit %': 'library_hit_pct',
+        'Soft Parse %': 'soft_parse_pct',
+        'Latch Hit %': 'latch_hit_pct',
+    }),
+    ('time_model', 'Statistic', 'DB_Time', {
+        'parse time elapsed': 'parse_time_pct',
+        'hard parse elapsed time': 'hard_parse_pct',
+    }),
+    ('memory_stats', 'Metric', 'Value', {
+        'SGA Size (MB)': 'sga_size_mb',
+        'PGA Allocated (MB)': 'pga_allocated_mb',
+        'PGA Used (MB)': 'pga_used_mb',
+        'PGA Usage %': 'pga_usage_pct',
+        'Sorts in Memory': 'sorts_memory',
+        'Sorts on Disk': 'sorts_disk',
+    }),
+    ('os_stats', 'Metric', 'Value', {
+        'OS CPU Usage %': 'os_cpu_usage_pct',
+        'Load Average': 'load_average',
+        'Physical Memory (GB)': 'physical_memory_gb',
+        'Num CPUs': 'num_cpus',
+    }),
+]
+
+TOP_EVENT_COUNT = 3
+
+# parsed table columns (after header cleaning) kept as text instead of being read as numbers
+TEXT_COLUMNS = {'SQL_Text', 'Object_Name', 'Object_Type'}
+
+# fixed schema of a flattened report, this is also the column order of awr_metrics.csv
+FLAT_COLUMNS = [
+    'filename', 'db_name', 'db_id', 'instance', 'start_time', 'end_time', 'elapsed_min', 'db_time_min', 'anomaly_type',
+    'db_time_per_sec', 'db_cpu_per_sec', 'redo_size_per_sec', 'logical_reads_per_sec', 'physical_reads_per_sec', 'executes_per_sec', 'transactions_per_sec',
+    'buffer_hit_pct', 'library_hit_pct', 'soft_parse_pct', 'latch_hit_pct',
+    'top_event_1_name', 'top_event_1_time_sec', 'top_event_1_avg_ms',
+    'top_event_2_name', 'top_event_2_time_sec', 'top_event_2_avg_ms',
+    'top_event_3_name', 'top_event_3_time_sec', 'top_event_3_avg_ms',
+    'parse_time_pct', 'hard_parse_pct',
+    'sga_size_mb', 'pga_allocated_mb', 'pga_used_mb', 'pga_usage_pct', 'sorts_memory', 'sorts_disk',
+    'os_cpu_usage_pct', 'load_average', 'physical_memory_gb', 'num_cpus',
+    'cpu_pct_of_db_time', 'physical_to_logical_ratio',
+]
+
+# flattened columns holding strings, everything else is numeric
+STRING_COLUMNS = ['filename', 'db_name', 'db_id', 'instance', 'start_time', 'end_time', 'anomaly_type', 'top_event_1_name', 'top_event_2_name', 'top_event_3_name']
+
+# every parsed section, plus the report type label
+ALL_SECTIONS = tuple(SECTION_TITLES) + ('anomaly_type',)
+
+# flattened columns computed from other flattened columns
+DERIVED_COLUMNS = {
+    'cpu_pct_of_db_time': ('db_time_per_sec', 'db_cpu_per_sec'),
+    'physical_to_logical_ratio': ('physical_reads_per_sec', 'logical_reads_per_sec'),
+}
+
+
+def required_sections(columns):
+    """
+    parsed sections needed to fill the given flattened columns. engineered names that are
+    not flattened columns (time encodings) come from the header, which is always parsed
+    """
+    column_sections = {'anomaly_type': 'anomaly_type'}
+    for section, _, _, metric_columns in SECTION_METRICS:
+        for column in metric_columns.values():
+            column_sections[column] = section
+    for idx in range(1, TOP_EVENT_COUNT + 1):
+        for suffix in ('name', 'time_sec', 'avg_ms'):
+            column_sections[f'top_event_{idx}_{suffix}'] = 'top_events'
+
+    sections = set()
+    for column in columns:
+        for source in DERIVED_COLUMNS.get(column, (column,)):
+            if source in column_sections:
+                sections.add(column_sections[source])
+    return tuple(section for section in ALL_SECTIONS if section in sections)
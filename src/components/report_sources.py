@@ -0,0 +1,196 @@
+"""
+Locates AWR reports in directories, compressed files and archives.
+
+Plain `.html` files, single compressed reports (`.html.gz`, `.html.bz2`,
+`.html.xz`, `.html.zst`) and members of `.zip` / `.tar.*` archives are all
+exposed as ReportSource objects. Content is decompressed as a stream straight
+from the archive, nothing is extracted to disk. zstd needs the optional
+`zstandard` package.
+
+An archive that cannot be opened or read to the end is yielded as one failed
+source named after the archive: opening it raises the archive's error, so the
+caller records a failure and moves on to the next file.
+"""
+import bz2
+import codecs
+import gzip
+import io
+import lzma
+import os
+import tarfile
+import zipfile
+from dataclasses import dataclass
+from typing import Callable
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+REPORT_SUFFIXES = ('.html', '.htm')
+COMPRESSION_SUFFIXES = ('.gz', '.bz2', '.xz', '.zst')
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz', '.tar.zst')
+
+
+def _strip_compression_suffix(name):
+    for suffix in COMPRESSION_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def is_report_name(name):
+    """ true for plain or single-file compressed AWR reports"""
+    return _strip_compression_suffix(name.lower()).endswith(REPORT_SUFFIXES)
+
+
+def is_archive_name(name):
+    name = name.lower()
+    return name.endswith('.zip') or name.endswith(TAR_SUFFIXES)
+
+
+def _zstd_reader(raw):
+    if zstandard is None:
+        raise ImportError("reading .zst reports requires the 'zstandard' package")
+    return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+
+
+def decompressing_reader(raw, name):
+    """ wraps a binary stream so it yields decompressed bytes according to the file name"""
+    lowered = name.lower()
+    if lowered.endswith('.gz'):
+        return gzip.GzipFile(fileobj=raw)
+    if lowered.endswith('.bz2'):
+        return bz2.BZ2File(raw)
+    if lowered.endswith('.xz'):
+        return lzma.LZMAFile(raw)
+    if lowered.endswith('.zst'):
+        return _zstd_reader(raw)
+    return raw
+
+
+def open_report(filepath):
+    """ opens a plain or compressed report file as a decompressed binary stream"""
+    lowered = filepath.lower()
+    if lowered.endswith('.gz'):
+        return gzip.open(filepath, 'rb')
+    if lowered.endswith('.bz2'):
+        return bz2.open(filepath, 'rb')
+    if lowered.endswith('.xz'):
+        return lzma.open(filepath, 'rb')
+    if lowered.endswith('.zst'):
+        return _zstd_reader(open(filepath, 'rb'))
+    return open(filepath, 'rb')
+
+
+def open_report_text(filepath):
+    return io.TextIOWrapper(open_report(filepath), encoding='utf-8')
+
+
+@dataclass
+class ReportSource:
+    # unique name of the report, `archive.zip:member.html` for archive members
+    name: str
+    open: Callable
+    # archive members can only be read before the iterator moves on to the next file
+    sequential: bool = False
+
+    def read_bytes(self):
+        with self.open() as stream:
+            return stream.read()
+
+    def open_text(self):
+        # codecs reader decodes incrementally and, unlike TextIOWrapper, works on non-seekable tar streams
+        return codecs.getreader('utf-8')(self.open())
+
+
+def _file_source(path):
+    return ReportSource(name=os.path.basename(path), open=lambda: open_report(path))
+
+
+def _failed_source(path, error):
+    """ stands in for an unreadable archive, opening it raises the archive's error"""
+    def open_failed():
+        raise error
+    return ReportSource(name=os.path.basename(path), open=open_failed)
+
+
+def _zip_sources(path):
+    try:
+        archive = zipfile.ZipFile(path)
+    except Exception as e:
+        yield _failed_source(path, e)
+        return
+    with archive:
+        for member in archive.infolist():
+            if member.is_dir() or not is_report_name(member.filename):
+                continue
+            yield ReportSource(
+                name=f"{os.path.basename(path)}:{member.filename}",
+                open=lambda member=member: decompressing_reader(archive.open(member), member.filename),
+                sequential=True,
+            )
+
+
+def _tar_sources(path):
+    lowered = path.lower()
+    try:
+        # closed even when the consumer stops early or raises, which closes this generator
+        with open(path, 'rb') as raw:
+            if lowered.endswith('.tar.zst'):
+                fileobj = _zstd_reader(raw)
+            else:
+                fileobj = decompressing_reader(raw, lowered.replace('.tgz', '.tar.gz'))
+            try:
+                # stream mode reads the archive front to back without seeking or extracting
+                with tarfile.open(fileobj=fileobj, mode='r|') as archive:
+                    for member in archive:
+                        if not member.isfile() or not is_report_name(member.name):
+                            continue
+                        stream = archive.extractfile(member)
+                        yield ReportSource(
+                            name=f"{os.path.basename(path)}:{member.name}",
+                            open=lambda stream=stream, member=member: decompressing_reader(stream, member.name),
+                            sequential=True,
+                        )
+            finally:
+                fileobj.close()
+    except Exception as e:
+        # members yielded before a corrupt or truncated part are kept
+        yield _failed_source(path, e)
+
+
+def _scan_paths(directory, recursive=False, sort=False):
+    """ file paths of a directory as the scan returns them, subdirectories after the files when recursive"""
+    subdirectories = []
+    with os.scandir(directory) as entries:
+        if sort:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        for entry in entries:
+            if entry.is_dir():
+                if recursive:
+                    subdirectories.append(entry.path)
+            else:
+                yield entry.path
+    for subdirectory in sorted(subdirectories) if sort else subdirectories:
+        yield from _scan_paths(subdirectory, recursive, sort)
+
+
+def iter_report_sources(input_path, recursive=False, sort=False):
+    """
+    lazily yields a ReportSource for every report in a directory, report file or archive.
+    directories are streamed in scan order, sort=True lists each one in name order first
+    """
+    if os.path.isdir(input_path):
+        paths = _scan_paths(input_path, recursive, sort)
+    else:
+        paths = iter([input_path])
+
+    for path in paths:
+        name = os.path.basename(path).lower()
+        if name.endswith('.zip'):
+            yield from _zip_sources(path)
+        elif name.endswith(TAR_SUFFIXES):
+            yield from _tar_sources(path)
+        elif is_report_name(name) and os.path.isfile(path):
+            yield _file_source(path)
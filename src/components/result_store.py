@@ -0,0 +1,131 @@
+"""
+Embedded SQLite store for prediction results.
+
+Every scored report is kept with its label, score, feature vector hash, model
+version, report period and, for reports scored by the watcher, the latency
+from the report landing to its verdict. The table is indexed on (db_name, instance,
+start_time) so history and trend queries never need the HTML again. WAL mode
+lets the Streamlit apps read while a watcher or backfill is writing.
+"""
+import os
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass
+import pandas as pd
+from src.exception import CustomException
+from src.utils import normalise_time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS report_scores (
+    id INTEGER PRIMARY KEY,
+    filename TEXT,
+    db_name TEXT,
+    db_id TEXT,
+    instance TEXT,
+    start_time TEXT,
+    end_time TEXT,
+    pipeline TEXT NOT NULL,
+    label TEXT,
+    score REAL,
+    feature_hash TEXT,
+    model_version TEXT,
+    scored_at REAL NOT NULL,
+    latency_ms REAL
+);
+CREATE INDEX IF NOT EXISTS idx_report_scores_instance_time ON report_scores (db_name, instance, start_time);
+"""
+
+_COLUMNS = ['filename', 'db_name', 'db_id', 'instance', 'start_time', 'end_time', 'pipeline', 'label', 'score', 'feature_hash', 'model_version', 'scored_at', 'latency_ms']
+
+# columns added after the first release, stores created before get them on open
+_ADDED_COLUMNS = {'latency_ms': 'REAL'}
+
+
+@dataclass
+class ResultStoreConfig:
+    db_path: str = os.path.join('data', 'awr_results.db')
+
+
+class ResultStore:
+    def __init__(self, db_path=None):
+        self.db_path = db_path or ResultStoreConfig().db_path
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(_SCHEMA)
+        existing = {row[1] for row in self.connection.execute("PRAGMA table_info(report_scores)")}
+        with self.connection:
+            for column, column_type in _ADDED_COLUMNS.items():
+                if column not in existing:
+                    self.connection.execute(f"ALTER TABLE report_scores ADD COLUMN {column} {column_type}")
+
+    def record(self, results, pipeline='unsupervised'):
+        """ appends prediction result dicts from either prediction pipeline"""
+        try:
+            scored_at = time.time()
+            rows = []
+            for result in results:
+                # unsupervised results carry status/anomaly_score, supervised ones anomaly_type/confidence
+                label = result.get('status', result.get('anomaly_type'))
+                score = result.get('anomaly_score', result.get('confidence'))
+                rows.append((
+                    result.get('filename'),
+                    result.get('db_name'),
+                    None if result.get('db_id') is None else str(result.get('db_id')),
+                    None if result.get('instance') is None else str(result.get('instance')),
+                    normalise_time(result.get('start_time')),
+                    normalise_time(result.get('end_time')),
+                    pipeline,
+                    label,
+                    score,
+                    result.get('feature_hash'),
+                    result.get('model_version'),
+                    result.get('scored_at', scored_at),
+                    result.get('latency_ms'),
+                ))
+            with self.connection:
+                self.connection.executemany(
+                    f"INSERT INTO report_scores ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                    rows
+                )
+            return len(rows)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def history(self, db_name, instance=None, start=None, end=None, pipeline=None):
+        """ scores of one database (optionally one instance) ordered by report start time"""
+        try:
+            clauses, params = ["db_name = ?"], [db_name]
+            if instance is not None:
+                clauses.append("instance = ?")
+                params.append(str(instance))
+            if start is not None:
+                clauses.append("start_time >= ?")
+                params.append(normalise_time(start))
+            if end is not None:
+                clauses.append("start_time < ?")
+                params.append(normalise_time(end))
+            if pipeline is not None:
+                clauses.append("pipeline = ?")
+                params.append(pipeline)
+
+            query = f"SELECT {', '.join(_COLUMNS)} FROM report_scores WHERE {' AND '.join(clauses)} ORDER BY instance, start_time"
+            return pd.read_sql_query(query, self.connection, params=params)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
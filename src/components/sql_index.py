@@ -0,0 +1,252 @@
+"""
+Cross-report index over "SQL ordered by Elapsed Time".
+
+Every SQL_ID found in a report's top SQL list is recorded in SQLite with the
+report, database, instance, snapshot period, elapsed and CPU seconds and
+executions. SQL text is stored once per distinct text and referenced by id.
+The index is filled while parsing (parse_all_reports(sql_index=...)) or
+backfilled from an archive, after which every appearance of one SQL_ID is an
+indexed lookup instead of a re-parse of the HTML.
+
+    python -m src.components.sql_index --build data/raw_awr_reports
+    python -m src.components.sql_index 26343e5a [--db PROD_ERP_120]
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+from dataclasses import dataclass
+import pandas as pd
+from src.exception import CustomException, ReportParseError
+from src.logger import get_logger
+from src.utils import normalise_time
+
+logger = get_logger('parser')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sql_texts (
+    text_id INTEGER PRIMARY KEY,
+    text_hash TEXT NOT NULL UNIQUE,
+    sql_text TEXT
+);
+CREATE TABLE IF NOT EXISTS sql_reports (
+    report_id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    db_name TEXT,
+    db_id TEXT,
+    instance TEXT,
+    start_time TEXT,
+    end_time TEXT
+);
+CREATE TABLE IF NOT EXISTS sql_occurrences (
+    sql_id TEXT NOT NULL,
+    report_id INTEGER NOT NULL REFERENCES sql_reports (report_id),
+    rank INTEGER,
+    elapsed_s REAL,
+    cpu_s REAL,
+    execs REAL,
+    text_id INTEGER REFERENCES sql_texts (text_id)
+);
+CREATE INDEX IF NOT EXISTS idx_sql_occurrences_sql_id ON sql_occurrences (sql_id, report_id);
+CREATE INDEX IF NOT EXISTS idx_sql_occurrences_report ON sql_occurrences (report_id);
+"""
+
+@dataclass
+class SqlIndexConfig:
+    db_path: str = os.path.join('data', 'awr_sql_index.db')
+
+
+def _as_text(value):
+    return None if value is None else str(value)
+
+
+class SqlIndex:
+    def __init__(self, db_path=None):
+        self.db_path = db_path or SqlIndexConfig().db_path
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(_SCHEMA)
+        # sha1 of a sql text -> text_id, the same statement appears in thousands of reports
+        self._text_ids = {}
+
+    def _text_id(self, sql_text):
+        if sql_text is None:
+            return None
+        text_hash = hashlib.sha1(sql_text.encode('utf-8')).hexdigest()
+        text_id = self._text_ids.get(text_hash)
+        if text_id is None:
+            self.connection.execute("INSERT OR IGNORE INTO sql_texts (text_hash, sql_text) VALUES (?, ?)", (text_hash, sql_text))
+            text_id = self.connection.execute("SELECT text_id FROM sql_texts WHERE text_hash = ?", (text_hash,)).fetchone()[0]
+            self._text_ids[text_hash] = text_id
+        return text_id
+
+    def _add_report(self, report_data):
+        filename = report_data.get('filename')
+        existing = self.connection.execute("SELECT report_id FROM sql_reports WHERE filename = ?", (filename,)).fetchone()
+        if existing is not None:
+            # a re-parsed report replaces what was indexed for it before
+            self.connection.execute("DELETE FROM sql_occurrences WHERE report_id = ?", existing)
+            self.connection.execute("DELETE FROM sql_reports WHERE report_id = ?", existing)
+
+        report_id = self.connection.execute(
+            "INSERT INTO sql_reports (filename, db_name, db_id, instance, start_time, end_time) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                filename,
+                report_data.get('db_name'),
+                _as_text(report_data.get('db_id')),
+                _as_text(report_data.get('instance')),
+                normalise_time(report_data.get('start_time')),
+                normalise_time(report_data.get('end_time')),
+            )
+        ).lastrowid
+
+        occurrences = []
+        for rank, row in enumerate(report_data.get('sql_stats') or [], 1):
+            if not row.get('SQL_ID'):
+                continue
+            occurrences.append((
+                row['SQL_ID'],
+                report_id,
+                rank,
+                row.get('Elapsed_s'),
+                row.get('CPU_s'),
+                row.get('Execs'),
+                self._text_id(row.get('SQL_Text')),
+            ))
+        self.connection.executemany(
+            "INSERT INTO sql_occurrences (sql_id, report_id, rank, elapsed_s, cpu_s, execs, text_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            occurrences
+        )
+        return len(occurrences)
+
+    def add_reports(self, reports):
+        """ indexes the top SQL of parsed (not flattened) reports in one transaction"""
+        try:
+            with self.connection:
+                return sum(self._add_report(report_data) for report_data in reports)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def indexed_filenames(self):
+        try:
+            return {row[0] for row in self.connection.execute("SELECT filename FROM sql_reports")}
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def lookup(self, sql_id, db_name=None, start=None, end=None):
+        """ every report period the SQL_ID was in the top SQL list of, ordered by start time"""
+        try:
+            clauses, params = ["o.sql_id = ?"], [sql_id]
+            if db_name is not None:
+                clauses.append("r.db_name = ?")
+                params.append(db_name)
+            if start is not None:
+                clauses.append("r.start_time >= ?")
+                params.append(normalise_time(start))
+            if end is not None:
+                clauses.append("r.start_time < ?")
+                params.append(normalise_time(end))
+
+            query = f"""
+                SELECT o.sql_id, r.filename, r.db_name, r.db_id, r.instance, r.start_time, r.end_time,
+                       o.rank, o.elapsed_s, o.cpu_s, o.execs, t.sql_text
+                FROM sql_occurrences o
+                JOIN sql_reports r ON r.report_id = o.report_id
+                LEFT JOIN sql_texts t ON t.text_id = o.text_id
+                WHERE {' AND '.join(clauses)}
+                ORDER BY r.start_time, r.db_name, r.instance
+            """
+            return pd.read_sql_query(query, self.connection, params=params)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def top_sql(self, db_name=None, limit=20):
+        """ SQL_IDs by total elapsed seconds over all indexed reports"""
+        try:
+            where, params = "", []
+            if db_name is not None:
+                where, params = "WHERE r.db_name = ?", [db_name]
+            query = f"""
+                SELECT o.sql_id, COUNT(*) AS reports, COUNT(DISTINCT r.db_name) AS databases,
+                       SUM(o.elapsed_s) AS elapsed_s, SUM(o.cpu_s) AS cpu_s, SUM(o.execs) AS execs
+                FROM sql_occurrences o
+                JOIN sql_reports r ON r.report_id = o.report_id
+                {where}
+                GROUP BY o.sql_id
+                ORDER BY elapsed_s DESC
+                LIMIT ?
+            """
+            return pd.read_sql_query(query, self.connection, params=[*params, limit])
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def build(self, input_dir, batch_size=500, recursive=False):
+        """ backfills the index from an archive of reports, parsing only the header and the top SQL"""
+        try:
+            from src.components.awr_parser import AWRParser
+            from src.components.report_sources import iter_report_sources
+
+            parser = AWRParser(sections=('sql_stats',))
+            indexed = self.indexed_filenames()
+            batch, added = [], 0
+            for source in iter_report_sources(input_dir, recursive=recursive):
+                if source.name in indexed:
+                    continue
+                try:
+                    with source.open_text() as stream:
+                        batch.append(parser.parse_report_content(stream, filename=source.name))
+                except Exception as e:
+                    logger.error("failed to index %s: %s", source.name, ReportParseError(e, sys, source=source.name).error)
+                    continue
+                if len(batch) >= batch_size:
+                    self.add_reports(batch)
+                    added, batch = added + len(batch), []
+            if batch:
+                self.add_reports(batch)
+                added += len(batch)
+            logger.info(f"indexed top SQL of {added} reports into {self.db_path}")
+            return added
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.components.sql_index", description="Index and look up SQL_IDs across AWR reports")
+    parser.add_argument("sql_id", nargs="?", help="SQL_ID to look up")
+    parser.add_argument("--build", metavar="INPUT_DIR", help="index the reports of a directory or archive first")
+    parser.add_argument("--db", help="only reports of this database")
+    parser.add_argument("--index", default=SqlIndexConfig().db_path, help="index database path")
+    args = parser.parse_args(argv)
+
+    with SqlIndex(args.index) as index:
+        if args.build:
+            index.build(args.build)
+        if args.sql_id:
+            print(index.lookup(args.sql_id, db_name=args.db).to_string(index=False))
+        elif not args.build:
+            print(index.top_sql(db_name=args.db).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
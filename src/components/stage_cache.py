@@ -0,0 +1,96 @@
+"""
+Content-addressed cache for intermediate training outputs.
+
+A stage output is stored under a key derived from a fingerprint of its
+inputs, its configuration and the source file of the code computing it.
+Downstream stages chain the key of the stage they consume instead of hashing
+its (larger) output again. A rerun on unchanged data and settings therefore
+loads engineered features, the split, the balanced set and the fitted scaler
+from disk and goes straight to model fitting.
+"""
+import dataclasses
+import hashlib
+import inspect
+import json
+import os
+import sys
+from dataclasses import dataclass
+import dill
+import numpy as np
+import pandas as pd
+from src.exception import CustomException
+from src.logger import get_logger
+from src.utils import load_object
+
+logger = get_logger('training')
+
+
+@dataclass
+class StageCacheConfig:
+    cache_dir: str = os.path.join('artifacts', 'stage_cache')
+
+
+def _update(digest, part):
+    if isinstance(part, pd.DataFrame):
+        digest.update(repr((part.columns.tolist(), part.dtypes.tolist())).encode())
+        digest.update(pd.util.hash_pandas_object(part, index=True).to_numpy().tobytes())
+    elif isinstance(part, pd.Series):
+        digest.update(repr((part.name, part.dtype)).encode())
+        digest.update(pd.util.hash_pandas_object(part, index=True).to_numpy().tobytes())
+    elif isinstance(part, np.ndarray):
+        digest.update(f"{part.dtype}{part.shape}".encode())
+        if part.dtype == object:
+            digest.update(pd.util.hash_array(part.ravel()).tobytes())
+        else:
+            digest.update(np.ascontiguousarray(part).tobytes())
+    elif dataclasses.is_dataclass(part) and not isinstance(part, type):
+        digest.update(json.dumps(dataclasses.asdict(part), sort_keys=True, default=str).encode())
+    elif callable(part):
+        # any edit to the module computing the stage invalidates its cached outputs
+        digest.update(part.__qualname__.encode())
+        with open(inspect.getsourcefile(part), 'rb') as f:
+            digest.update(f.read())
+    else:
+        digest.update(repr(part).encode())
+    digest.update(b'\x00')
+
+
+def fingerprint(*parts):
+    """ sha256 over frames, arrays, config dataclasses, functions (by source) and plain values"""
+    digest = hashlib.sha256()
+    for part in parts:
+        _update(digest, part)
+    return digest.hexdigest()
+
+
+class StageCache:
+    def __init__(self, config=None):
+        self.config = config or StageCacheConfig()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, stage, *parts):
+        return f"{stage}-{fingerprint(stage, *parts)[:24]}"
+
+    def get_or_compute(self, key, compute):
+        """ the cached output stored under key, or compute() which is then stored"""
+        try:
+            path = os.path.join(self.config.cache_dir, f"{key}.pkl")
+            if os.path.exists(path):
+                self.hits += 1
+                logger.info(f"stage cache hit: {key}")
+                return load_object(path)
+
+            self.misses += 1
+            output = compute()
+            os.makedirs(self.config.cache_dir, exist_ok=True)
+            # written aside and renamed, an interrupted run never leaves a truncated entry
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                dill.dump(output, f)
+            os.replace(tmp_path, path)
+            logger.info(f"stage cache stored: {key}")
+            return output
+
+        except Exception as e:
+            raise CustomException(e, sys)
@@ -0,0 +1,195 @@
+"""
+Incremental CSV/Parquet output for long parsing runs.
+
+Row groups are written as numbered part files next to the output as soon as
+they are complete, and a manifest records the input being parsed and every
+committed part together with the reports it contains. After a crash, a new
+writer on the same output path and input picks up the manifest, so already
+committed reports can be skipped.
+finalize() merges the parts into the output with an atomic rename.
+Parquet output needs the optional `pyarrow` package.
+"""
+import json
+import os
+import shutil
+import sys
+from src.components.report_schema import FLAT_COLUMNS, STRING_COLUMNS
+from src.exception import CustomException
+from src.logger import get_logger
+
+_MANIFEST_NAME = 'manifest.jsonl'
+
+logger = get_logger('parser')
+
+
+def _parquet_schema():
+    """ fixed arrow schema for flattened reports so every row group has identical column types"""
+    import pyarrow as pa
+
+    fields = []
+    for column in FLAT_COLUMNS:
+        if column == 'filename':
+            fields.append(pa.field(column, pa.string()))
+        elif column in STRING_COLUMNS:
+            fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append(pa.field(column, pa.float64()))
+    return pa.schema(fields)
+
+
+def write_part(df, path, output_format):
+    """ writes one row group of flattened reports as a csv or parquet file"""
+    if output_format == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.Table.from_pandas(df, schema=_parquet_schema(), preserve_index=False), path)
+    else:
+        df.to_csv(path, index=False)
+
+
+class StreamingReportWriter:
+    def __init__(self, output_path, resume=True, input_path=None):
+        self.output_path = output_path
+        self.format = 'parquet' if output_path.endswith('.parquet') else 'csv'
+        self.parts_dir = f"{output_path}.parts"
+        self.manifest_path = os.path.join(self.parts_dir, _MANIFEST_NAME)
+        # reports being written, parts left behind by a run over other input are not resumed
+        self.input_path = os.path.abspath(input_path) if input_path is not None else None
+        self.parts = []
+        self.completed_sources = set()
+        self._next_part = 0
+
+        if resume and os.path.isdir(self.parts_dir) and self._load_manifest():
+            return
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+        os.makedirs(self.parts_dir, exist_ok=True)
+        self._append_manifest({'input': self.input_path})
+
+    def _read_manifest(self):
+        """ (header, committed entries, byte offset after the last complete line)"""
+        header, entries, good_size = None, [], 0
+        with open(self.manifest_path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a torn last line means that part was never committed
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                good_size += len(line)
+                if 'part' in entry:
+                    entries.append(entry)
+                else:
+                    header = entry
+        return header, entries, good_size
+
+    def _load_manifest(self):
+        """ picks up the committed parts of an interrupted run, False when the parts cannot be resumed"""
+        if not os.path.exists(self.manifest_path):
+            return False
+        header, entries, good_size = self._read_manifest()
+        if header is None or (self.input_path is not None and header.get('input') != self.input_path):
+            logger.warning(f"{self.parts_dir} was written from {(header or {}).get('input')}, not {self.input_path}, starting over")
+            return False
+
+        # appending after torn bytes would corrupt the next entry too
+        if good_size != os.path.getsize(self.manifest_path):
+            with open(self.manifest_path, 'r+b') as f:
+                f.truncate(good_size)
+                os.fsync(f.fileno())
+
+        for entry in entries:
+            self.parts.append(entry['part'])
+            self.completed_sources.update(entry['sources'])
+        self._next_part = 1 + max((int(part.split('-')[1].split('.')[0]) for part in self.parts), default=-1)
+
+        # only part files never listed in the manifest are leftovers of an uncommitted row group
+        committed = set(self.parts) | {_MANIFEST_NAME}
+        for name in os.listdir(self.parts_dir):
+            if name not in committed:
+                os.remove(os.path.join(self.parts_dir, name))
+        logger.info(f"resuming {self.output_path}: {len(self.parts)} row groups, {len(self.completed_sources)} reports already written")
+        return True
+
+    def _append_manifest(self, entry):
+        with open(self.manifest_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _commit_part(self, write, rows, sources):
+        """ write(tmp_path) produces the part file, which is renamed into place and then recorded in the manifest"""
+        part = f"part-{self._next_part:05d}.{self.format}"
+        part_path = os.path.join(self.parts_dir, part)
+        tmp_path = f"{part_path}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, part_path)
+
+        self._append_manifest({'part': part, 'rows': rows, 'sources': sources})
+        self._next_part += 1
+        self.parts.append(part)
+        self.completed_sources.update(sources)
+
+    def write_group(self, df):
+        """ commits one row group of flattened reports"""
+        try:
+            self._commit_part(lambda tmp_path: write_part(df, tmp_path, self.format), len(df), df['filename'].astype(str).tolist())
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def add_part(self, part_path, rows, sources):
+        """ commits a row group already written by write_part in the output's format, e.g. by another process"""
+        try:
+            self._commit_part(lambda tmp_path: shutil.copyfile(part_path, tmp_path), rows, list(sources))
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def _merge_csv(self, tmp_path):
+        with open(tmp_path, 'wb') as out:
+            for i, part in enumerate(self.parts):
+                with open(os.path.join(self.parts_dir, part), 'rb') as f:
+                    header = f.readline()
+                    if i == 0:
+                        out.write(header)
+                    shutil.copyfileobj(f, out)
+
+    def _merge_parquet(self, tmp_path):
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for part in self.parts:
+                table = pq.read_table(os.path.join(self.parts_dir, part))
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def finalize(self):
+        """ merges all committed row groups into the output path atomically and removes the parts"""
+        try:
+            tmp_path = f"{self.output_path}.tmp"
+            if not self.parts:
+                # nothing was parsed, still leave a valid output with just the columns behind
+                if self.format == 'parquet':
+                    import pyarrow.parquet as pq
+                    pq.write_table(_parquet_schema().empty_table(), tmp_path)
+                else:
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        f.write(','.join(FLAT_COLUMNS) + '\n')
+            elif self.format == 'parquet':
+                self._merge_parquet(tmp_path)
+            else:
+                self._merge_csv(tmp_path)
+
+            os.replace(tmp_path, self.output_path)
+            shutil.rmtree(self.parts_dir, ignore_errors=True)
+            logger.info(f"finalized {self.output_path} from {len(self.parts)} row groups")
+
+        except Exception as e:
+            raise CustomException(e, sys)
@@ -0,0 +1,458 @@
+"""
+File-backed work queue for parsing and scoring on several hosts.
+
+The queue is a directory on a filesystem every worker can see (NFS, SMB, a
+mounted bucket with atomic renames). The input files are split into shards,
+one JSON file each, and every state change of a shard is a rename, which only
+one worker can win:
+
+    pending/shard-00007.json               waiting to be claimed
+    leased/shard-00007.json@host-pid       claimed, its mtime is the worker's heartbeat
+    done/shard-00007.json                  committed, its result is in results/
+    failed/shard-00007.json                given up after max_attempts
+
+A worker claims a shard by renaming it from pending/ to leased/ under its own
+name and touches the lease while it works. A lease whose heartbeat is older
+than lease_timeout_seconds belongs to a dead worker: any other worker moves
+it back to pending/ with one more attempt, first renaming it to
+`*.recovering` so only one worker does. A recovering shard still counts as
+leased, the queue is not finished until it is pending again. A worker that finds its lease gone
+drops the shard. Results are written to results/ before the lease is renamed
+to done/, so a committed shard always has its result, and a shard processed
+twice leaves the same result. Once every shard is done or failed, merge
+assembles the results, and only the worker that creates the merge lock
+does so. The merge lock is a lease as well: its holder renews it while it
+merges, and another worker takes over a lock not renewed for
+lease_timeout_seconds. merge.done records the finished merge, and the `merge`
+command redoes it by hand.
+
+    python -m src.components.work_queue create data/raw_awr_reports --queue /shared/awr_queue
+    python -m src.components.work_queue parse --queue /shared/awr_queue --output data/awr_metrics.csv   (on every host)
+    python -m src.components.work_queue status --queue /shared/awr_queue
+    python -m src.components.work_queue merge --queue /shared/awr_queue --output data/awr_metrics.csv
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+from dataclasses import dataclass
+from src.components.report_sources import is_archive_name, is_report_name
+from src.exception import CustomException
+from src.logger import get_logger
+
+logger = get_logger('parser')
+
+_STATES = ('pending', 'leased', 'done', 'failed', 'results')
+_LEASE_SEPARATOR = '@'
+
+
+@dataclass
+class WorkQueueConfig:
+    queue_dir: str = os.path.join('data', 'work_queue')
+    # input files per shard, an archive counts as one file
+    shard_size: int = 200
+    # a lease not renewed for this long is taken to belong to a dead worker
+    lease_timeout_seconds: float = 300.0
+    # leases are renewed at most this often
+    heartbeat_seconds: float = 10.0
+    # a shard whose workers keep dying is moved to failed/ after this many claims
+    max_attempts: int = 3
+    # idle workers look for expired leases this often until every shard is finished
+    poll_seconds: float = 5.0
+
+
+class LeaseLost(Exception):
+    """ the shard was recovered by another worker while this one was still on it"""
+
+
+class Lease:
+    def __init__(self, queue, shard, path):
+        self.queue = queue
+        self.shard = shard
+        self.path = path
+        self._renewed = time.monotonic()
+
+    @property
+    def name(self):
+        return self.shard['shard']
+
+    def heartbeat(self, force=False):
+        """ renews the lease, raises LeaseLost once another worker has recovered the shard"""
+        now = time.monotonic()
+        if not force and now - self._renewed < self.queue.config.heartbeat_seconds:
+            return
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            raise LeaseLost(self.name) from None
+        self._renewed = now
+
+
+class WorkQueue:
+    def __init__(self, config=None, worker_id=None):
+        self.config = config or WorkQueueConfig()
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+
+    def _dir(self, state):
+        return os.path.join(self.config.queue_dir, state)
+
+    def _list(self, state):
+        try:
+            names = os.listdir(self._dir(state))
+        except FileNotFoundError:
+            return []
+        if state == 'leased':
+            # shards being given back are in flight as well, until their pending file exists
+            return sorted(name for name in names if _LEASE_SEPARATOR in name and not name.endswith('.tmp'))
+        return sorted(name for name in names if name.endswith('.json'))
+
+    @staticmethod
+    def _write_json(path, obj):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(obj, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read_json(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def create(self, input_path, recursive=False):
+        """
+        splits the report files and archives of input_path into pending shards. a queue that
+        already exists is left as it is, so every worker may call this on start-up
+        """
+        try:
+            if os.path.isdir(self._dir('pending')):
+                return False
+            if os.path.isdir(input_path):
+                if recursive:
+                    paths = [os.path.join(dirpath, filename) for dirpath, _, filenames in os.walk(input_path) for filename in filenames]
+                else:
+                    paths = [os.path.join(input_path, filename) for filename in os.listdir(input_path)]
+            else:
+                paths = [input_path]
+            paths = sorted(os.path.abspath(path) for path in paths if is_report_name(os.path.basename(path)) or is_archive_name(os.path.basename(path)))
+
+            # shards are written next to the queue, the directory appears in one rename
+            os.makedirs(self.config.queue_dir, exist_ok=True)
+            staging_dir = os.path.join(self.config.queue_dir, f"pending.{self.worker_id}.tmp")
+            os.makedirs(staging_dir, exist_ok=True)
+            for number, start in enumerate(range(0, len(paths), self.config.shard_size)):
+                shard = {'shard': f"shard-{number:05d}", 'paths': paths[start:start + self.config.shard_size], 'attempts': 0}
+                self._write_json(os.path.join(staging_dir, f"{shard['shard']}.json"), shard)
+            for state in _STATES:
+                if state != 'pending':
+                    os.makedirs(self._dir(state), exist_ok=True)
+            try:
+                os.rename(staging_dir, self._dir('pending'))
+            except OSError:
+                # another worker created the queue first
+                for name in os.listdir(staging_dir):
+                    os.remove(os.path.join(staging_dir, name))
+                os.rmdir(staging_dir)
+                return False
+            logger.info(f"work queue {self.config.queue_dir}: {len(paths)} files in {len(self._list('pending'))} shards")
+            return True
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def claim(self):
+        """ the Lease of the first pending shard this worker wins, None when nothing is pending"""
+        try:
+            for name in self._list('pending'):
+                pending_path = os.path.join(self._dir('pending'), name)
+                lease_path = os.path.join(self._dir('leased'), f"{name}{_LEASE_SEPARATOR}{self.worker_id}")
+                try:
+                    # renames keep the mtime, the lease must not look expired from the start
+                    os.utime(pending_path)
+                    os.rename(pending_path, lease_path)
+                except FileNotFoundError:
+                    # claimed by another worker in the meantime
+                    continue
+                shard = self._read_json(lease_path)
+                shard['attempts'] += 1
+                return Lease(self, shard, lease_path)
+            return None
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def release(self, lease):
+        """ gives a shard back to pending/ (or failed/ once it used up its attempts)"""
+        recovering_path = f"{lease.path}.recovering"
+        try:
+            # renames keep the mtime, the recovering file must not look expired to other workers
+            os.utime(lease.path)
+            os.rename(lease.path, recovering_path)
+        except FileNotFoundError:
+            return False
+        state = 'failed' if lease.shard['attempts'] >= self.config.max_attempts else 'pending'
+        self._write_json(os.path.join(self._dir(state), f"{lease.name}.json"), lease.shard)
+        os.remove(recovering_path)
+        if state == 'failed':
+            logger.error(f"work queue shard {lease.name} failed {lease.shard['attempts']} times, moved to failed/")
+        return True
+
+    def recover_expired(self):
+        """ returns shards of workers whose lease expired to the queue, and how many"""
+        try:
+            recovered = 0
+            now = time.time()
+            for name in self._list('leased'):
+                lease_path = os.path.join(self._dir('leased'), name)
+                try:
+                    if now - os.stat(lease_path).st_mtime < self.config.lease_timeout_seconds:
+                        continue
+                    shard = self._read_json(lease_path)
+                except FileNotFoundError:
+                    continue
+                shard['attempts'] += 1
+                if self.release(Lease(self, shard, lease_path)):
+                    logger.warning(f"work queue shard {shard['shard']} recovered from expired lease {name}")
+                    recovered += 1
+            return recovered
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def result_path(self, shard_name, suffix):
+        return os.path.join(self._dir('results'), f"{shard_name}{suffix}")
+
+    def complete(self, lease, result_tmp_path, suffix, sources, failures):
+        """ moves the shard's result into results/ and commits the shard by renaming its lease to done/"""
+        try:
+            lease.heartbeat(force=True)
+            os.replace(result_tmp_path, self.result_path(lease.name, suffix))
+            self._write_json(self.result_path(lease.name, '.json'), {'sources': sources, 'failures': failures, 'worker': self.worker_id})
+            try:
+                os.rename(lease.path, os.path.join(self._dir('done'), f"{lease.name}.json"))
+            except FileNotFoundError:
+                # recovered meanwhile, the worker that has it now writes the same result
+                raise LeaseLost(lease.name) from None
+
+        except LeaseLost:
+            raise
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def run_worker(self, process_shard, suffix):
+        """
+        claims and processes shards until every shard is done or failed. process_shard(paths, result_path, heartbeat)
+        writes the shard's result to result_path and returns (sources, failures); heartbeat() is called between reports.
+        returns the number of shards this worker committed
+        """
+        try:
+            committed = 0
+            while True:
+                lease = self.claim()
+                if lease is None:
+                    if self.recover_expired():
+                        continue
+                    if not self._list('leased'):
+                        break
+                    # other workers are still on their shards, one of them may die
+                    time.sleep(self.config.poll_seconds)
+                    continue
+
+                result_tmp_path = f"{self.result_path(lease.name, suffix)}.{self.worker_id}.tmp"
+                try:
+                    sources, failures = process_shard(lease.shard['paths'], result_tmp_path, lease.heartbeat)
+                    self.complete(lease, result_tmp_path, suffix, sources, failures)
+                    committed += 1
+                    logger.info(f"work queue shard {lease.name} committed by {self.worker_id}: {len(sources)} reports, {len(failures)} failed")
+                except LeaseLost:
+                    logger.warning(f"work queue shard {lease.name} was recovered by another worker, dropping it")
+                except Exception as e:
+                    # the shard goes back for another worker, unless it keeps failing
+                    logger.error(f"work queue shard {lease.name} failed on {self.worker_id}: {e}")
+                    self.release(lease)
+                finally:
+                    if os.path.exists(result_tmp_path):
+                        os.remove(result_tmp_path)
+            return committed
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def status(self):
+        return {state: len(self._list(state)) for state in ('pending', 'leased', 'done', 'failed')}
+
+    def is_finished(self):
+        status = self.status()
+        return status['pending'] == 0 and status['leased'] == 0
+
+    def results(self, suffix):
+        """ (result path, shard record) of every committed shard in shard order"""
+        return [
+            (self.result_path(name[:-len('.json')], suffix), self._read_json(self.result_path(name[:-len('.json')], '.json')))
+            for name in self._list('done')
+        ]
+
+    def failures(self):
+        """ every report that failed inside a committed shard, plus the shards given up on"""
+        failures = [failure for _, record in self.results('') for failure in record['failures']]
+        for name in self._list('failed'):
+            shard = self._read_json(os.path.join(self._dir('failed'), name))
+            failures.extend({'source': path, 'error': f"shard {shard['shard']} failed {shard['attempts']} times"} for path in shard['paths'])
+        return failures
+
+    def _create_merge_lock(self, lock_path):
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return Lease(self, {'shard': 'merge'}, lock_path)
+        except FileExistsError:
+            return None
+
+    def claim_merge(self, force=False):
+        """
+        the merge Lease for the one worker that gets to merge the results of a finished queue, None for the others.
+        a merge lock not renewed for lease_timeout_seconds belongs to a dead worker and is taken over,
+        force takes it regardless and redoes a finished merge (the merge command)
+        """
+        try:
+            if not self.is_finished():
+                return None
+            lock_path = os.path.join(self.config.queue_dir, 'merge.lock')
+            done_path = os.path.join(self.config.queue_dir, 'merge.done')
+            if os.path.exists(done_path) and not force:
+                done = self._read_json(done_path)
+                logger.info(f"work queue {self.config.queue_dir} was already merged into {done['output']} by {done['worker']}")
+                return None
+            lease = self._create_merge_lock(lock_path)
+            if lease is not None:
+                return lease
+
+            try:
+                age = time.time() - os.stat(lock_path).st_mtime
+            except FileNotFoundError:
+                age = None
+            if not force and age is not None and age < self.config.lease_timeout_seconds:
+                logger.warning(
+                    f"work queue {self.config.queue_dir} is finished but another worker holds the merge lock, renewed {age:.0f}s ago. "
+                    f"it is taken over after {self.config.lease_timeout_seconds:.0f}s, or run the merge command"
+                )
+                return None
+            # only one worker wins the rename of the stale lock
+            stale_path = f"{lock_path}{_LEASE_SEPARATOR}{self.worker_id}.stale"
+            try:
+                os.rename(lock_path, stale_path)
+            except FileNotFoundError:
+                pass
+            else:
+                os.remove(stale_path)
+                logger.warning(f"work queue {self.config.queue_dir}: merge lock expired, {self.worker_id} takes over the merge")
+            lease = self._create_merge_lock(lock_path)
+            if lease is None:
+                logger.warning(f"work queue {self.config.queue_dir}: another worker took over the merge first")
+            return lease
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    @staticmethod
+    def _release_merge(lease):
+        if lease is not None:
+            try:
+                os.remove(lease.path)
+            except FileNotFoundError:
+                pass
+
+    def _finish_merge(self, lease, output_path):
+        """ records the finished merge and removes its lock"""
+        self._write_json(os.path.join(self.config.queue_dir, 'merge.done'), {'output': os.path.abspath(output_path), 'worker': self.worker_id, 'time': time.time()})
+        self._release_merge(lease)
+
+    def merge_parsed(self, output_path, lease=None):
+        """ assembles the parsed shards into one metrics dataset (csv or parquet by the output's suffix), renewing the merge lease"""
+        try:
+            from src.components.streaming_writer import StreamingReportWriter
+
+            writer = StreamingReportWriter(output_path, resume=False)
+            for result_path, record in self.results(f".{writer.format}"):
+                if lease is not None:
+                    lease.heartbeat()
+                writer.add_part(result_path, len(record['sources']), record['sources'])
+            if lease is not None:
+                lease.heartbeat(force=True)
+            writer.finalize()
+            self._finish_merge(lease, output_path)
+            logger.info(f"merged {len(writer.parts)} shards into {output_path}")
+            return output_path
+
+        except LeaseLost:
+            logger.warning(f"work queue {self.config.queue_dir}: merge lock was taken over by another worker, leaving the merge to it")
+            return None
+        except Exception as e:
+            # a failed merge can be retried right away
+            self._release_merge(lease)
+            raise CustomException(e, sys)
+
+    def merge_jsonl(self, output_path, lease=None):
+        """ concatenates the JSON lines results of every shard into output_path, renewing the merge lease"""
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as out:
+                for result_path, _ in self.results('.jsonl'):
+                    if lease is not None:
+                        lease.heartbeat()
+                    with open(result_path, 'rb') as f:
+                        out.write(f.read())
+            os.replace(tmp_path, output_path)
+            self._finish_merge(lease, output_path)
+            return output_path
+
+        except LeaseLost:
+            logger.warning(f"work queue {self.config.queue_dir}: merge lock was taken over by another worker, leaving the merge to it")
+            return None
+        except Exception as e:
+            # a failed merge can be retried right away
+            self._release_merge(lease)
+            raise CustomException(e, sys)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.components.work_queue", description="Shared-directory work queue for parsing and scoring AWR reports")
+    parser.add_argument("command", choices=["create", "parse", "score", "status", "merge"])
+    parser.add_argument("input_path", nargs="?", help="directory, report file or archive to queue (create)")
+    parser.add_argument("--queue", default=WorkQueueConfig.queue_dir, help="queue directory on the shared filesystem")
+    parser.add_argument("--output", default=None, help="merged output, written by whichever worker finishes last (merge: .jsonl for scores)")
+    parser.add_argument("--shard-size", type=int, default=WorkQueueConfig.shard_size)
+    parser.add_argument("--lease-timeout", type=float, default=WorkQueueConfig.lease_timeout_seconds)
+    parser.add_argument("--recursive", action="store_true")
+    args = parser.parse_args(argv)
+
+    queue = WorkQueue(WorkQueueConfig(queue_dir=args.queue, shard_size=args.shard_size, lease_timeout_seconds=args.lease_timeout))
+    if args.command == "create":
+        queue.create(args.input_path, recursive=args.recursive)
+    elif args.command == "parse":
+        from src.components.awr_parser import AWRParser
+        AWRParser().parse_all_reports(args.input_path, args.output or os.path.join('data', 'awr_metrics.csv'), return_df=False, work_queue=queue)
+    elif args.command == "score":
+        from src.inference.bulk_score import score_queue
+        score_queue(queue, args.output or os.path.join('data', 'scores.jsonl'))
+    elif args.command == "merge":
+        # redoes the merge of a finished queue, e.g. after the merging worker died
+        if not queue.is_finished():
+            parser.error(f"work queue {args.queue} still has unfinished shards: {queue.status()}")
+        output_path = args.output or os.path.join('data', 'awr_metrics.csv')
+        lease = queue.claim_merge(force=True)
+        if lease is None:
+            parser.error("another worker took over the merge first")
+        if output_path.endswith('.jsonl'):
+            queue.merge_jsonl(output_path, lease)
+        else:
+            queue.merge_parsed(output_path, lease)
+    print(json.dumps(queue.status()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,63 @@
 import sys
-from src.logger import logging
 
-def error_message_details(error, error_detail:sys):
-    _, _, exc_tb = error_detail.exc_info()
-    file_name = exc_tb.tb_frame.f_code.co_filename
-    error_message = f"Error occurred in python script name {file_name} line number {exc_tb.tb_lineno} error message {str(error)}"
-
-    return error_message
+def _error_origin(error_detail):
+    """ script and line of the exception being handled, nothing is formatted here"""
+    exc_tb = error_detail.exc_info()[2] if error_detail is not None else None
+    if exc_tb is None:
+        return None, None
+    return exc_tb.tb_frame.f_code.co_filename, exc_tb.tb_lineno
 
 class CustomException(Exception):
-    def __init__(self, error_message,  error_detail: sys):
+    """
+    Error raised anywhere in the project. The message is only built when it is read,
+    and wrapping an error that already is a typed CustomException returns it unchanged,
+    so re-raising through every layer keeps the innermost type, origin and context
+    """
+    # status of the result a batch path records in place of a report failing with this error
+    status = "ERROR"
+
+    def __new__(cls, error_message=None, error_detail: sys = sys, **context):
+        if isinstance(error_message, CustomException) and (isinstance(error_message, cls) or type(error_message) is not CustomException):
+            return error_message
+        return super().__new__(cls)
+
+    def __init__(self, error_message=None, error_detail: sys = sys, **context):
+        if error_message is self:
+            # already wrapped further down, only context that is still missing is added
+            for key, value in context.items():
+                self.context.setdefault(key, value)
+            return
+        if isinstance(error_message, CustomException):
+            # a plain CustomException turned into a typed one keeps where it came from
+            super().__init__(error_message.error)
+            self.error = error_message.error
+            self.file_name, self.line_number = error_message.file_name, error_message.line_number
+            self.context = {**error_message.context, **context}
+            return
         super().__init__(error_message)
-        self.error_message = error_message_details(error_message, error_detail=error_detail)
+        self.error = error_message
+        self.file_name, self.line_number = _error_origin(error_detail)
+        self.context = context
+
+    @property
+    def error_message(self):
+        return f"Error occurred in python script name {self.file_name} line number {self.line_number} error message {str(self.error)}"
+
+    @property
+    def source(self):
+        return self.context.get('source')
 
     def __str__(self):
         return self.error_message
-        
\ No newline at end of file
+
+class ReportParseError(CustomException):
+    """ a report that could not be read, parsed or flattened, context carries its source"""
+    status = "PARSE ERROR"
+
+class FeatureEngineeringError(CustomException):
+    """ flattened reports the feature engineering could not turn into model features"""
+    status = "FEATURE ERROR"
+
+class ModelError(CustomException):
+    """ a model that could not be trained, or could not score its input"""
+    status = "MODEL ERROR"
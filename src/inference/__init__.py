@@ -0,0 +1,25 @@
+"""
+Inference-only entry point.
+
+Nothing here imports the training components (imblearn, xgboost, model selection).
+The prediction pipelines are resolved on first attribute access so that
+`import src.inference` stays cheap for cron jobs and short-lived containers.
+"""
+import importlib
+
+_LAZY_ATTRIBUTES = {
+    'PredictionPipeline': 'src.pipeline.predict_pipeline',
+    'UnsupervisedPredictPipeline': 'src.unsupervised_pipeline.unsupervised_prediction_pipeline',
+    'engineer_features': 'src.inference.features',
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,53 @@
+"""
+Score AWR reports from the command line with only the inference imports loaded.
+
+    python -m src.inference report1.html [report2.html ...]
+    python -m src.inference --supervised report.html
+    python -m src.inference --explain report.html
+"""
+import argparse
+import sys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.inference", description="Score AWR HTML reports")
+    parser.add_argument("reports", nargs="+", help="AWR HTML report files")
+    parser.add_argument("--supervised", action="store_true", help="predict the anomaly type with the supervised model")
+    parser.add_argument("--threshold", type=float, default=None, help="anomaly score threshold for the unsupervised model, for every database (default: -0.025)")
+    parser.add_argument("--per-db-thresholds", action="store_true", help="without --threshold, use the per-database thresholds of the score calibration where there is one")
+    parser.add_argument("--fast-path", action="store_true", help="report clearly normal reports as NORMAL after a partial parse, without a model score")
+    parser.add_argument("--explain", action="store_true", help="list the features that contributed most to each verdict")
+    args = parser.parse_args(argv)
+
+    # every report gets a line, a report that cannot be scored does not stop the others
+    if args.supervised:
+        from src.pipeline.predict_pipeline import PredictionPipeline
+        predictor = PredictionPipeline()
+        results = predictor.predict_batch(args.reports, errors='collect', explain=args.explain)
+    else:
+        from src.unsupervised_pipeline.unsupervised_prediction_pipeline import UnsupervisedPredictPipeline
+        predictor = UnsupervisedPredictPipeline(use_fast_path=args.fast_path, per_db_thresholds=args.per_db_thresholds)
+        results = predictor.predict_batch(args.reports, anomaly_threshold=args.threshold, errors='collect', explain=args.explain)
+
+    failed = 0
+    for report, result in zip(args.reports, results):
+        if 'error' in result:
+            failed += 1
+            print(f"{report}\t{result['status']}\t{result['error']}")
+        elif args.supervised:
+            print(f"{report}\t{result['anomaly_type']}")
+        else:
+            anomaly_score, percentile = result['anomaly_score'], result.get('anomaly_percentile')
+            line = f"{report}\t{result['status']}\t{'fast path' if anomaly_score is None else f'{anomaly_score:.4f}'}"
+            if percentile is not None:
+                line += f"\tworse than {percentile:.1f}% of training reports"
+            print(line)
+        for feature, contribution in result.get('attribution', {}).items():
+            print(f"\t{feature}\t{contribution:+.4f}")
+        if 'attribution_residual' in result:
+            print(f"\t(unattributed leaf depth)\t{result['attribution_residual']:+.4f}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+Per-prediction feature attribution for the saved tree ensembles.
+
+Contributions are read off the paths a report takes through every tree, for
+all trees and reports at once: the decision paths of the ensemble form one
+sparse (reports x nodes) indicator matrix, which is multiplied with a sparse
+(nodes x features) matrix of per-node contributions prepared once per model.
+
+* RandomForest: every split moves the class probability from the parent's to
+  the child's value, and that change is credited to the split feature
+  (Saabas). Bias plus contributions add up to predict_proba.
+* IsolationForest: every split on a report's path adds one to its path length
+  and is credited to the split feature, the leaf adds the expected remaining
+  depth. Each feature's depth is compared with the depth the training sample
+  spends on it in the same trees, and the differences are scaled into
+  decision_function units, so bias plus contributions add up to the score.
+  A negative contribution means the feature isolated the report faster than
+  usual, i.e. pushed it towards ANOMALY.
+"""
+import sys
+import numpy as np
+from scipy import sparse
+from src.exception import ModelError
+
+
+def _average_path_length(n_samples):
+    """ expected path length of an unsuccessful BST search among n samples (the iforest c(n))"""
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    lengths = np.zeros_like(n_samples)
+    lengths[n_samples == 2] = 1.0
+    many = n_samples > 2
+    lengths[many] = 2.0 * (np.log(n_samples[many] - 1.0) + np.euler_gamma) - 2.0 * (n_samples[many] - 1.0) / n_samples[many]
+    return lengths
+
+
+def _parents(tree):
+    parents = np.full(tree.node_count, -1, dtype=np.int64)
+    split_nodes = np.flatnonzero(tree.children_left >= 0)
+    parents[tree.children_left[split_nodes]] = split_nodes
+    parents[tree.children_right[split_nodes]] = split_nodes
+    return parents
+
+
+def top_contributions(feature_names, contributions, top_k=5):
+    """ {feature: contribution} of the top_k largest absolute contributions of one report"""
+    order = np.argsort(-np.abs(contributions))[:top_k]
+    return {feature_names[i]: float(contributions[i]) for i in order}
+
+
+class RandomForestAttribution:
+    def __init__(self, model):
+        if not hasattr(model, 'estimators_') or not hasattr(model, 'decision_path') or not hasattr(model, 'predict_proba'):
+            raise ModelError(f"feature attribution needs a fitted random forest classifier, got {type(model).__name__}")
+        self.model = model
+        self.n_features = model.n_features_in_
+        self.n_classes = len(model.classes_)
+
+        # (node x feature*class) probability change credited to the parent's split feature
+        blocks, biases = [], []
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            values = tree.value[:, 0, :]
+            values = values / values.sum(axis=1, keepdims=True)
+            parents = _parents(tree)
+            has_parent = parents >= 0
+            rows = np.repeat(np.flatnonzero(has_parent), self.n_classes)
+            features = tree.feature[parents[has_parent]]
+            columns = (features[:, None] * self.n_classes + np.arange(self.n_classes)).ravel()
+            deltas = (values[has_parent] - values[parents[has_parent]]).ravel()
+            blocks.append(sparse.csr_matrix((deltas, (rows, columns)), shape=(tree.node_count, self.n_features * self.n_classes)))
+            biases.append(values[0])
+        self._node_contributions = sparse.vstack(blocks).tocsr() / len(model.estimators_)
+        self.bias = np.mean(biases, axis=0)
+
+    def explain(self, X):
+        """ (bias per class, contributions of shape reports x features x classes)"""
+        try:
+            indicator, _ = self.model.decision_path(X)
+            contributions = np.asarray((indicator @ self._node_contributions).todense())
+            return self.bias, contributions.reshape(len(contributions), self.n_features, self.n_classes)
+
+        except Exception as e:
+            raise ModelError(e, sys)
+
+
+class IsolationForestAttribution:
+    def __init__(self, model):
+        if not hasattr(model, 'estimators_features_') or not hasattr(model, 'offset_'):
+            raise ModelError(f"feature attribution needs a fitted IsolationForest, got {type(model).__name__}")
+        self.model = model
+        self.n_features = model.n_features_in_
+        self.normaliser = float(_average_path_length([model.max_samples_])[0])
+
+        # (node x feature) one unit of depth for the split feature of every split node,
+        # the leaf's expected remaining depth goes into an extra last column
+        blocks, baselines = [], []
+        for estimator, tree_features in zip(model.estimators_, model.estimators_features_):
+            tree = estimator.tree_
+            split_nodes = np.flatnonzero(tree.children_left >= 0)
+            leaves = np.flatnonzero(tree.children_left < 0)
+            rows = np.concatenate([split_nodes, leaves])
+            columns = np.concatenate([np.asarray(tree_features)[tree.feature[split_nodes]], np.full(len(leaves), self.n_features)])
+            depth = np.concatenate([np.ones(len(split_nodes)), _average_path_length(tree.n_node_samples[leaves])])
+            block = sparse.csr_matrix((depth, (rows, columns)), shape=(tree.node_count, self.n_features + 1))
+            blocks.append(block)
+            # the same depth split by feature, averaged over the training sample of this tree
+            reach = tree.n_node_samples / tree.n_node_samples[0]
+            baselines.append(block.T @ reach)
+        self._node_depths = sparse.vstack(blocks).tocsr() / len(model.estimators_)
+        self._baseline_depths = np.mean(baselines, axis=0)
+        self.bias = self._score(self._baseline_depths.sum())
+
+    def _score(self, path_length):
+        return -np.power(2.0, -np.asarray(path_length) / self.normaliser) - self.model.offset_
+
+    def _decision_paths(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        return sparse.hstack([
+            estimator.decision_path(X[:, tree_features])
+            for estimator, tree_features in zip(self.model.estimators_, self.model.estimators_features_)
+        ]).tocsr()
+
+    def explain(self, X):
+        """ (score of the training baseline, contributions of shape reports x features) in decision_function units"""
+        try:
+            depths = np.asarray((self._decision_paths(X) @ self._node_depths).todense())
+            depth_changes = depths - self._baseline_depths
+            path_lengths = depths.sum(axis=1)
+            baseline_length = self._baseline_depths.sum()
+
+            # each feature's share of the depth change, scaled by the score change per unit of depth
+            scores = self._score(path_lengths)
+            length_change = path_lengths - baseline_length
+            slope = np.log(2.0) / self.normaliser * np.power(2.0, -path_lengths / self.normaliser)
+            moved = np.abs(length_change) > 1e-12
+            slope[moved] = (scores[moved] - self.bias) / length_change[moved]
+            contributions = depth_changes * slope[:, None]
+            # the leaf column is the part of the depth no single feature accounts for
+            return self.bias, contributions[:, :self.n_features], contributions[:, self.n_features]
+
+        except Exception as e:
+            raise ModelError(e, sys)
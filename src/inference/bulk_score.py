@@ -0,0 +1,293 @@
+"""
+Bulk scoring of a directory of AWR reports.
+
+Plain, compressed and archived reports are accepted (see report_sources).
+Files are read on an I/O thread pool, parsed in a process pool and scored in
+batches by one warm UnsupervisedPredictPipeline. Results are streamed as JSON
+lines to stdout or a file. At most `max_in_flight` reports are being read or
+parsed at any time, so memory stays flat on large backfills.
+
+    python -m src.inference.bulk_score data/raw_awr_reports -o data/scores.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from src.components.report_sources import iter_report_sources
+from src.exception import CustomException, ReportParseError
+from src.inference.features import failure_result, is_failure
+from src.logger import get_logger, init_worker_logging, worker_log_queue
+
+logger = get_logger('inference')
+report_logger = get_logger('inference.reports', sample_every=100)
+
+
+@dataclass
+class BulkScoreConfig:
+    input_dir: str = os.path.join('data', 'raw_awr_reports')
+    # None streams the results to stdout
+    output_path: str = None
+    # optional ResultStore database the results are also recorded in
+    result_store_path: str = None
+    # optional MetricBaselineStore file, fed with the metrics of every report scored NORMAL
+    baseline_store_path: str = None
+    # None judges by the default threshold, or by each database's calibrated one with per_db_thresholds
+    anomaly_threshold: float = None
+    # judge databases with a calibrated threshold by it when no anomaly_threshold is given
+    per_db_thresholds: bool = False
+    workers: int = field(default_factory=lambda: os.cpu_count() or 1)
+    batch_size: int = 256
+    max_in_flight: int = 1024
+    io_threads: int = 8
+    recursive: bool = False
+
+
+_worker_parser = None
+
+
+def _init_parse_worker(sections=None, log_queue=None):
+    global _worker_parser
+    if log_queue is not None:
+        init_worker_logging(log_queue)
+    from src.components.awr_parser import AWRParser
+    _worker_parser = AWRParser(sections=sections)
+
+
+def _parse_report(filename, html_bytes):
+    """ runs in the process pool, returns the flattened metrics of one report"""
+    try:
+        report_data = _worker_parser.parse_report_content(html_bytes.decode('utf-8'), filename=filename)
+        return _worker_parser._flatten_report_data(report_data)
+    except Exception as e:
+        # failures come back as rows, the batch keeps going
+        return failure_result(ReportParseError(e, sys, source=filename), filename=filename)
+
+
+class BulkScorer:
+    def __init__(self, config=None, predictor=None):
+        self.config = config or BulkScoreConfig()
+        if predictor is None:
+            from src.unsupervised_pipeline.unsupervised_prediction_pipeline import UnsupervisedPredictPipeline
+            predictor = UnsupervisedPredictPipeline(per_db_thresholds=self.config.per_db_thresholds)
+        self.predictor = predictor
+        self.result_store = None
+        if self.config.result_store_path:
+            from src.components.result_store import ResultStore
+            self.result_store = ResultStore(self.config.result_store_path)
+        self.metric_baselines = None
+        if self.config.baseline_store_path:
+            from src.components.quantile_sketch import MetricBaselineStore
+            self.metric_baselines = MetricBaselineStore.load_or_create(self.config.baseline_store_path)
+        self.scored = 0
+        self.failed = 0
+
+    async def _parse_one(self, source, html_bytes, loop, io_pool, parse_pool, parsed_queue, in_flight):
+        try:
+            if html_bytes is None:
+                html_bytes = await loop.run_in_executor(io_pool, source.read_bytes)
+            row = await loop.run_in_executor(parse_pool, _parse_report, source.name, html_bytes)
+            await parsed_queue.put(row)
+        except Exception as e:
+            report_logger.error("failed to parse %s: %s", source.name, e)
+            await parsed_queue.put(failure_result(ReportParseError(e, sys, source=source.name), filename=source.name))
+        finally:
+            in_flight.release()
+
+    async def _produce(self, loop, io_pool, parse_pool, parsed_queue, in_flight):
+        tasks = set()
+        sources = iter_report_sources(self.config.input_dir, recursive=self.config.recursive)
+        try:
+            while True:
+                await in_flight.acquire()
+                # walking directories and archives is blocking I/O too
+                source = await loop.run_in_executor(io_pool, next, sources, None)
+                if source is None:
+                    in_flight.release()
+                    break
+                html_bytes = None
+                if source.sequential:
+                    # archive members have to be read before the iterator moves on
+                    try:
+                        html_bytes = await loop.run_in_executor(io_pool, source.read_bytes)
+                    except Exception as e:
+                        report_logger.error("failed to parse %s: %s", source.name, e)
+                        await parsed_queue.put(failure_result(ReportParseError(e, sys, source=source.name), filename=source.name))
+                        in_flight.release()
+                        continue
+                task = asyncio.ensure_future(self._parse_one(source, html_bytes, loop, io_pool, parse_pool, parsed_queue, in_flight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            # the scoring loop stops at the sentinel even when the walk fails, run() re-raises it
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            await parsed_queue.put(None)
+
+    async def _score_and_write(self, loop, rows, out):
+        failures = [row for row in rows if is_failure(row)]
+        parsed = [row for row in rows if not is_failure(row)]
+        results = []
+        if parsed:
+            # scoring runs off the event loop so reads and parses keep flowing meanwhile,
+            # a report the model cannot score only fails itself
+            score = partial(self.predictor.predict_records, parsed, self.config.anomaly_threshold, errors='collect')
+            results = await loop.run_in_executor(None, score)
+            if self.metric_baselines is not None:
+                for row, result in zip(parsed, results):
+                    self.metric_baselines.update(row, normal=result.get('status') == 'NORMAL')
+        results.extend(failures)
+        if self.result_store is not None:
+            self.result_store.record(results, pipeline='unsupervised')
+        out.write(''.join(json.dumps(result, default=str) + '\n' for result in results))
+        out.flush()
+        failed = sum(is_failure(result) for result in results)
+        self.scored += len(results) - failed
+        self.failed += failed
+
+    async def run(self):
+        try:
+            if not os.path.exists(self.config.input_dir):
+                raise FileNotFoundError(f"input path {self.config.input_dir} does not exist")
+            loop = asyncio.get_running_loop()
+            # bounds the reports being read or parsed, and the parsed rows waiting to be scored
+            in_flight = asyncio.Semaphore(self.config.max_in_flight)
+            parsed_queue = asyncio.Queue(maxsize=self.config.max_in_flight)
+            start = time.perf_counter()
+
+            out = open(self.config.output_path, 'w', encoding='utf-8') if self.config.output_path else sys.stdout
+            try:
+                with ThreadPoolExecutor(self.config.io_threads) as io_pool, \
+                        ProcessPoolExecutor(self.config.workers, initializer=_init_parse_worker, initargs=(self.predictor.parser.sections, worker_log_queue())) as parse_pool:
+                    producer = asyncio.ensure_future(self._produce(loop, io_pool, parse_pool, parsed_queue, in_flight))
+
+                    batch = []
+                    try:
+                        while True:
+                            row = await parsed_queue.get()
+                            if row is not None:
+                                batch.append(row)
+                            if batch and (row is None or len(batch) >= self.config.batch_size):
+                                await self._score_and_write(loop, batch, out)
+                                batch = []
+                            if row is None:
+                                break
+                    except BaseException:
+                        producer.cancel()
+                        raise
+                    # raises what stopped the producer early
+                    await producer
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+                if self.result_store is not None:
+                    self.result_store.close()
+                if self.metric_baselines is not None:
+                    self.metric_baselines.save(self.config.baseline_store_path)
+
+            elapsed = time.perf_counter() - start
+            logger.info(f"bulk scoring finished: {self.scored} scored, {self.failed} failed in {elapsed:.2f}s")
+            return self.scored, self.failed, elapsed
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+def _score_shard(predictor, paths, result_path, heartbeat, anomaly_threshold=None):
+    """ parses and scores one work queue shard into a JSON lines file, returns (scored sources, failures)"""
+    rows, failures = [], []
+    for path in paths:
+        for source in iter_report_sources(path):
+            heartbeat()
+            try:
+                with source.open_text() as stream:
+                    rows.append(predictor.parser._flatten_report_data(predictor.parser.parse_report_content(stream, filename=source.name)))
+            except Exception as e:
+                report_logger.error("failed to parse %s: %s", source.name, e)
+                failures.append(failure_result(ReportParseError(e, sys, source=source.name), filename=source.name))
+    results = predictor.predict_records(rows, anomaly_threshold, errors='collect') if rows else []
+    results.extend(failures)
+    with open(result_path, 'w', encoding='utf-8') as out:
+        out.write(''.join(json.dumps(result, default=str) + '\n' for result in results))
+    return (
+        [result['filename'] for result in results if not is_failure(result)],
+        [{'source': result['filename'], 'error': result['error']} for result in results if is_failure(result)],
+    )
+
+
+def score_queue(work_queue, output_path, anomaly_threshold=None, predictor=None):
+    """
+    scores the shards of a shared WorkQueue as one of its workers, single-process per worker.
+    whichever worker finishes last concatenates the shard results into output_path
+    """
+    try:
+        if predictor is None:
+            from src.unsupervised_pipeline.unsupervised_prediction_pipeline import UnsupervisedPredictPipeline
+            predictor = UnsupervisedPredictPipeline()
+        committed = work_queue.run_worker(partial(_score_shard, predictor, anomaly_threshold=anomaly_threshold), suffix='.jsonl')
+        logger.info(f"scored {committed} work queue shards")
+        merge_lease = work_queue.claim_merge()
+        if merge_lease is not None:
+            work_queue.merge_jsonl(output_path, merge_lease)
+            logger.info(f"merged work queue results into {output_path}")
+        return committed
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.inference.bulk_score", description="Score a directory of AWR reports")
+    parser.add_argument("input_dir", help="directory, report file or .zip/.tar.* archive")
+    parser.add_argument("-o", "--output", default=None, help="JSONL output file, stdout when omitted")
+    parser.add_argument("--store", default=None, help="also record the results in this SQLite result store")
+    parser.add_argument("--baselines", default=None, help="update the per-instance quantile sketches of normal reports in this file")
+    parser.add_argument("--threshold", type=float, default=None, help="anomaly score threshold for every database (default: -0.025)")
+    parser.add_argument("--per-db-thresholds", action="store_true", help="without --threshold, use the per-database thresholds of the score calibration where there is one")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: one per cpu)")
+    parser.add_argument("--batch-size", type=int, default=None, help=f"reports per model call (default: {BulkScoreConfig.batch_size})")
+    parser.add_argument("--max-in-flight", type=int, default=None, help=f"reports held in memory at once (default: {BulkScoreConfig.max_in_flight})")
+    parser.add_argument("--recursive", action="store_true")
+    parser.add_argument("--queue", default=None, help="shared work queue directory, run this on every host and the last worker writes -o")
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.input_dir):
+        parser.error(f"input path {args.input_dir} does not exist")
+
+    if args.queue:
+        # queue workers score single-process and only write -o
+        unsupported = [option for option, value in (("--store", args.store), ("--baselines", args.baselines), ("--workers", args.workers),
+                                                    ("--batch-size", args.batch_size), ("--max-in-flight", args.max_in_flight)) if value is not None]
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} cannot be used with --queue")
+        from src.components.work_queue import WorkQueue, WorkQueueConfig
+        from src.unsupervised_pipeline.unsupervised_prediction_pipeline import UnsupervisedPredictPipeline
+        work_queue = WorkQueue(WorkQueueConfig(queue_dir=args.queue))
+        work_queue.create(args.input_dir, recursive=args.recursive)
+        predictor = UnsupervisedPredictPipeline(per_db_thresholds=args.per_db_thresholds)
+        score_queue(work_queue, args.output or os.path.join('data', 'scores.jsonl'), args.threshold, predictor)
+        print(f"work queue {args.queue}: {work_queue.status()}", file=sys.stderr)
+        return 0
+
+    config = BulkScoreConfig(
+        input_dir=args.input_dir,
+        output_path=args.output,
+        result_store_path=args.store,
+        baseline_store_path=args.baselines,
+        anomaly_threshold=args.threshold,
+        per_db_thresholds=args.per_db_thresholds,
+        workers=args.workers or os.cpu_count() or 1,
+        batch_size=args.batch_size or BulkScoreConfig.batch_size,
+        max_in_flight=args.max_in_flight or BulkScoreConfig.max_in_flight,
+        recursive=args.recursive,
+    )
+    scored, failed, elapsed = asyncio.run(BulkScorer(config).run())
+    print(f"scored {scored} reports ({failed} failed) in {elapsed:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""
+RAC cluster-level scoring across the instances of one database.
+
+Every report is scored alone, so a problem spread thinly over the instances of
+a RAC database can look normal on each of them. This stage groups the
+flattened reports of one batch into clusters: reports of the same db_id
+covering the same snapshot window. The grouping is a sweep over the reports
+sorted by (db_id, start_time); a report joins the current cluster while its
+start and end are within period_tolerance_minutes of the cluster's first
+report, so staggered reports of different hours never chain into one cluster.
+
+The cluster verdict comes from one score only: the calibrated percentiles of
+its instances combined with Stouffer's method (combined_percentile), so several
+instances that are each somewhat worse than usual add up to strong evidence.
+Plain Stouffer assumes independent instances, but the instances of one database
+share its workload and their percentiles move together. The sum of the z-scores
+is therefore divided by its standard deviation under an assumed pairwise
+correlation (instance_correlation), sqrt(n + n(n-1)rho), instead of sqrt(n).
+The training reports hold no multi-instance clusters to estimate rho from.
+This needs the score calibration, score_clusters fails without one. The sum,
+maximum and skew (maximum / mean, 1.0 when evenly spread) of every numeric
+metric across the instances are added in one vectorised groupby pass to
+describe the cluster, they do not feed the verdict.
+
+    python -m src.inference.cluster_scoring data/raw_awr_reports
+"""
+import argparse
+import sys
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+from src.components.quantile_sketch import BASELINE_METRICS
+from src.exception import CustomException, ModelError, ReportParseError
+from src.inference.features import is_failure
+from src.logger import get_logger
+
+logger = get_logger('inference')
+
+# per-cluster columns of the cluster results, the aggregates follow them
+CLUSTER_COLUMNS = [
+    'cluster_id', 'db_id', 'db_name', 'instances', 'filenames', 'start_time', 'end_time',
+    'status', 'combined_percentile', 'instance_anomalies',
+]
+
+
+@dataclass
+class ClusterScoringConfig:
+    # clusters with fewer distinct instances are left to the per-instance verdicts
+    min_instances: int = 2
+    # reports of one snapshot window on different instances start and end this close together
+    period_tolerance_minutes: float = 5.0
+    # a cluster whose combined instance percentile reaches this is flagged
+    combined_percentile_threshold: float = 97.5
+    # assumed correlation between the percentiles of instances of one database, 0 is plain Stouffer
+    # and 1 the mean z-score; at 0.5 four instances at the 85th percentile combine to about 90.5
+    instance_correlation: float = 0.5
+    # instance percentiles are clipped into (0, 100) by this much before the normal quantile is taken
+    percentile_clip: float = 0.05
+
+
+def assign_clusters(df, tolerance_minutes=5.0):
+    """ cluster number per row of flattened reports, NaN for reports without db_id or snapshot period"""
+    try:
+        periods = pd.DataFrame({
+            'db_id': df['db_id'].astype('string'),
+            'start': pd.to_datetime(df['start_time'], errors='coerce'),
+            'end': pd.to_datetime(df['end_time'], errors='coerce'),
+        }, index=df.index).dropna()
+        periods = periods.sort_values(['db_id', 'start'], kind='stable')
+
+        # a report opens a new cluster unless it matches the period of the current cluster's first report
+        db_ids = periods['db_id'].factorize()[0].tolist()
+        starts, ends = periods['start'].to_numpy().astype(np.int64).tolist(), periods['end'].to_numpy().astype(np.int64).tolist()
+        tolerance = int(tolerance_minutes * 60 * 1e9)
+        cluster_ids, cluster = [], -1
+        anchor_db = anchor_start = anchor_end = None
+        for db_id, start, end in zip(db_ids, starts, ends):
+            if db_id != anchor_db or start - anchor_start > tolerance or abs(end - anchor_end) > tolerance:
+                cluster += 1
+                anchor_db, anchor_start, anchor_end = db_id, start, end
+            cluster_ids.append(cluster)
+        return pd.Series(cluster_ids, index=periods.index, dtype='float64').reindex(df.index)
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def _split_by_cluster(values, cluster_ids):
+    """ list of the values of every cluster, in cluster order, with one sort instead of a python groupby"""
+    order = np.argsort(cluster_ids.to_numpy(), kind='stable')
+    sorted_ids = cluster_ids.to_numpy()[order]
+    return [list(part) for part in np.split(values.to_numpy()[order], np.flatnonzero(np.diff(sorted_ids)) + 1)]
+
+
+def aggregate_clusters(df, config=None):
+    """
+    one row per cluster of at least min_instances instances: identity, period and the
+    sum, max and skew of every numeric metric across the instances
+    """
+    try:
+        config = config or ClusterScoringConfig()
+        df = df.reset_index(drop=True)
+        cluster_ids = assign_clusters(df, config.period_tolerance_minutes)
+        instance_counts = df['instance'].astype('string').groupby(cluster_ids).nunique()
+        kept = instance_counts.index[instance_counts >= config.min_instances]
+        in_cluster = cluster_ids.isin(kept)
+        df, cluster_ids = df[in_cluster], cluster_ids[in_cluster].astype(int)
+        if df.empty:
+            return pd.DataFrame(columns=CLUSTER_COLUMNS)
+
+        groups = df.groupby(cluster_ids, sort=True)
+        periods = pd.DataFrame({
+            'start_time': pd.to_datetime(df['start_time'], errors='coerce'),
+            'end_time': pd.to_datetime(df['end_time'], errors='coerce'),
+        }).groupby(cluster_ids, sort=True).agg({'start_time': 'min', 'end_time': 'max'})
+        instances = pd.DataFrame({'cluster': cluster_ids, 'instance': df['instance'].astype(str)}).drop_duplicates().sort_values(['cluster', 'instance'])
+        clusters = pd.DataFrame({
+            'cluster_id': np.arange(groups.ngroups),
+            'db_id': groups['db_id'].first().astype(str).to_numpy(),
+            'db_name': groups['db_name'].first().to_numpy(),
+            'instances': _split_by_cluster(instances['instance'], instances['cluster']),
+            'filenames': _split_by_cluster(df['filename'], cluster_ids),
+            'start_time': periods['start_time'].dt.strftime('%Y-%m-%d %H:%M:%S').to_numpy(),
+            'end_time': periods['end_time'].dt.strftime('%Y-%m-%d %H:%M:%S').to_numpy(),
+        })
+
+        metrics = [metric for metric in BASELINE_METRICS if metric in df.columns]
+        values = df[metrics].apply(pd.to_numeric, errors='coerce').groupby(cluster_ids, sort=True)
+        sums, maxima, means = values.sum(), values.max(), values.mean()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            skew = np.where(means.to_numpy() > 0, maxima.to_numpy() / means.to_numpy(), 1.0)
+        aggregates = pd.concat([
+            sums.add_suffix('_sum').reset_index(drop=True),
+            maxima.add_suffix('_max').reset_index(drop=True),
+            pd.DataFrame(skew, columns=[f"{metric}_skew" for metric in metrics]),
+        ], axis=1)
+        return pd.concat([clusters, aggregates], axis=1)
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def combine_percentiles(percentiles, clip=0.05, correlation=0.0):
+    """
+    Stouffer's combination of instance percentiles (0-100, higher is worse) into one percentile,
+    for z-scores with the given pairwise correlation
+    """
+    percentiles = np.clip(np.asarray(percentiles, dtype=np.float64), clip, 100.0 - clip)
+    z_scores = norm.ppf(percentiles / 100.0)
+    n = len(z_scores)
+    return float(100.0 * norm.cdf(z_scores.sum() / np.sqrt(n + n * (n - 1) * correlation)))
+
+
+def score_clusters(predictor, flattened_rows, results, config=None):
+    """
+    cluster results for flattened reports already scored per instance by an UnsupervisedPredictPipeline.
+    one row per cluster with its verdict, combined percentile and aggregate metrics, flagged clusters first.
+    the verdict is the combined instance percentile alone, so the predictor needs its score calibration
+    """
+    try:
+        config = config or ClusterScoringConfig()
+        if predictor.calibration is None:
+            raise ModelError("cluster scoring needs the score calibration of the current model, retrain the unsupervised model to write it")
+        scored = [(row, result) for row, result in zip(flattened_rows, results) if row is not None and not is_failure(result)]
+        if not scored:
+            return pd.DataFrame(columns=CLUSTER_COLUMNS)
+        df = pd.DataFrame([row for row, _ in scored])
+        clusters = aggregate_clusters(df, config)
+        if clusters.empty:
+            return clusters
+
+        by_filename = {row.get('filename'): result for row, result in scored}
+        instance_results = [[by_filename[filename] for filename in filenames] for filenames in clusters['filenames']]
+        clusters['instance_anomalies'] = [sum(result['status'] == "ANOMALY DETECTED" for result in group) for group in instance_results]
+        # fast path verdicts have no score and no percentile, they count as the median report
+        clusters['combined_percentile'] = [
+            combine_percentiles([50.0 if result.get('anomaly_percentile') is None else result['anomaly_percentile'] for result in group], config.percentile_clip, config.instance_correlation)
+            for group in instance_results
+        ]
+        clusters['status'] = np.where(clusters['combined_percentile'] >= config.combined_percentile_threshold, "ANOMALY DETECTED", "NORMAL")
+        logger.info(f"scored {len(clusters)} clusters, {int((clusters['status'] != 'NORMAL').sum())} flagged")
+
+        clusters = clusters[CLUSTER_COLUMNS + [column for column in clusters.columns if column not in CLUSTER_COLUMNS]]
+        return clusters.sort_values(['status', 'combined_percentile'], ascending=[True, False], kind='stable').reset_index(drop=True)
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.inference.cluster_scoring", description="Score the RAC clusters in a set of AWR reports")
+    parser.add_argument("input_path", help="directory, report file or .zip/.tar.* archive")
+    parser.add_argument("--threshold", type=float, default=None, help="anomaly score threshold for the unsupervised model (default: -0.025)")
+    parser.add_argument("--recursive", action="store_true")
+    args = parser.parse_args(argv)
+
+    from src.components.report_sources import iter_report_sources
+    from src.unsupervised_pipeline.unsupervised_prediction_pipeline import UnsupervisedPredictPipeline
+
+    predictor = UnsupervisedPredictPipeline()
+    rows = []
+    for source in iter_report_sources(args.input_path, recursive=args.recursive):
+        try:
+            with source.open_text() as stream:
+                rows.append(predictor.parser._flatten_report_data(predictor.parser.parse_report_content(stream, filename=source.name)))
+        except Exception as e:
+            logger.error("failed to parse %s: %s", source.name, ReportParseError(e, sys, source=source.name).error)
+    results = predictor.predict_records(rows, anomaly_threshold=args.threshold, errors='collect')
+    clusters = score_clusters(predictor, rows, results)
+
+    print("cluster verdicts come from the combined instance percentiles, the metric aggregates are descriptive")
+    with pd.option_context('display.width', 200, 'display.max_colwidth', 60):
+        print(clusters[CLUSTER_COLUMNS].drop(columns=['filenames']).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+import os
+import sys
+import hashlib
+import numpy as np
+import pandas as pd
+from src.components.report_schema import DERIVED_COLUMNS, FLAT_COLUMNS, SECTION_TITLES, required_sections
+from src.exception import CustomException, FeatureEngineeringError, ReportParseError
+
+# identifier/redundant columns removed before scoring, same as the training transformations
+DROP_COLUMNS = ['anomaly_type', 'filename', 'db_name', 'db_id', 'instance', 'db_time_min', 'top_event_1_time_sec', 'top_event_2_time_sec', 'top_event_2_avg_ms', 'physical_to_logical_ratio', 'top_event_1_name', 'top_event_2_name', 'top_event_3_name']
+
+# report identifiers carried from the flattened report into every prediction result
+REPORT_ID_COLUMNS = ['filename', 'db_name', 'db_id', 'instance', 'start_time', 'end_time']
+
+
+def report_identity(row):
+    return {column: row.get(column) for column in REPORT_ID_COLUMNS}
+
+
+def failure_result(error, row=None, filename=None):
+    """ result recorded in place of a report that failed to parse or score"""
+    result = report_identity(row or {})
+    if filename is not None:
+        result['filename'] = filename
+    result.update({
+        'status': getattr(error, 'status', CustomException.status),
+        'error': str(getattr(error, 'error', error)),
+        'error_type': type(error).__name__,
+    })
+    return result
+
+
+def is_failure(result):
+    return 'error' in result
+
+
+def score_each_on_failure(score_rows, rows, feature_names=None):
+    """
+    score_rows(rows) in one call; rows lacking a value of feature_names become failure results
+    up front, and only if the call still fails is every row scored on its own
+    so a single bad report only fails itself
+    """
+    if feature_names is not None and rows:
+        input_df = pd.DataFrame(rows)
+        incomplete = check_feature_inputs(input_df, feature_names)
+        if incomplete.any():
+            complete_rows = [row for row, skip in zip(rows, incomplete) if not skip]
+            scored = iter(score_each_on_failure(score_rows, complete_rows) if complete_rows else [])
+            return [
+                failure_result(feature_input_error(input_df, feature_names, i), row=row) if skip else next(scored)
+                for i, (row, skip) in enumerate(zip(rows, incomplete))
+            ]
+    try:
+        return score_rows(rows)
+    except CustomException:
+        results = []
+        for row in rows:
+            try:
+                results.extend(score_rows([row]))
+            except CustomException as e:
+                results.append(failure_result(e, row=row))
+        return results
+
+
+def parse_and_score(file_paths, parse_row, score_rows, cache=None, model_version=None, failures=None):
+    """
+    (flattened_rows, results) for file_paths, through the prediction cache when one is given.
+    With a failures dict, reports that fail to parse are recorded under their index and
+    left as None instead of failing the batch
+    """
+    if cache is not None:
+        return cache.lookup_batch(file_paths, model_version, parse_row, score_rows, failures=failures)
+
+    rows = []
+    for i, file_path in enumerate(file_paths):
+        try:
+            rows.append(parse_row(file_path))
+        except ReportParseError as e:
+            if failures is None:
+                raise
+            failures[i] = e
+            rows.append(None)
+    scored = iter(score_rows([row for row in rows if row is not None]))
+    return rows, [None if row is None else next(scored) for row in rows]
+
+
+def fill_failures(file_paths, results, failures):
+    """ puts a failure result in the slot of every report recorded in failures"""
+    for i, error in (failures or {}).items():
+        results[i] = failure_result(error, filename=os.path.basename(file_paths[i]))
+    return results
+
+
+def feature_hashes(features_df):
+    """ one short hash per engineered feature row, identical inputs give identical hashes"""
+    values = features_df.to_numpy(dtype=np.float64, na_value=np.nan)
+    return [hashlib.sha1(row.tobytes()).hexdigest()[:16] for row in values]
+
+
+def input_columns(feature_names):
+    """ flattened columns a report needs for the given model features, the time encodings come from start_time"""
+    columns = ['start_time']
+    for feature in feature_names:
+        for column in DERIVED_COLUMNS.get(feature, (feature,)):
+            if column in FLAT_COLUMNS and column not in columns:
+                columns.append(column)
+    return columns
+
+
+def check_feature_inputs(df, feature_names):
+    """
+    boolean mask of the flattened reports lacking a value the model features need.
+    the schema always has every column, a report missing a whole section would otherwise be scored from NaN
+    """
+    return df.reindex(columns=input_columns(feature_names)).isna().any(axis=1).to_numpy()
+
+
+def feature_input_error(df, feature_names, index):
+    """ FeatureEngineeringError naming the sections and columns row `index` of df is missing"""
+    columns = input_columns(feature_names)
+    row = df.reindex(columns=columns).iloc[index]
+    missing_columns = [column for column in columns if pd.isna(row[column])]
+    sections = [SECTION_TITLES[section] for section in required_sections(missing_columns) if section in SECTION_TITLES]
+    filename = df['filename'].iloc[index] if 'filename' in df.columns else None
+    return FeatureEngineeringError(
+        f"report {filename} is missing {', '.join(sections) if sections else 'required values'} ({', '.join(missing_columns)})",
+        source=filename
+    )
+
+
+def engineer_features(df):
+    """ applies the training feature engineering to flattened report rows, without the training imports"""
+    try:
+        df = df.drop(columns=DROP_COLUMNS)
+
+        ## converts start_time and end_time in datetime format
+        start_time = pd.to_datetime(df['start_time'])
+
+        ## extract time features
+        start_hour = start_time.dt.hour
+        day_of_week = start_time.dt.dayofweek
+        start_month = start_time.dt.month
+        df['is_weekend'] = (day_of_week >= 5).astype(int)
+
+        # Encode Hour of Day (Cycle Length = 24)
+        df['hour_sin'] = np.sin(2 * np.pi * start_hour / 24)
+        df['hour_cos'] = np.cos(2 * np.pi * start_hour / 24)
+
+        # Encode Day of Week (Cycle Length = 7)
+        df['day_sin'] = np.sin(2 * np.pi * day_of_week / 7)
+        df['day_cos'] = np.cos(2 * np.pi * day_of_week / 7)
+
+        # Encode month (Cycle Length = 30)
+        df['month_sin'] = np.sin(2 * np.pi * start_month / 30)
+        df['month_cos'] = np.cos(2 * np.pi * start_month / 30)
+
+        #drop original time columns
+        df = df.drop(columns=['start_time', 'end_time'])
+
+        return df
+    except Exception as e:
+        raise FeatureEngineeringError(e, sys)
@@ -0,0 +1,176 @@
+"""
+Memoised predictions keyed by report content.
+
+A report is identified by the sha256 of its file bytes together with the
+model_version of the artifacts that scored it, so re-uploads and repeated
+backfills skip parsing, feature engineering and the model, and a retrained
+model never serves stale verdicts. Entries live in an in-process LRU and,
+when `disk_dir` is set, in a size-bounded directory shared between processes.
+"""
+import os
+import pickle
+import sys
+from collections import OrderedDict
+from dataclasses import dataclass
+from src.exception import CustomException, ReportParseError
+from src.inference.features import is_failure
+from src.logger import get_logger
+from src.utils import file_checksum as content_hash
+
+logger = get_logger('inference')
+
+
+@dataclass
+class PredictionCacheConfig:
+    max_entries: int = 1024
+    # on-disk tier, disabled when None
+    disk_dir: str = None
+    max_disk_bytes: int = 256 * 1024 * 1024
+
+
+class PredictionCache:
+    def __init__(self, config=None):
+        self.config = config or PredictionCacheConfig()
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+        self._disk_bytes = 0
+        if self.config.disk_dir:
+            os.makedirs(self.config.disk_dir, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self.config.disk_dir) if entry.name.endswith('.pkl'))
+
+    @staticmethod
+    def key(report_hash, model_version):
+        return f"{model_version}-{report_hash}"
+
+    def _disk_path(self, key):
+        return os.path.join(self.config.disk_dir, f"{key}.pkl")
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.config.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """ the cached entry for key or None, counted as a hit or a miss"""
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        if self.config.disk_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, 'rb') as f:
+                    entry = pickle.load(f)
+                # a read counts as a use, eviction removes the least recently used files first
+                os.utime(path)
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                entry = None
+            if entry is not None:
+                self._remember(key, entry)
+                self.hits += 1
+                self.disk_hits += 1
+                return entry
+
+        self.misses += 1
+        return None
+
+    def put(self, key, entry):
+        try:
+            self._remember(key, entry)
+            if not self.config.disk_dir:
+                return
+
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            # an entry written again replaces its old file, only the difference is new
+            try:
+                replaced_bytes = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced_bytes = 0
+            os.replace(tmp_path, path)
+            self._disk_bytes += os.path.getsize(path) - replaced_bytes
+            if self._disk_bytes > self.config.max_disk_bytes:
+                self._evict_disk()
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def _evict_disk(self):
+        entries = sorted(
+            (entry for entry in os.scandir(self.config.disk_dir) if entry.name.endswith('.pkl')),
+            key=lambda entry: entry.stat().st_mtime_ns
+        )
+        total = sum(entry.stat().st_size for entry in entries)
+        # evict down to 90% so that every put after the limit does not rescan the directory
+        target = self.config.max_disk_bytes * 0.9
+        evicted = 0
+        for entry in entries:
+            if total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # another process evicted it first
+                continue
+            total -= size
+            evicted += 1
+        self._disk_bytes = total
+        logger.info(f"prediction cache evicted {evicted} entries from {self.config.disk_dir}")
+
+    def lookup_batch(self, file_paths, model_version, parse_row, score_rows, failures=None):
+        """
+        returns (flattened_rows, results) for file_paths. only reports missing from the
+        cache go through parse_row(path) and a single score_rows(rows) call. with a failures
+        dict, reports that fail to parse are recorded under their index and left as None
+        """
+        try:
+            rows = [None] * len(file_paths)
+            results = [None] * len(file_paths)
+            missing = []
+            for i, file_path in enumerate(file_paths):
+                key = self.key(content_hash(file_path), model_version)
+                entry = self.get(key)
+                if entry is None:
+                    missing.append((i, key, file_path))
+                    continue
+                # the same content may arrive under another name
+                filename = os.path.basename(file_path)
+                rows[i] = dict(entry['row'], filename=filename)
+                results[i] = dict(entry['result'], filename=filename)
+
+            parsed = []
+            for i, key, file_path in missing:
+                try:
+                    parsed.append((i, key, parse_row(file_path)))
+                except ReportParseError as e:
+                    if failures is None:
+                        raise
+                    failures[i] = e
+            if parsed:
+                for (i, key, row), result in zip(parsed, score_rows([row for _, _, row in parsed])):
+                    # failures are not cached, a fixed model or parser gets another go at them
+                    if not is_failure(result):
+                        self.put(key, {'row': row, 'result': dict(result)})
+                    rows[i], results[i] = row, result
+            return rows, results
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'disk_hits': self.disk_hits,
+            'memory_entries': len(self._memory),
+            'disk_bytes': self._disk_bytes,
+        }
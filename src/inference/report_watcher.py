@@ -0,0 +1,274 @@
+"""
+Long-running watcher that scores AWR reports as they land in a drop directory.
+
+New files are picked up through inotify when the optional `inotify_simple`
+package is installed, otherwise the directory is polled. Files are debounced
+until they stop changing, grouped into micro-batches and scored with a model
+that stays loaded for the lifetime of the process. Verdicts are appended to
+the ResultStore.
+
+    python -m src.inference.report_watcher --watch-dir data/incoming_awr_reports
+"""
+import argparse
+import os
+import sys
+import time
+from dataclasses import dataclass
+from src.components.result_store import ResultStore, ResultStoreConfig
+from src.exception import CustomException, ReportParseError
+from src.inference.features import failure_result
+from src.logger import get_logger
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+logger = get_logger('inference')
+# one line per report or batch, sampled so a busy drop directory does not flood the log
+report_logger = get_logger('inference.reports', sample_every=100)
+
+
+@dataclass
+class ReportWatcherConfig:
+    watch_dir: str = os.path.join('data', 'incoming_awr_reports')
+    results_db_path: str = ResultStoreConfig.db_path
+    # when set, per-instance trend features are kept up to date in this RollingFeatureStore file
+    feature_store_path: str = None
+    # optional MetricBaselineStore file, fed with the metrics of every report scored NORMAL
+    baseline_store_path: str = None
+    # the feature and baseline stores are saved at most this often, and when the watcher stops
+    store_save_seconds: float = 30.0
+    # None judges by the default threshold, or by each database's calibrated one with per_db_thresholds
+    anomaly_threshold: float = None
+    # judge databases with a calibrated threshold by it when no anomaly_threshold is given
+    per_db_thresholds: bool = False
+    # a polled file must keep the same size and mtime for this long before it is scored
+    settle_seconds: float = 0.5
+    # once a file is ready, wait this long for more arrivals before scoring the batch
+    batch_window_seconds: float = 0.2
+    max_batch_size: int = 64
+    poll_interval_seconds: float = 0.25
+    file_suffix: str = '.html'
+    use_inotify: bool = True
+
+
+class _PollingSource:
+    """ reports files whose size or mtime changed since the previous scan"""
+
+    def __init__(self, watch_dir, file_suffix):
+        self.watch_dir = watch_dir
+        self.file_suffix = file_suffix
+        self._signatures = {}
+
+    def changed_paths(self, timeout):
+        time.sleep(timeout)
+        changed = []
+        current = {}
+        with os.scandir(self.watch_dir) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.endswith(self.file_suffix):
+                    continue
+                stat = entry.stat()
+                signature = (stat.st_size, stat.st_mtime_ns)
+                current[entry.path] = signature
+                if self._signatures.get(entry.path) != signature:
+                    changed.append(entry.path)
+        self._signatures = current
+        return changed
+
+    def close(self):
+        pass
+
+
+class _InotifySource:
+    """ reports files that were closed after writing or moved into the directory"""
+
+    def __init__(self, watch_dir, file_suffix):
+        self.watch_dir = watch_dir
+        self.file_suffix = file_suffix
+        self._inotify = INotify()
+        self._inotify.add_watch(watch_dir, inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO)
+
+    def changed_paths(self, timeout):
+        events = self._inotify.read(timeout=int(timeout * 1000))
+        return [
+            os.path.join(self.watch_dir, event.name)
+            for event in events
+            if event.name.endswith(self.file_suffix)
+        ]
+
+    def close(self):
+        self._inotify.close()
+
+
+class ReportWatcher:
+    def __init__(self, config=None, predictor=None, result_store=None):
+        self.config = config or ReportWatcherConfig()
+        if predictor is None:
+            from src.unsupervised_pipeline.unsupervised_prediction_pipeline import UnsupervisedPredictPipeline
+            predictor = UnsupervisedPredictPipeline(per_db_thresholds=self.config.per_db_thresholds)
+        self.predictor = predictor
+        self.result_store = result_store or ResultStore(self.config.results_db_path)
+        if self.config.feature_store_path:
+            from src.components.feature_store import RollingFeatureStore
+            self.predictor.feature_store = RollingFeatureStore.load_or_create(self.config.feature_store_path)
+        self.metric_baselines = None
+        if self.config.baseline_store_path:
+            from src.components.quantile_sketch import MetricBaselineStore
+            self.metric_baselines = MetricBaselineStore.load_or_create(self.config.baseline_store_path)
+
+        os.makedirs(self.config.watch_dir, exist_ok=True)
+        if self.config.use_inotify and INotify is not None:
+            self.source = _InotifySource(self.config.watch_dir, self.config.file_suffix)
+            # inotify only fires after the writer closed the file, no extra settling needed
+            self.settle_seconds = 0.0
+        else:
+            self.source = _PollingSource(self.config.watch_dir, self.config.file_suffix)
+            self.settle_seconds = self.config.settle_seconds
+        logger.info(f"watching {self.config.watch_dir} with {type(self.source).__name__}")
+
+        # path -> (size, mtime_ns, monotonic time of the last observed change)
+        self._pending = {}
+        # path -> (size, mtime_ns) of the version that was already scored
+        self._scored = {}
+        self._stores_saved_at = time.monotonic()
+
+    def _observe(self, paths):
+        now = time.monotonic()
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self._pending.pop(path, None)
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if self._scored.get(path) == signature:
+                continue
+            previous = self._pending.get(path)
+            if previous is None or previous[:2] != signature:
+                self._pending[path] = (*signature, now)
+
+    def _ready_paths(self):
+        """ pending files that are non-empty and have not changed for settle_seconds"""
+        now = time.monotonic()
+        ready = []
+        for path, (size, mtime_ns, changed_at) in list(self._pending.items()):
+            if size == 0 or now - changed_at < self.settle_seconds:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self._pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self._pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+                continue
+            ready.append(path)
+        return ready
+
+    def _score_batch(self, paths):
+        flattened_rows, landed_at, failures = [], [], []
+        for path in paths:
+            size, mtime_ns, _ = self._pending.pop(path)
+            self._scored[path] = (size, mtime_ns)
+            try:
+                report_data = self.predictor.parser.parse_single_report(path)
+                flattened_rows.append(self.predictor.parser._flatten_report_data(report_data))
+                landed_at.append(mtime_ns / 1e9)
+            except Exception as e:
+                error = ReportParseError(e, sys, source=path)
+                report_logger.error("failed to parse %s: %s", path, error.error)
+                failures.append(failure_result(error, filename=os.path.basename(path)))
+
+        results = []
+        if flattened_rows:
+            results = self.predictor.predict_records(flattened_rows, anomaly_threshold=self.config.anomaly_threshold, errors='collect')
+            scored_at = time.time()
+            for result, landed in zip(results, landed_at):
+                result['scored_at'] = scored_at
+                result['latency_ms'] = round((scored_at - landed) * 1000, 3)
+            if self.metric_baselines is not None:
+                for row, result in zip(flattened_rows, results):
+                    self.metric_baselines.update(row, normal=result.get('status') == 'NORMAL')
+        results.extend(failures)
+
+        self.result_store.record(results, pipeline='unsupervised')
+        if time.monotonic() - self._stores_saved_at >= self.config.store_save_seconds:
+            self._save_stores()
+        report_logger.info("scored batch of %d reports", len(paths))
+        return results
+
+    def _save_stores(self):
+        if self.config.feature_store_path:
+            self.predictor.feature_store.save(self.config.feature_store_path)
+        if self.metric_baselines is not None:
+            self.metric_baselines.save(self.config.baseline_store_path)
+        self._stores_saved_at = time.monotonic()
+
+    def poll_once(self):
+        """ waits for one round of file events and scores a micro-batch if one is ready"""
+        try:
+            self._observe(self.source.changed_paths(self.config.poll_interval_seconds))
+            ready = self._ready_paths()
+            if not ready:
+                return []
+
+            # micro-batch: give files landing right behind the first one a chance to join
+            batch_deadline = time.monotonic() + self.config.batch_window_seconds
+            while len(ready) < self.config.max_batch_size and time.monotonic() < batch_deadline:
+                self._observe(self.source.changed_paths(min(self.config.poll_interval_seconds, self.config.batch_window_seconds)))
+                ready = self._ready_paths()
+
+            return self._score_batch(ready[:self.config.max_batch_size])
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def run(self, max_batches=None):
+        """ scores reports until interrupted, or until max_batches batches were scored"""
+        # files already sitting in the directory are scored on start-up
+        with os.scandir(self.config.watch_dir) as entries:
+            self._observe([entry.path for entry in entries if entry.name.endswith(self.config.file_suffix)])
+
+        batches = 0
+        try:
+            while max_batches is None or batches < max_batches:
+                if self.poll_once():
+                    batches += 1
+        except KeyboardInterrupt:
+            logger.info("report watcher stopped")
+        finally:
+            self._save_stores()
+            self.source.close()
+            self.result_store.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.inference.report_watcher", description="Score AWR reports as they land in a directory")
+    parser.add_argument("--watch-dir", default=ReportWatcherConfig.watch_dir)
+    parser.add_argument("--results-db", default=ReportWatcherConfig.results_db_path, help="SQLite result store the verdicts are appended to")
+    parser.add_argument("--threshold", type=float, default=None, help="anomaly score threshold for every database (default: -0.025)")
+    parser.add_argument("--per-db-thresholds", action="store_true", help="without --threshold, use the per-database thresholds of the score calibration where there is one")
+    parser.add_argument("--batch-window", type=float, default=ReportWatcherConfig.batch_window_seconds, help="seconds to wait for more files before scoring")
+    parser.add_argument("--feature-store", default=None, help="file keeping per-instance trend features between runs")
+    parser.add_argument("--baselines", default=None, help="file keeping per-instance quantile sketches of normal reports")
+    parser.add_argument("--poll", action="store_true", help="poll the directory even if inotify is available")
+    args = parser.parse_args(argv)
+
+    config = ReportWatcherConfig(
+        watch_dir=args.watch_dir,
+        results_db_path=args.results_db,
+        anomaly_threshold=args.threshold,
+        per_db_thresholds=args.per_db_thresholds,
+        batch_window_seconds=args.batch_window,
+        feature_store_path=args.feature_store,
+        baseline_store_path=args.baselines,
+        use_inotify=not args.poll,
+    )
+    ReportWatcher(config).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
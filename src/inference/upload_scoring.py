@@ -0,0 +1,101 @@
+"""
+Scoring of many uploaded reports at once for the Streamlit apps.
+
+Uploaded files may be plain or compressed reports or .zip / .tar.* archives
+of them (see report_sources). Every report is parsed in a process pool and the
+parsed rows are scored by the warm pipeline in batches as the parses
+complete, so the app can show each batch of results while the rest are still
+being parsed.
+"""
+import io
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from src.components.report_sources import COMPRESSION_SUFFIXES, REPORT_SUFFIXES, TAR_SUFFIXES, decompressing_reader, is_archive_name, is_report_name, iter_report_sources
+from src.exception import CustomException, ReportParseError
+from src.inference.bulk_score import _init_parse_worker, _parse_report
+from src.inference.features import failure_result, is_failure
+from src.logger import get_logger, worker_log_queue
+
+logger = get_logger('inference')
+
+# file types the upload widgets accept, streamlit only compares what follows the last dot
+UPLOAD_TYPES = sorted({suffix.rsplit('.', 1)[-1] for suffix in (*REPORT_SUFFIXES, *COMPRESSION_SUFFIXES, *TAR_SUFFIXES, '.zip')})
+
+
+@dataclass
+class UploadScoringConfig:
+    workers: int = field(default_factory=lambda: os.cpu_count() or 1)
+    # parsed reports scored per model call, the results table refreshes after each
+    score_batch_size: int = 32
+
+
+def expand_uploads(uploads):
+    """
+    (name, report bytes) for every report in (file name, file bytes) uploads, archives are expanded.
+    an archive or member that cannot be read comes back with its ReportParseError instead of bytes
+    """
+    try:
+        reports = []
+        for name, data in uploads:
+            if is_archive_name(name):
+                # archives are read through report_sources, which needs a file on disk
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    archive_path = os.path.join(tmp_dir, os.path.basename(name))
+                    with open(archive_path, 'wb') as f:
+                        f.write(data)
+                    # members are named `archive.zip:member.html`
+                    for source in iter_report_sources(archive_path):
+                        try:
+                            reports.append((source.name, source.read_bytes()))
+                        except Exception as e:
+                            # an unreadable archive or member is scored as a failed report
+                            reports.append((source.name, ReportParseError(e, sys, source=source.name)))
+            elif is_report_name(name):
+                with decompressing_reader(io.BytesIO(data), name) as stream:
+                    reports.append((name, stream.read()))
+            else:
+                logger.warning(f"skipping upload {name}, not an AWR report or archive")
+        return reports
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def upload_parse_pool(sections=None, config=None):
+    """ process pool whose workers parse only the given sections, kept alive between uploads"""
+    config = config or UploadScoringConfig()
+    return ProcessPoolExecutor(config.workers, initializer=_init_parse_worker, initargs=(sections, worker_log_queue()))
+
+
+def score_uploads(predictor, reports, parse_pool, config=None, **predict_kwargs):
+    """
+    parses the (name, bytes) reports of expand_uploads in parse_pool and yields (rows, results) batches as they are scored.
+    every report gets a result, one that fails to parse or score gets a failure result and a None row.
+    BrokenProcessPool is raised as is, the caller has to replace the pool
+    """
+    try:
+        config = config or UploadScoringConfig()
+        futures = [parse_pool.submit(_parse_report, name, data) for name, data in reports if not isinstance(data, CustomException)]
+        # unreadable archives are reported with the first batch
+        rows, failures = [], [failure_result(data, filename=name) for name, data in reports if isinstance(data, CustomException)]
+        for i, future in enumerate(as_completed(futures), 1):
+            row = future.result()
+            if is_failure(row):
+                failures.append(row)
+            else:
+                rows.append(row)
+            if len(rows) + len(failures) >= config.score_batch_size or i == len(futures):
+                results = predictor.predict_records(rows, errors='collect', **predict_kwargs) if rows else []
+                yield rows + [None] * len(failures), results + failures
+                rows, failures = [], []
+        if failures:
+            yield [None] * len(failures), failures
+
+    except BrokenProcessPool:
+        raise
+    except Exception as e:
+        raise CustomException(e, sys)
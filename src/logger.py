@@ -1,15 +1,216 @@
+"""
+Queued logging for the whole project.
+
+Callers only put records on a queue; a background listener thread is the
+single writer of one rotating log file per process
+(logs/awr-<host>-<pid>.log), so the apps, watchers, CLIs and work queue
+workers running side by side never write or rotate each other's file.
+Nothing is created until the first record is logged. At that point files of
+processes that are gone and have not been written for AWR_LOG_RETENTION_DAYS
+(default 7) are removed. Worker processes send their records to the
+parent's listener when the pool is started with
+`initializer=init_worker_logging, initargs=(worker_log_queue(),)`.
+
+Levels are set per subsystem through get_logger(name) and the environment:
+
+    AWR_LOG_LEVEL=INFO AWR_LOG_LEVELS="parser=WARNING,inference=DEBUG"
+
+Per-report messages below WARNING can be sampled with get_logger(name, sample_every=N).
+"""
+import atexit
 import logging
+import logging.handlers
 import os
-from datetime import datetime
+import queue
+import re
+import socket
+import threading
+import time
+
+LOG_DIR = os.environ.get('AWR_LOG_DIR', os.path.join(os.getcwd(), "logs"))
+LOG_FORMAT = "[ %(asctime)s ] %(lineno)d %(name)s - %(levelname)s - %(message)s"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# per-process files idle this long are removed, 0 keeps them all
+LOG_RETENTION_DAYS = float(os.environ.get('AWR_LOG_RETENTION_DAYS', 7))
+_LOG_NAME = re.compile(r"awr-(?P<host>.+)-(?P<pid>\d+)\.log(\.\d+)?")
+
+_lock = threading.Lock()
+_file_handler = None
+_listeners = []
+_worker_queue = None
+
+
+class _LazyRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """ rotating file handler that creates the log directory with the file, not at import"""
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
+def log_file_path(pid=None):
+    """ the log file written by one process, rotation is only safe with a single writer"""
+    return os.path.join(LOG_DIR, f"awr-{socket.gethostname()}-{pid or os.getpid()}.log")
+
+
+def _process_running(pid):
+    if os.name != 'posix':
+        # os.kill would terminate it, open files cannot be removed there anyway
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def prune_old_logs(retention_days=LOG_RETENTION_DAYS):
+    """
+    removes the log files and backups of processes not written for retention_days,
+    except those of processes still running on this host. returns the number removed
+    """
+    if not retention_days or retention_days <= 0:
+        return 0
+    cutoff = time.time() - retention_days * 86400
+    hostname = socket.gethostname()
+    removed = 0
+    try:
+        entries = list(os.scandir(LOG_DIR))
+    except OSError:
+        return 0
+    for entry in entries:
+        match = _LOG_NAME.fullmatch(entry.name)
+        if not match:
+            continue
+        try:
+            if entry.stat().st_mtime >= cutoff:
+                continue
+            if match['host'] == hostname and _process_running(int(match['pid'])):
+                continue
+            os.remove(entry.path)
+            removed += 1
+        except OSError:
+            # removed by another process, or still open
+            continue
+    return removed
+
+
+def _get_file_handler():
+    global _file_handler
+    # a forked process must not keep writing to its parent's file
+    if _file_handler is None or _file_handler.pid != os.getpid():
+        prune_old_logs()
+        _file_handler = _LazyRotatingFileHandler(log_file_path(), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, delay=True)
+        _file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        _file_handler.pid = os.getpid()
+    return _file_handler
+
+
+def _start_listener(log_queue):
+    listener = logging.handlers.QueueListener(log_queue, _get_file_handler(), respect_handler_level=False)
+    listener.start()
+    _listeners.append(listener)
+    return log_queue
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """ queue handler that starts its listener on the first record of each process"""
+
+    def __init__(self, log_queue=None):
+        super().__init__(log_queue)
+        self._pid = os.getpid() if log_queue is not None else None
+
+    def prepare(self, record):
+        # only what cannot cross the queue is resolved here, the listener formats the line
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            # first record, or a process forked without init_worker_logging: this process writes itself
+            with _lock:
+                if self._pid != os.getpid():
+                    self.queue = _start_listener(queue.SimpleQueue())
+                    self._pid = os.getpid()
+        self.queue.put_nowait(record)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    lets the first record of every message template through, then one in every `every`.
+    warnings and errors are never sampled
+    """
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(int(every), 1)
+        self._counts = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        count = self._counts.get(record.msg, 0)
+        self._counts[record.msg] = count + 1
+        if count % self.every:
+            return False
+        if count:
+            record.msg = f"{record.msg} [sampled 1/{self.every}]"
+        return True
+
+
+def _configured_levels():
+    levels = {}
+    for item in os.environ.get('AWR_LOG_LEVELS', '').split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def get_logger(name, sample_every=None):
+    """ logger of one subsystem (parser, training, inference, ...) with its level from AWR_LOG_LEVELS"""
+    logger = logging.getLogger(f"awr.{name}")
+    level = _configured_levels().get(name)
+    if level:
+        logger.setLevel(level)
+    if sample_every and not any(isinstance(f, SamplingFilter) for f in logger.filters):
+        logger.addFilter(SamplingFilter(sample_every))
+    return logger
+
+
+def worker_log_queue():
+    """ queue for pool workers, served by a listener writing to the same file as this process"""
+    global _worker_queue
+    with _lock:
+        if _worker_queue is None:
+            import multiprocessing
+            _worker_queue = _start_listener(multiprocessing.Queue(-1))
+    return _worker_queue
+
+
+def init_worker_logging(log_queue):
+    """ pool initializer: the worker's records go to the parent's listener, never to the file directly"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_QueueHandler(log_queue))
+
 
-LOG_FILE = f"{datetime.now().strftime('%m_%d_%Y_%H_%M_%S')}.log"
-log_path = os.path.join(os.getcwd(), "logs", LOG_FILE)
-os.makedirs(log_path, exist_ok=True)
+def _stop_listeners():
+    for listener in _listeners:
+        listener.stop()
 
-LOG_FILE_PATH = os.path.join(log_path, LOG_FILE)
 
 logging.basicConfig(
-    filename=LOG_FILE_PATH,
-    format="[ %(asctime)s ] %(lineno)d %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
\ No newline at end of file
+    handlers=[_QueueHandler()],
+    level=os.environ.get('AWR_LOG_LEVEL', 'INFO').upper(),
+)
+atexit.register(_stop_listeners)
@@ -1,63 +1,73 @@
 import sys
 import os
 import pandas as pd
-import numpy as np
+from dataclasses import dataclass
+from functools import partial
 from src.components.awr_parser import AWRParser
-from src.exception import CustomException
-from src.utils import load_object
+from src.components.feature_store import TREND_METRICS
+from src.components.report_schema import required_sections
+from src.exception import CustomException, ModelError
+from src.inference.attribution import RandomForestAttribution, top_contributions
+from src.inference.features import check_feature_inputs, engineer_features, feature_input_error, feature_hashes, fill_failures, is_failure, parse_and_score, report_identity, score_each_on_failure
+from src.utils import load_object, artifact_version
+
+@dataclass
+class PredictionPipelineConfig:
+    label_encoder_path: str = os.path.join('artifacts','label_encoder.pkl')
+    scaler_path: str = os.path.join('artifacts','scaler.pkl')
+    model_path: str = os.path.join('artifacts', 'model.pkl')
+    # features listed per report when predictions are explained
+    attribution_top_k: int = 5
 
 class PredictionPipeline:
-    def __init__(self):
-        self.label_encoder = load_object(os.path.join('artifacts','label_encoder.pkl'))
-        self.scaler = load_object(os.path.join('artifacts','scaler.pkl'))
-        self.model = load_object(os.path.join('artifacts', 'model.pkl'))
+    def __init__(self, feature_store=None, cache=None):
+        self.config = PredictionPipelineConfig()
+        self.label_encoder = load_object(self.config.label_encoder_path)
+        self.scaler = load_object(self.config.scaler_path)
+        self.model = load_object(self.config.model_path)
+        self.model_version = artifact_version(self.config.label_encoder_path, self.config.scaler_path, self.config.model_path)
 
-        self.parser = AWRParser()
+        # only the sections the model features (and trend features) come from are parsed
+        self.parser = AWRParser(sections=self._required_sections())
+        # optional RollingFeatureStore, adds per-instance trend features to every result
+        self.feature_store = feature_store
+        # optional PredictionCache, re-scored reports skip parsing and the model
+        self.cache = cache
+        # RandomForestAttribution, prepared on the first explained prediction
+        self.attribution = None
 
     def feature_engineer_data(self, df):
-        try:
-            
-            drop_columns = ['filename', 'db_name', 'db_id', 'instance','db_time_min', 'top_event_1_time_sec', 'top_event_2_time_sec', 'top_event_2_avg_ms', 'physical_to_logical_ratio', 'top_event_1_name', 'top_event_2_name', 'top_event_3_name', 'anomaly_type']
-            df = df.drop(columns=drop_columns, axis=1)
-
-            ## converts start_time and end_time in datetime format
-            df['start_time'] = pd.to_datetime(df['start_time'])
-            df['end_time'] = pd.to_datetime(df['end_time'])
-            
-            ## extract time features
-            df['start_hour'] = df['start_time'].dt.hour
-            df['day_of_week'] = df['start_time'].dt.dayofweek
-            df['start_month'] = df['start_time'].dt.month
-            df['is_weekend'] = (df['start_time'].dt.dayofweek >= 5).astype(int)
-
-            # Encode Hour of Day (Cycle Length = 24)
-            df['hour_sin'] = np.sin(2 * np.pi * df['start_hour'] / 24)
-            df['hour_cos'] = np.cos(2 * np.pi * df['start_hour'] / 24)
-
-            # Encode Day of Week (Cycle Length = 7)
-            df['day_sin'] = np.sin(2 * np.pi * df['day_of_week'] / 7)
-            df['day_cos'] = np.cos(2 * np.pi * df['day_of_week'] / 7)
-
-            # Encode month (Cycle Length = 30)
-            df['month_sin'] = np.sin(2 * np.pi * df['start_month'] / 30)
-            df['month_cos'] = np.cos(2 * np.pi * df['start_month'] / 30)
-            
-            #drop original time columns
-            df = df.drop(columns=['start_time', 'end_time', 'start_hour', 'day_of_week', 'start_month'])
-
-            return df
-        except Exception as e:
-            raise CustomException(e, sys)
-        
-    def predict(self, html_filepath:str):
-        try:
-            #reads the awr html file
-            report_data = self.parser.parse_single_report(html_filepath)
-            #flattens the data from html file
-            flattened_data = self.parser._flatten_report_data(report_data)
+        return engineer_features(df)
+
+    def _required_sections(self):
+        feature_names = getattr(self.scaler, 'feature_names_in_', None)
+        if feature_names is None:
+            return None
+        return required_sections([*feature_names, *TREND_METRICS])
+
+    def _parse_row(self, html_filepath):
+        return self.parser._flatten_report_data(self.parser.parse_single_report(html_filepath))
 
+    def _explain(self, features_df, scaled_data, y_pred_encoded, results):
+        if self.attribution is None:
+            self.attribution = RandomForestAttribution(self.model)
+        bias, contributions = self.attribution.explain(scaled_data)
+        # contributions towards the predicted class, bias plus all of them is its probability
+        class_indices = self.model.classes_.searchsorted(y_pred_encoded)
+        for result, row_contributions, class_index in zip(results, contributions, class_indices):
+            result['attribution'] = top_contributions(features_df.columns, row_contributions[:, class_index], self.config.attribution_top_k)
+            result['attribution_bias'] = float(bias[class_index])
+        return results
+
+    def _score_records(self, flattened_rows, explain=False):
+        try:
             #convert flattened data to dataframe
-            input_df = pd.DataFrame([flattened_data])
+            input_df = pd.DataFrame(flattened_rows)
+
+            #a report missing a section the model needs gets no prediction
+            incomplete = check_feature_inputs(input_df, self.scaler.feature_names_in_)
+            if incomplete.any():
+                raise feature_input_error(input_df, self.scaler.feature_names_in_, incomplete.argmax())
 
             #feature engineering
             features_df = self.feature_engineer_data(input_df)
@@ -65,13 +75,85 @@ class PredictionPipeline:
             #scale features
             scaled_data = self.scaler.transform(features_df)
 
-            #make prediction
-            y_pred_encoded = self.model.predict(scaled_data)
+            #make prediction, the winning class probability is kept as confidence
+            probabilities = self.model.predict_proba(scaled_data)
+            y_pred_encoded = self.model.classes_[probabilities.argmax(axis=1)]
 
             #inverse transform to get result
-            anomaly_type = self.label_encoder.inverse_transform(y_pred_encoded)
+            anomaly_types = self.label_encoder.inverse_transform(y_pred_encoded)
+
+            results = []
+            for row, anomaly_type, confidence, feature_hash in zip(flattened_rows, anomaly_types, probabilities.max(axis=1), feature_hashes(features_df)):
+                result = report_identity(row)
+                result.update({
+                    'anomaly_type': anomaly_type,
+                    'confidence': float(confidence),
+                    'feature_hash': feature_hash,
+                    'model_version': self.model_version
+                })
+                results.append(result)
+
+            if explain:
+                return self._explain(features_df, scaled_data, y_pred_encoded, results)
+            return results
+
+        except Exception as e:
+            raise ModelError(e, sys)
+
+    def _score_rows(self, errors, explain=False):
+        score_rows = partial(self._score_records, explain=explain)
+        if errors == 'collect':
+            # reports missing a model input fail up front, the rest still share one model call
+            return partial(score_each_on_failure, score_rows, feature_names=self.scaler.feature_names_in_)
+        return score_rows
+
+    def _add_trend_features(self, flattened_rows, results):
+        if self.feature_store is not None:
+            for row, result in zip(flattened_rows, results):
+                if row is not None and not is_failure(result):
+                    result['trend_features'] = self.feature_store.update(row)
+        return results
 
-            return anomaly_type[0]
+    def predict_records(self, flattened_rows, errors='raise', explain=False):
+        """
+        classifies flattened reports in a single model call and returns one result dict per report.
+        with errors='collect' a report that cannot be scored gets a failure result instead of failing the batch,
+        with explain=True every result carries the features that contributed most to its predicted class
+        """
+        try:
+            return self._add_trend_features(flattened_rows, self._score_rows(errors, explain)(flattened_rows))
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def predict_batch(self, html_filepaths, errors='raise', explain=False):
+        """
+        parses and classifies several AWR reports in one batch.
+        with errors='collect' a report that cannot be parsed or scored gets a failure result in its place,
+        with explain=True every result carries its top feature contributions
+        """
+        try:
+            failures = {} if errors == 'collect' else None
+            # cached verdicts carry no attribution, explained batches are always scored
+            cache = None if explain else self.cache
+            flattened_rows, results = parse_and_score(html_filepaths, self._parse_row, self._score_rows(errors, explain), cache, self.model_version, failures)
+            return fill_failures(html_filepaths, self._add_trend_features(flattened_rows, results), failures)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+        
+    def predict(self, html_filepath:str):
+        try:
+            #reads, flattens and classifies the awr html file
+            return self.predict_batch([html_filepath])[0]['anomaly_type']
 
         except Exception as e:
-            raise CustomException(e, sys)
\ No newline at end of file
+            raise CustomException(e, sys)
+
+    def explain(self, html_filepath: str):
+        """ prediction result of one report with the features that contributed most to its class"""
+        try:
+            return self.predict_batch([html_filepath], explain=True)[0]
+
+        except Exception as e:
+            raise CustomException(e, sys)
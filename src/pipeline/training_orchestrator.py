@@ -0,0 +1,209 @@
+"""
+Trains the supervised and the unsupervised model in one run.
+
+The run is a small DAG of stages: the metrics CSV is ingested and feature
+engineered once, the engineered arrays are written to the run directory, and
+the supervised model search and the IsolationForest fit then run at the same
+time in separate processes, each memory-mapping those arrays. Every stage is
+timed, and the timings together with sha256 checksums of the produced
+artifacts are written to a JSON manifest.
+
+    python -m src.pipeline.training_orchestrator
+"""
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable
+import numpy as np
+import pandas as pd
+from src.components.data_ingestion import DataIngestion
+from src.components.stage_cache import StageCache
+from src.exception import CustomException
+from src.inference.features import engineer_features
+from src.logger import get_logger, init_worker_logging, worker_log_queue
+from src.utils import file_checksum
+
+logger = get_logger('training')
+
+
+@dataclass
+class TrainingOrchestratorConfig:
+    run_dir: str = os.path.join('artifacts', 'training_run')
+    manifest_path: str = os.path.join('artifacts', 'training_manifest.json')
+    max_workers: int = 2
+
+
+@dataclass
+class TrainingStage:
+    name: str
+    func: Callable
+    depends_on: tuple = ()
+    # process stages are started in the worker pool as soon as their dependencies are done
+    own_process: bool = False
+
+
+def _run_timed(func, *args):
+    """ runs a stage and returns (output, seconds, pid); errors come back as plain RuntimeErrors
+    because CustomException cannot be re-created on the parent side of a process pool"""
+    started = time.perf_counter()
+    try:
+        output = func(*args)
+    except Exception as e:
+        raise RuntimeError(f"{getattr(func, '__name__', func)} failed: {e}") from None
+    return output, time.perf_counter() - started, os.getpid()
+
+
+def _load_engineered(engineered):
+    X = pd.DataFrame(np.load(engineered['features_path'], mmap_mode='r'), columns=engineered['columns'], copy=False)
+    y = pd.Series(np.load(engineered['labels_path'], allow_pickle=True), name='anomaly_type')
+    return X, y
+
+
+def _train_supervised(engineered):
+    from src.components.data_transformation import DataTransformation
+    from src.components.model_trainer import ModelTrainer
+
+    X, y = _load_engineered(engineered)
+    transformation = DataTransformation()
+    X_train, X_test, y_train, y_test, _ = transformation.transform_features(X, y)
+    trainer = ModelTrainer()
+    accuracy, model_name = trainer.initiate_model_trainer(X_train, X_test, y_train, y_test)
+    return {
+        'accuracy': float(accuracy),
+        'model_name': model_name,
+        'artifacts': [
+            transformation.transformation_config.label_encoder_path,
+            transformation.transformation_config.scaler_path,
+            trainer.model_trainer_config.trained_model_file_path,
+        ],
+    }
+
+
+def _train_unsupervised(engineered):
+    from src.unsupervised_components.unsupervised_data_transformation import DataTransformation as UnsupervisedDataTransformation
+    from src.unsupervised_components.unsupervised_model_trainer import UnsupervisedModelTrainer
+    from src.unsupervised_components.unsupervised_fast_path import FastPathConfig, train_fast_path_gate
+    from src.unsupervised_components.unsupervised_calibration import CalibrationConfig, train_score_calibration
+    from src.utils import artifact_version
+
+    X, _ = _load_engineered(engineered)
+    transformation = UnsupervisedDataTransformation()
+    X_train_scaled, X_test_scaled = transformation.transform_features(X)
+    trainer = UnsupervisedModelTrainer()
+    model, anomaly_scores = trainer.initiate_model_trainer(X_train_scaled, X_test_scaled)
+
+    model_version = artifact_version(transformation.transformation_config.scaler_path, trainer.model_trainer_config.trained_model_file_path)
+    # the box is fit on the model's training rows and checked on its held-out rows
+    X_fit, X_held_out = transformation.split(X)
+    gate = train_fast_path_gate(X_fit, transformation.scaler, model, model_version, validation_df=X_held_out)
+    calibration = train_score_calibration(X, transformation.scaler, model, model_version, db_names=np.load(engineered['db_names_path'], allow_pickle=True))
+    return {
+        'test_anomaly_score_min': float(np.min(anomaly_scores)),
+        'test_anomaly_score_max': float(np.max(anomaly_scores)),
+        'fast_path_coverage': gate.coverage,
+        'calibrated_databases': len(calibration.db_thresholds),
+        'artifacts': [
+            transformation.transformation_config.scaler_path,
+            trainer.model_trainer_config.trained_model_file_path,
+            FastPathConfig().gate_path,
+            CalibrationConfig().calibration_path,
+        ],
+    }
+
+
+class TrainingOrchestrator:
+    def __init__(self, config=None):
+        self.config = config or TrainingOrchestratorConfig()
+        self.stages = [
+            TrainingStage('ingest', self._ingest),
+            TrainingStage('engineer', self._engineer, depends_on=('ingest',)),
+            TrainingStage('supervised', _train_supervised, depends_on=('engineer',), own_process=True),
+            TrainingStage('unsupervised', _train_unsupervised, depends_on=('engineer',), own_process=True),
+        ]
+
+    def _ingest(self):
+        return DataIngestion().initiate_data_ingestion()
+
+    def _engineer(self, df):
+        """ engineers the features shared by both models once and stores them for the workers"""
+        stage_cache = StageCache()
+        features = stage_cache.get_or_compute(stage_cache.key('engineered', df, engineer_features), lambda: engineer_features(df))
+        os.makedirs(self.config.run_dir, exist_ok=True)
+        engineered = {
+            'features_path': os.path.join(self.config.run_dir, 'features.npy'),
+            'labels_path': os.path.join(self.config.run_dir, 'labels.npy'),
+            'db_names_path': os.path.join(self.config.run_dir, 'db_names.npy'),
+            'columns': features.columns.tolist(),
+            'rows': len(features),
+        }
+        np.save(engineered['features_path'], features.to_numpy(dtype=np.float64))
+        np.save(engineered['labels_path'], df['anomaly_type'].to_numpy(dtype=object), allow_pickle=True)
+        np.save(engineered['db_names_path'], df['db_name'].to_numpy(dtype=object), allow_pickle=True)
+        return engineered
+
+    def _record(self, timings, stage, output, seconds, pid):
+        timings[stage.name] = {'seconds': round(seconds, 3), 'pid': pid}
+        logger.info(f"training stage {stage.name} finished in {seconds:.2f}s")
+        return output
+
+    def run(self):
+        """ runs every stage in dependency order and returns the manifest"""
+        try:
+            started_at = time.time()
+            outputs, timings = {}, {}
+            pending = list(self.stages)
+            running = {}
+
+            with ProcessPoolExecutor(max_workers=self.config.max_workers, initializer=init_worker_logging, initargs=(worker_log_queue(),)) as executor:
+                while pending or running:
+                    ready = [stage for stage in pending if all(dep in outputs for dep in stage.depends_on)]
+                    for stage in ready:
+                        pending.remove(stage)
+                        args = [outputs[dep] for dep in stage.depends_on]
+                        if stage.own_process:
+                            running[executor.submit(_run_timed, stage.func, *args)] = stage
+                        else:
+                            outputs[stage.name] = self._record(timings, stage, *_run_timed(stage.func, *args))
+
+                    if any(stage for stage in pending if all(dep in outputs for dep in stage.depends_on)):
+                        # a stage that ran here just unlocked more work
+                        continue
+                    if not running:
+                        if pending:
+                            raise ValueError(f"training stages with unmet dependencies: {[stage.name for stage in pending]}")
+                        break
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        stage = running.pop(future)
+                        outputs[stage.name] = self._record(timings, stage, *future.result())
+
+            artifacts = sorted({path for output in outputs.values() if isinstance(output, dict) for path in output.get('artifacts', [])})
+            manifest = {
+                'started_at': started_at,
+                'total_seconds': round(time.time() - started_at, 3),
+                'stages': timings,
+                'results': {
+                    name: {key: value for key, value in outputs[name].items() if key != 'artifacts'}
+                    for name in ('supervised', 'unsupervised')
+                },
+                'artifacts': {path: file_checksum(path) for path in artifacts},
+            }
+
+            manifest_dir = os.path.dirname(self.config.manifest_path)
+            if manifest_dir:
+                os.makedirs(manifest_dir, exist_ok=True)
+            with open(self.config.manifest_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2)
+            logger.info(f"training finished in {manifest['total_seconds']}s, manifest written to {self.config.manifest_path}")
+            return manifest
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+if __name__ == '__main__':
+    print(json.dumps(TrainingOrchestrator().run()['stages'], indent=2))
@@ -0,0 +1,110 @@
+"""
+Score calibration table for the Isolation Forest.
+
+Training scores every training report with the saved model and keeps a
+compact sorted table of those scores (at most `max_points` evenly spaced
+quantiles) for the model_version it was built against, plus one table per
+database with enough history. At prediction time a raw decision_function score
+is turned into "worse than 99.2% of training reports" by a binary search in
+the table, without the training data.
+
+Each database with at least `min_db_reports` reports also gets its own
+threshold: the score below which a report is worse than `threshold_percentile`
+percent of all of that database's training reports. It may be looser or
+stricter than the global threshold, and by construction it flags about
+100 - threshold_percentile percent of the database's own history. Other
+databases keep the global threshold.
+"""
+import bisect
+import os
+import sys
+from dataclasses import dataclass
+import numpy as np
+from src.exception import CustomException
+from src.logger import get_logger
+from src.utils import save_object
+
+logger = get_logger('training')
+
+
+@dataclass
+class CalibrationConfig:
+    calibration_path: str = os.path.join('artifacts', 'unsupervised_calibration.pkl')
+    # the global threshold, used for databases without their own
+    anomaly_threshold: float = -0.025
+    # entries kept per table, the percentile resolution is about 100 / max_points
+    max_points: int = 1001
+    # databases with fewer training reports use the global table and threshold
+    min_db_reports: int = 30
+    # a per-db threshold flags reports worse than this share of the database's training reports
+    threshold_percentile: float = 99.0
+
+
+def _compact_table(scores, max_points):
+    """ sorted scores, reduced to max_points evenly spaced quantiles when there are more"""
+    scores = np.sort(np.asarray(scores, dtype=np.float64))
+    if len(scores) > max_points:
+        scores = np.quantile(scores, np.linspace(0.0, 1.0, max_points))
+    return scores.tolist()
+
+
+class ScoreCalibration:
+    def __init__(self, scores, anomaly_threshold, model_version=None, db_scores=None, db_thresholds=None):
+        # ascending anomaly scores, lower is more anomalous
+        self.scores = scores
+        self.anomaly_threshold = anomaly_threshold
+        self.model_version = model_version
+        self.db_scores = db_scores or {}
+        self.db_thresholds = db_thresholds or {}
+
+    def percentile(self, anomaly_score, db_name=None):
+        """ share (0-100) of the training reports that scored higher, i.e. were more normal, than this one"""
+        if anomaly_score is None or anomaly_score != anomaly_score:
+            return None
+        scores = self.db_scores.get(db_name, self.scores)
+        return 100.0 * (len(scores) - bisect.bisect_right(scores, anomaly_score)) / len(scores)
+
+    def threshold(self, db_name=None, default=None):
+        """ the database's own threshold, or `default` (the global threshold when not given) without one"""
+        return self.db_thresholds.get(db_name, self.anomaly_threshold if default is None else default)
+
+    def strictest_threshold(self, default=None):
+        """ highest threshold any database is judged by, used to check the fast path still applies"""
+        default = self.anomaly_threshold if default is None else default
+        return max([default, *self.db_thresholds.values()])
+
+
+def fit_score_calibration(anomaly_scores, db_names=None, model_version=None, config=None):
+    """ builds the global and per-database tables from the training scores"""
+    try:
+        config = config or CalibrationConfig()
+        anomaly_scores = np.asarray(anomaly_scores, dtype=np.float64)
+        calibration = ScoreCalibration(_compact_table(anomaly_scores, config.max_points), config.anomaly_threshold, model_version)
+
+        if db_names is not None:
+            db_names = np.asarray(db_names, dtype=object)
+            for db_name in np.unique(db_names):
+                db_scores = anomaly_scores[db_names == db_name]
+                if len(db_scores) < config.min_db_reports:
+                    continue
+                calibration.db_scores[db_name] = _compact_table(db_scores, config.max_points)
+                calibration.db_thresholds[db_name] = float(np.quantile(db_scores, 1.0 - config.threshold_percentile / 100.0))
+
+        logger.info(f"score calibration over {len(anomaly_scores)} reports, {len(calibration.db_thresholds)} databases with their own threshold")
+        return calibration
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def train_score_calibration(features_df, scaler, model, model_version, db_names=None, config=None):
+    """ scores the training reports with the trained model and saves the calibration next to it"""
+    try:
+        config = config or CalibrationConfig()
+        anomaly_scores = model.decision_function(scaler.transform(features_df))
+        calibration = fit_score_calibration(anomaly_scores, db_names, model_version, config)
+        save_object(file_path=config.calibration_path, obj=calibration)
+        return calibration
+
+    except Exception as e:
+        raise CustomException(e, sys)
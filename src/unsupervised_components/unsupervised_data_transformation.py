@@ -5,28 +5,43 @@ import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder, StandardScaler
 #from imblearn.over_sampling import SMOTE
-from src.logger import logging
+from src.logger import get_logger
 from collections import Counter
-from src.exception import CustomException
+from src.exception import CustomException, FeatureEngineeringError
 from dataclasses import dataclass
 from src.utils import save_object
+from src.components.stage_cache import StageCache, StageCacheConfig
+
+logger = get_logger('training')
 
 @dataclass
 class DataTransformationConfig:
     scaler_path: str = os.path.join('artifacts','unsupervised_scaler.pkl')
+    # intermediate outputs are reused from here while data and settings are unchanged, None disables it
+    stage_cache_dir: str = StageCacheConfig.cache_dir
 
 class DataTransformation:
     def __init__(self):
         self.transformation_config = DataTransformationConfig()
         self.label_encoder = LabelEncoder()
         self.scaler = StandardScaler()
+        self.stage_cache = None
+        if self.transformation_config.stage_cache_dir:
+            self.stage_cache = StageCache(StageCacheConfig(cache_dir=self.transformation_config.stage_cache_dir))
+
+    def _cached(self, stage, key_parts, compute):
+        """ runs compute through the stage cache when enabled and returns (output, cache key)"""
+        if self.stage_cache is None:
+            return compute(), None
+        key = self.stage_cache.key(stage, *key_parts)
+        return self.stage_cache.get_or_compute(key, compute), key
 
     def get_data_transformer_object(self, df):
         try:
-            logging.info("starting feature engineering")
+            logger.info("starting feature engineering")
             drop_columns = ['anomaly_type','filename', 'db_name', 'db_id', 'instance','db_time_min', 'top_event_1_time_sec', 'top_event_2_time_sec', 'top_event_2_avg_ms', 'physical_to_logical_ratio', 'top_event_1_name', 'top_event_2_name', 'top_event_3_name']
             df = df.drop(columns=drop_columns, axis=1)
-            logging.info(f"Dropped columns: {drop_columns}")
+            logger.info(f"Dropped columns: {drop_columns}")
 
             ## converts start_time and end_time in datetime format
             df['start_time'] = pd.to_datetime(df['start_time'])
@@ -53,7 +68,7 @@ class DataTransformation:
             #drop original time columns
             df = df.drop(columns=['start_time', 'end_time', 'start_hour', 'day_of_week', 'start_month'])
 
-            logging.info("feature engineering completed")
+            logger.info("feature engineering completed")
             return df
         
         except Exception as e:
@@ -61,30 +76,46 @@ class DataTransformation:
         
     def initiate_data_transformation(self, df):
         try:
-            logging.info("starting data transformation")
+            logger.info("starting data transformation")
 
             #apply feature engineering
-            df = self.get_data_transformer_object(df)
+            df, _ = self._cached('unsupervised_features', (df, self.get_data_transformer_object), lambda: self.get_data_transformer_object(df))
+
+            return self.transform_features(df)
 
+        except Exception as e:
+            raise CustomException(e, sys)
 
-            # stratified train-test split 
-            X_train, X_test= train_test_split(df, test_size=0.2, random_state=42)
+    def split(self, df):
+        """ the train and held-out rows the model is fit and tested on, the split is deterministic"""
+        return train_test_split(df, test_size=0.2, random_state=42)
 
-            logging.info(f"Train set shape: X_train: {X_train.shape}")
-            logging.info(f"Test set shape: X_test: {X_test.shape}")
+    def _split_and_scale(self, df):
+        # stratified train-test split 
+        X_train, X_test= self.split(df)
 
-            # scale features
-            X_train_scaled = self.scaler.fit_transform(X_train)
-            X_test_scaled = self.scaler.transform(X_test)
+        logger.info(f"Train set shape: X_train: {X_train.shape}")
+        logger.info(f"Test set shape: X_test: {X_test.shape}")
 
-            logging.info("feature scaling completed")
+        # scale features
+        scaler = StandardScaler()
+        return scaler.fit_transform(X_train), scaler.transform(X_test), scaler
+
+    def transform_features(self, df):
+        """ splits and scales already engineered features"""
+        try:
+            # reused from the stage cache when the features are unchanged
+            (X_train_scaled, X_test_scaled, self.scaler), _ = self._cached(
+                'unsupervised_scaled', (df, self._split_and_scale), lambda: self._split_and_scale(df))
+
+            logger.info("feature scaling completed")
 
             # save preprocessing object
             save_object(file_path=self.transformation_config.scaler_path, obj = self.scaler)
 
-            logging.info("data transformation completed successfully")
+            logger.info("data transformation completed successfully")
 
             return X_train_scaled, X_test_scaled
         
         except Exception as e:
-            raise CustomException(e, sys)
+            raise FeatureEngineeringError(e, sys)
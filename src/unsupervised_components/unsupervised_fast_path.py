@@ -0,0 +1,122 @@
+"""
+Cheap first stage in front of the Isolation Forest.
+
+A box over a few Load Profile / OS values is learned from reports the full
+model scores as clearly normal, then shrunk until (almost) none of the
+reports falling inside it are flagged by the full model, both among the rows
+it was fit on and among held-out rows it never saw. At prediction time a
+report whose values lie inside the box is NORMAL after parsing only the
+header, Load Profile and OS Statistics; everything else goes through the full
+pipeline. The gate remembers the model_version it was validated against and
+is ignored once the model is retrained without it.
+"""
+import os
+import sys
+from dataclasses import dataclass
+import numpy as np
+from src.exception import CustomException
+from src.logger import get_logger
+from src.utils import save_object
+
+logger = get_logger('training')
+
+FAST_PATH_FEATURES = ['db_time_per_sec', 'db_cpu_per_sec', 'os_cpu_usage_pct']
+# parsed sections the fast path features come from, the header is always parsed
+FAST_PATH_SECTIONS = ('load_profile', 'os_stats')
+
+
+@dataclass
+class FastPathConfig:
+    gate_path: str = os.path.join('artifacts', 'unsupervised_fast_path.pkl')
+    anomaly_threshold: float = -0.025
+    # only reports scored at least this far above the threshold shape the box
+    score_margin: float = 0.03
+    # share of reports inside the box that the full model flags and that is still tolerated
+    max_false_normal_rate: float = 0.0
+    quantiles: tuple = (0.05, 0.95)
+    # the quantiles move inwards by this step while the box lets anomalies through
+    shrink_step: float = 0.05
+
+
+class FastPathGate:
+    def __init__(self, lower, upper, anomaly_threshold, model_version=None, coverage=0.0):
+        self.features = list(FAST_PATH_FEATURES)
+        self.lower = np.asarray(lower, dtype=np.float64)
+        self.upper = np.asarray(upper, dtype=np.float64)
+        self.anomaly_threshold = anomaly_threshold
+        self.model_version = model_version
+        # share of the training reports that fell inside the box
+        self.coverage = coverage
+
+    def applies_to(self, model_version, anomaly_threshold):
+        """ the box was only validated for this model and for thresholds at least as lenient"""
+        return model_version == self.model_version and anomaly_threshold <= self.anomaly_threshold
+
+    def inside(self, values):
+        """ boolean per row of a (rows x FAST_PATH_FEATURES) array; missing values are never inside"""
+        values = np.asarray(values, dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            return np.all((values >= self.lower) & (values <= self.upper), axis=-1)
+
+    def is_clearly_normal(self, row):
+        return bool(self.inside([[np.nan if row.get(feature) is None else row.get(feature) for feature in self.features]])[0])
+
+
+def _false_normal_rate(gate, values, flagged):
+    """ share of the rows inside the box that the full model flags"""
+    inside = gate.inside(values)
+    return flagged[inside].mean() if inside.any() else 0.0
+
+
+def fit_fast_path_gate(features_df, anomaly_scores, model_version=None, config=None, validation_df=None, validation_scores=None):
+    """
+    learns the safe box from engineered features and the full model's scores on them.
+    with validation rows, the box is only accepted once it also lets no flagged held-out report through
+    """
+    try:
+        config = config or FastPathConfig()
+        values = features_df[FAST_PATH_FEATURES].to_numpy(dtype=np.float64)
+        anomaly_scores = np.asarray(anomaly_scores)
+        flagged = anomaly_scores < config.anomaly_threshold
+        clearly_normal = values[anomaly_scores >= config.anomaly_threshold + config.score_margin]
+        if validation_df is not None:
+            validation_values = validation_df[FAST_PATH_FEATURES].to_numpy(dtype=np.float64)
+            validation_flagged = np.asarray(validation_scores) < config.anomaly_threshold
+
+        low_q, high_q = config.quantiles
+        while len(clearly_normal) and low_q < high_q:
+            lower = np.nanquantile(clearly_normal, low_q, axis=0)
+            upper = np.nanquantile(clearly_normal, high_q, axis=0)
+            gate = FastPathGate(lower, upper, config.anomaly_threshold, model_version)
+            held_out_rate = 0.0 if validation_df is None else _false_normal_rate(gate, validation_values, validation_flagged)
+            if _false_normal_rate(gate, values, flagged) <= config.max_false_normal_rate and held_out_rate <= config.max_false_normal_rate:
+                gate.coverage = float(gate.inside(values).mean())
+                logger.info(f"fast path box {dict(zip(FAST_PATH_FEATURES, zip(lower, upper)))} covers {gate.coverage:.1%} of reports")
+                if validation_df is not None:
+                    logger.info(f"fast path box covers {gate.inside(validation_values).mean():.1%} of {len(validation_values)} held-out reports, {held_out_rate:.1%} of those inside flagged")
+                return gate
+            low_q, high_q = low_q + config.shrink_step, high_q - config.shrink_step
+
+        # no box separates normal from flagged reports here, the gate never fires
+        logger.info("no safe fast path box found, every report takes the full pipeline")
+        return FastPathGate(np.full(len(FAST_PATH_FEATURES), np.inf), np.full(len(FAST_PATH_FEATURES), -np.inf), config.anomaly_threshold, model_version)
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def train_fast_path_gate(features_df, scaler, model, model_version, config=None, validation_df=None):
+    """
+    fits the gate against the trained model on features_df, checks it on the held-out
+    validation_df (e.g. the transformation's test split) and saves it next to the model artifacts
+    """
+    try:
+        config = config or FastPathConfig()
+        anomaly_scores = model.decision_function(scaler.transform(features_df))
+        validation_scores = None if validation_df is None else model.decision_function(scaler.transform(validation_df))
+        gate = fit_fast_path_gate(features_df, anomaly_scores, model_version, config, validation_df, validation_scores)
+        save_object(file_path=config.gate_path, obj=gate)
+        return gate
+
+    except Exception as e:
+        raise CustomException(e, sys)
@@ -0,0 +1,128 @@
+"""
+Size/latency/quality sweep for the Isolation Forest.
+
+Fits one model per (n_estimators, max_samples) combination on the training
+split and measures, on the held-out split: single-report and batch scoring
+latency, scoring memory peak, pickled model size and detection quality
+against the labelled anomaly_type (anything but NORMAL counts as an anomaly).
+The table shows how much quality each extra tree buys, so a model size can be
+picked to fit a latency budget and set in UnsupervisedModelTrainingConfig.
+
+    python -m src.unsupervised_components.unsupervised_model_profiler
+"""
+import itertools
+import os
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+import dill
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+from sklearn.metrics import average_precision_score, precision_score, recall_score, roc_auc_score
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+from src.exception import CustomException
+from src.inference.features import engineer_features
+from src.logger import get_logger
+from src.utils import parallel_decision_function
+
+logger = get_logger('training')
+
+
+@dataclass
+class UnsupervisedModelProfilerConfig:
+    n_estimators_grid: tuple = (25, 50, 100, 200, 400)
+    max_samples_grid: tuple = ('auto', 64, 512)
+    contamination: float = 0.20
+    # single reports timed for the per-report latency percentiles
+    latency_samples: int = 50
+    n_jobs: int = -1
+    report_path: str = os.path.join('artifacts', 'unsupervised_profile.csv')
+
+
+class UnsupervisedModelProfiler:
+    def __init__(self, config=None):
+        self.config = config or UnsupervisedModelProfilerConfig()
+
+    def _split(self, df):
+        """ the unsupervised training split, with the labels kept aside for evaluation only"""
+        features = engineer_features(df)
+        is_anomaly = (df['anomaly_type'] != 'NORMAL').to_numpy()
+        X_train, X_test, _, y_test = train_test_split(features, is_anomaly, test_size=0.2, random_state=42)
+        scaler = StandardScaler()
+        return scaler.fit_transform(X_train), scaler.transform(X_test), y_test
+
+    def _profile_model(self, model, X_test, y_test):
+        # per-report latency, the way the watcher and the apps score
+        rows = X_test[:self.config.latency_samples]
+        latencies = []
+        for i in range(len(rows)):
+            started = time.perf_counter()
+            model.decision_function(rows[i:i + 1])
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        scores = parallel_decision_function(model, X_test, n_jobs=self.config.n_jobs)
+        batch_seconds = time.perf_counter() - started
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        predicted = model.predict(X_test) == -1
+        return {
+            'single_p50_ms': float(np.percentile(latencies, 50)),
+            'single_p95_ms': float(np.percentile(latencies, 95)),
+            'batch_rows_per_sec': len(X_test) / batch_seconds,
+            'score_peak_mb': peak_bytes / 1e6,
+            'model_mb': len(dill.dumps(model)) / 1e6,
+            # lower decision_function means more anomalous
+            'roc_auc': roc_auc_score(y_test, -scores),
+            'average_precision': average_precision_score(y_test, -scores),
+            'precision': precision_score(y_test, predicted, zero_division=0),
+            'recall': recall_score(y_test, predicted, zero_division=0),
+        }
+
+    def profile(self, df):
+        """ one row per (n_estimators, max_samples) with fit time, latency, memory and quality"""
+        try:
+            X_train, X_test, y_test = self._split(df)
+            logger.info(f"profiling isolation forest on {len(X_train)} training and {len(X_test)} held-out reports")
+
+            rows = []
+            for n_estimators, max_samples in itertools.product(self.config.n_estimators_grid, self.config.max_samples_grid):
+                if isinstance(max_samples, int) and max_samples > len(X_train):
+                    continue
+                model = IsolationForest(
+                    n_estimators=n_estimators,
+                    max_samples=max_samples,
+                    contamination=self.config.contamination,
+                    random_state=42,
+                    n_jobs=self.config.n_jobs
+                )
+                started = time.perf_counter()
+                model.fit(X_train)
+                fit_seconds = time.perf_counter() - started
+
+                row = {'n_estimators': n_estimators, 'max_samples': str(max_samples), 'fit_seconds': fit_seconds}
+                row.update(self._profile_model(model, X_test, y_test))
+                logger.info(f"profiled {row}")
+                rows.append(row)
+
+            report = pd.DataFrame(rows)
+            report_dir = os.path.dirname(self.config.report_path)
+            if report_dir:
+                os.makedirs(report_dir, exist_ok=True)
+            report.to_csv(self.config.report_path, index=False)
+            return report
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+if __name__ == '__main__':
+    from src.components.data_ingestion import DataIngestion
+
+    report = UnsupervisedModelProfiler().profile(DataIngestion().initiate_data_ingestion())
+    print(report.round(4).to_string(index=False))
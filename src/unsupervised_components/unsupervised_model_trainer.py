@@ -4,13 +4,21 @@ import numpy as np
 from sklearn.ensemble import IsolationForest
 from sklearn.metrics import confusion_matrix
 from src.utils import save_object
-from src.logger import logging
-from src.exception import CustomException
+from src.logger import get_logger
+from src.exception import ModelError
 from dataclasses import dataclass
+from typing import Union
+
+logger = get_logger('training')
 
 @dataclass
 class UnsupervisedModelTrainingConfig:
     trained_model_file_path: str = os.path.join("artifacts","unsupervised_model.pkl")
+    # see unsupervised_model_profiler for the latency/quality trade-off of these
+    n_estimators: int = 100
+    # 'auto', a sample count or a fraction of the training rows
+    max_samples: Union[str, int, float] = 'auto'
+    contamination: float = 0.20
 
 class UnsupervisedModelTrainer:
     def __init__(self):
@@ -18,19 +26,20 @@ class UnsupervisedModelTrainer:
 
     def initiate_model_trainer(self, X_train, X_test):
         try:
-            logging.info("starting unsupervised model training (Isolation Forest)")
+            logger.info("starting unsupervised model training (Isolation Forest)")
 
             #define the model
             model = IsolationForest(
-                n_estimators=100,
-                contamination=0.20,
+                n_estimators=self.model_trainer_config.n_estimators,
+                max_samples=self.model_trainer_config.max_samples,
+                contamination=self.model_trainer_config.contamination,
                 random_state=42,
                 n_jobs=-1
             )
 
             #fit the model
             model.fit(X_train)
-            logging.info("Isolation forest model training completed")
+            logger.info("Isolation forest model training completed")
 
             #predict the class (-1 for anomaly, 1 for normal)
             y_pred_test = model.predict(X_test)
@@ -38,18 +47,18 @@ class UnsupervisedModelTrainer:
             #predict the anomaly score (lower is anomalous)
             anomaly_scores= model.decision_function(X_test)
 
-            logging.info(f"Min Anomaly Score: {np.min(anomaly_scores):.4f}")
-            logging.info(f"Max Anomaly Score: {np.max(anomaly_scores):.4f}")
-            logging.info(f"Number of predicted anomalies (-1): {np.sum(y_pred_test == -1)}")
+            logger.info(f"Min Anomaly Score: {np.min(anomaly_scores):.4f}")
+            logger.info(f"Max Anomaly Score: {np.max(anomaly_scores):.4f}")
+            logger.info(f"Number of predicted anomalies (-1): {np.sum(y_pred_test == -1)}")
 
             # Save the trained model
             save_object(
                 file_path=self.model_trainer_config.trained_model_file_path,
                 obj=model
             )
-            logging.info("Unsupervised model saved successfully.")
+            logger.info("Unsupervised model saved successfully.")
             
             return model, anomaly_scores
 
         except Exception as e:
-            raise CustomException(e, sys)
+            raise ModelError(e, sys)
@@ -1,32 +1,118 @@
 import sys
 import os
 import pandas as pd
-import numpy as np
 from dataclasses import dataclass
-from src.exception import CustomException
-from src.utils import load_object 
-from src.unsupervised_components.unsupervised_data_transformation import DataTransformation
+from functools import partial
+from src.exception import CustomException, ModelError, ReportParseError
+from src.inference.attribution import IsolationForestAttribution, top_contributions
+from src.inference.features import check_feature_inputs, engineer_features, feature_input_error, failure_result, feature_hashes, fill_failures, is_failure, parse_and_score, report_identity, score_each_on_failure
+from src.utils import load_object, artifact_version, parallel_decision_function
 from src.components.awr_parser import AWRParser 
+from src.components.feature_store import TREND_METRICS
+from src.components.report_schema import required_sections
+from src.logger import get_logger
+from src.unsupervised_components.unsupervised_fast_path import FAST_PATH_SECTIONS
+logger = get_logger('inference')
+
+# threshold for calls that pass none, unless the database has a calibrated one and per_db_thresholds is on
+DEFAULT_ANOMALY_THRESHOLD = -0.025
 
 @dataclass
 class UnsupervisedPredictionPipelineConfig:
     scaler_path: str = os.path.join('artifacts', 'unsupervised_scaler.pkl')
     model_path: str = os.path.join("artifacts", "unsupervised_model.pkl")
+    # batches of at least parallel_chunk_size rows are scored in chunks on n_jobs threads
+    parallel_chunk_size: int = 4096
+    n_jobs: int = -1
+    # FastPathGate written by the training pipeline, used with use_fast_path=True
+    fast_path_gate_path: str = os.path.join('artifacts', 'unsupervised_fast_path.pkl')
+    # ScoreCalibration written by the training pipeline, adds anomaly_percentile to every scored result
+    calibration_path: str = os.path.join('artifacts', 'unsupervised_calibration.pkl')
+    # features listed per report when scores are explained
+    attribution_top_k: int = 5
 
 class UnsupervisedPredictPipeline:
-    def __init__(self):
+    def __init__(self, feature_store=None, cache=None, use_fast_path=False, per_db_thresholds=False):
         self.config = UnsupervisedPredictionPipelineConfig()
         self.scaler = load_object(self.config.scaler_path)
         self.model = load_object(self.config.model_path)
-        self.parser = AWRParser() 
-        self.feature_engineer = DataTransformation().get_data_transformer_object
+        self.model_version = artifact_version(self.config.scaler_path, self.config.model_path)
+        # only the sections the model features (and trend features) come from are parsed
+        self.parser = AWRParser(sections=self._required_sections())
+        self.feature_engineer = engineer_features
+        # optional RollingFeatureStore, adds per-instance trend features to every result
+        self.feature_store = feature_store
+        # optional PredictionCache, re-scored reports skip parsing and the model
+        self.cache = cache
+        # optional FastPathGate, clearly normal reports skip the full parse and the model
+        self.fast_path = None
+        # IsolationForestAttribution, prepared on the first explained score
+        self.attribution = None
+        if use_fast_path:
+            self.fast_path = self._load_fast_path()
+        # optional ScoreCalibration, ignored when it was built for another model version
+        self.calibration = self._load_calibration()
+        # judge each database by its calibrated threshold when no threshold is passed in
+        self.per_db_thresholds = per_db_thresholds and self.calibration is not None
+
+    def _load_fast_path(self):
+        if not os.path.exists(self.config.fast_path_gate_path):
+            logger.warning(f"no fast path gate at {self.config.fast_path_gate_path}, scoring every report in full")
+            return None
+        gate = load_object(self.config.fast_path_gate_path)
+        if gate.model_version != self.model_version:
+            logger.warning("fast path gate was validated against another model version, scoring every report in full")
+            return None
+        return gate
+
+    def _load_calibration(self):
+        if not os.path.exists(self.config.calibration_path):
+            logger.debug(f"no score calibration at {self.config.calibration_path}")
+            return None
+        calibration = load_object(self.config.calibration_path)
+        if calibration.model_version != self.model_version:
+            logger.warning("score calibration was built for another model version, results carry no percentile")
+            return None
+        return calibration
+
+    def _threshold(self, db_name, anomaly_threshold):
+        # a threshold passed in explicitly applies to every database
+        if anomaly_threshold is not None:
+            return anomaly_threshold
+        if self.per_db_thresholds:
+            return self.calibration.threshold(db_name, default=DEFAULT_ANOMALY_THRESHOLD)
+        return DEFAULT_ANOMALY_THRESHOLD
 
-    def predict(self, html_filepath: str, anomaly_threshold: float = -0.025):
+    def _required_sections(self):
+        feature_names = getattr(self.scaler, 'feature_names_in_', None)
+        if feature_names is None:
+            return None
+        return required_sections([*feature_names, *TREND_METRICS])
+
+    def _parse_row(self, html_filepath):
+        return self.parser._flatten_report_data(self.parser.parse_single_report(html_filepath))
+
+    def _explain(self, features_df, scaled_data, results):
+        if self.attribution is None:
+            self.attribution = IsolationForestAttribution(self.model)
+        # in anomaly score units, negative contributions pushed the report towards ANOMALY.
+        # bias + all feature contributions + residual is the anomaly score
+        bias, contributions, residuals = self.attribution.explain(scaled_data)
+        for result, row_contributions, residual in zip(results, contributions, residuals):
+            result['attribution'] = top_contributions(features_df.columns, row_contributions, self.config.attribution_top_k)
+            result['attribution_bias'] = float(bias)
+            # the leaves' expected remaining depth, which no single feature accounts for
+            result['attribution_residual'] = float(residual)
+        return results
+
+    def _score_records(self, flattened_rows, explain=False):
         try:
-            #parse awr report
-            report_data = self.parser.parse_single_report(html_filepath)
-            flattened_data = self.parser._flatten_report_data(report_data)
-            input_df = pd.DataFrame([flattened_data])
+            input_df = pd.DataFrame(flattened_rows)
+
+            #a report missing a section the model needs gets no verdict
+            incomplete = check_feature_inputs(input_df, self.scaler.feature_names_in_)
+            if incomplete.any():
+                raise feature_input_error(input_df, self.scaler.feature_names_in_, incomplete.argmax())
 
             #feature engineering
             features_df = self.feature_engineer(input_df)
@@ -34,15 +120,135 @@ class UnsupervisedPredictPipeline:
             #scale features
             scaled_data = self.scaler.transform(features_df)
 
-            #make prediction
-            anomaly_score = self.model.decision_function(scaled_data)[0]
+            #make prediction for the whole batch
+            anomaly_scores = parallel_decision_function(self.model, scaled_data, n_jobs=self.config.n_jobs, chunk_size=self.config.parallel_chunk_size)
 
-            if anomaly_score < anomaly_threshold:
-                status = "ANOMALY DETECTED"
+            results = []
+            for row, anomaly_score, feature_hash in zip(flattened_rows, anomaly_scores, feature_hashes(features_df)):
+                result = report_identity(row)
+                result.update({
+                    'anomaly_score': float(anomaly_score),
+                    'feature_hash': feature_hash,
+                    'model_version': self.model_version
+                })
+                results.append(result)
+
+            if explain:
+                return self._explain(features_df, scaled_data, results)
+            return results
+
+        except Exception as e:
+            raise ModelError(e, sys)
+
+    def _score_rows(self, errors, explain=False):
+        score_rows = partial(self._score_records, explain=explain)
+        if errors == 'collect':
+            # reports missing a model input fail up front, the rest still share one model call
+            return partial(score_each_on_failure, score_rows, feature_names=self.scaler.feature_names_in_)
+        return score_rows
+
+    def _finish_results(self, flattened_rows, results, anomaly_threshold):
+        # the verdict is applied after scoring so cached scores work with any threshold
+        for row, result in zip(flattened_rows, results):
+            if row is None or is_failure(result):
+                continue
+            if result['anomaly_score'] is None:
+                # fast path verdict, there is no model score to compare
+                result['status'] = "NORMAL"
             else:
-                status = "NORMAL"
+                threshold = self._threshold(result.get('db_name'), anomaly_threshold)
+                result['status'] = "ANOMALY DETECTED" if result['anomaly_score'] < threshold else "NORMAL"
+                if self.per_db_thresholds:
+                    result['anomaly_threshold'] = threshold
+            if self.calibration is not None:
+                result['anomaly_percentile'] = self.calibration.percentile(result['anomaly_score'], result.get('db_name'))
+            if self.feature_store is not None:
+                result['trend_features'] = self.feature_store.update(row)
+        return results
+
+    def predict_records(self, flattened_rows, anomaly_threshold: float = None, errors='raise', explain=False):
+        """
+        scores flattened reports in a single model call and returns one result dict per report.
+        without an anomaly_threshold, reports are judged by DEFAULT_ANOMALY_THRESHOLD (or their database's calibrated one with per_db_thresholds).
+        with errors='collect' a report that cannot be scored gets a failure result instead of failing the batch,
+        with explain=True every result carries the features that moved its score the most
+        """
+        try:
+            return self._finish_results(flattened_rows, self._score_rows(errors, explain)(flattened_rows), anomaly_threshold)
 
-            return status, anomaly_score
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def _predict_full(self, html_filepaths, anomaly_threshold, errors='raise', explain=False):
+        failures = {} if errors == 'collect' else None
+        # cached scores carry no attribution, explained batches are always scored
+        cache = None if explain else self.cache
+        flattened_rows, results = parse_and_score(html_filepaths, self._parse_row, self._score_rows(errors, explain), cache, self.model_version, failures)
+        return fill_failures(html_filepaths, self._finish_results(flattened_rows, results, anomaly_threshold), failures)
+
+    def _predict_with_fast_path(self, html_filepaths, anomaly_threshold, errors='raise'):
+        """ reports inside the gate are NORMAL after a partial parse, the rest are scored in full"""
+        results = [None] * len(html_filepaths)
+        full_indices = []
+        for i, html_filepath in enumerate(html_filepaths):
+            try:
+                row = self.parser._flatten_report_data(self.parser.parse_single_report(html_filepath, sections=FAST_PATH_SECTIONS))
+            except ReportParseError as e:
+                if errors != 'collect':
+                    raise
+                results[i] = failure_result(e, filename=os.path.basename(html_filepath))
+                continue
+            if not self.fast_path.is_clearly_normal(row):
+                full_indices.append(i)
+                continue
+            result = report_identity(row)
+            result.update({
+                'anomaly_score': None,
+                'feature_hash': None,
+                'model_version': self.model_version,
+                'fast_path': True,
+            })
+            results[i] = self._finish_results([row], [result], anomaly_threshold)[0]
+
+        if full_indices:
+            full_results = self._predict_full([html_filepaths[i] for i in full_indices], anomaly_threshold, errors)
+            for i, result in zip(full_indices, full_results):
+                results[i] = result
+        return results
+
+    def predict_batch(self, html_filepaths, anomaly_threshold: float = None, errors='raise', explain=False):
+        """
+        parses and scores several AWR reports through the warm model in one batch.
+        with errors='collect' a report that cannot be parsed or scored gets a failure result in its place,
+        with explain=True every scored result carries its top feature contributions
+        """
+        try:
+            # the gate has to hold for the strictest threshold any database is judged by
+            if anomaly_threshold is None and self.per_db_thresholds:
+                gate_threshold = self.calibration.strictest_threshold(DEFAULT_ANOMALY_THRESHOLD)
+            else:
+                gate_threshold = DEFAULT_ANOMALY_THRESHOLD if anomaly_threshold is None else anomaly_threshold
+            if not explain and self.fast_path is not None and self.fast_path.applies_to(self.model_version, gate_threshold):
+                return self._predict_with_fast_path(html_filepaths, anomaly_threshold, errors)
+            return self._predict_full(html_filepaths, anomaly_threshold, errors, explain)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def predict(self, html_filepath: str, anomaly_threshold: float = None):
+        try:
+            #parse and score awr report
+            result = self.predict_batch([html_filepath], anomaly_threshold=anomaly_threshold)[0]
+
+            return result['status'], result['anomaly_score']
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def explain(self, html_filepath: str, anomaly_threshold: float = None):
+        """ scored result of one report with the features that moved its anomaly score the most"""
+        try:
+            return self.predict_batch([html_filepath], anomaly_threshold=anomaly_threshold, explain=True)[0]
 
         except Exception as e:
-            raise CustomException(e, sys)              
+            raise CustomException(e, sys)
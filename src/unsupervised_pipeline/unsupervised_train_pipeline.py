@@ -1,29 +1,45 @@
 import os
 import sys
-from src.logger import logging
+from src.logger import get_logger
 from src.exception import CustomException
 from src.components.data_ingestion import DataIngestion
 from src.unsupervised_components.unsupervised_data_transformation import DataTransformation
 from src.unsupervised_components.unsupervised_model_trainer import UnsupervisedModelTrainer
+from src.unsupervised_components.unsupervised_fast_path import train_fast_path_gate
+from src.unsupervised_components.unsupervised_calibration import train_score_calibration
+from src.utils import artifact_version
+
+logger = get_logger('training')
 
 def unsupervised_training_pipeline():
     try:
-        logging.info("unsupervised model training started")
+        logger.info("unsupervised model training started")
 
         ## data ingestion
         ingestion = DataIngestion()
         df = ingestion.initiate_data_ingestion()
-        logging.info('Data ingestion completed')
+        logger.info('Data ingestion completed')
 
         ## data transformation
         transformation = DataTransformation()
         X_train_scaled, X_test_scaled = transformation.initiate_data_transformation(df)
-        logging.info('Data transformation completed')
+        logger.info('Data transformation completed')
 
         ## model training
         trainer = UnsupervisedModelTrainer()
         model, anomaly_scores = trainer.initiate_model_trainer(X_train_scaled, X_test_scaled)
-        logging.info("model training completed")
+        logger.info("model training completed")
+
+        ## fast path gate, validated against the model that was just saved
+        model_version = artifact_version(transformation.transformation_config.scaler_path, trainer.model_trainer_config.trained_model_file_path)
+        features_df = transformation.get_data_transformer_object(df)
+        fit_df, held_out_df = transformation.split(features_df)
+        train_fast_path_gate(fit_df, transformation.scaler, model, model_version, validation_df=held_out_df)
+        logger.info("fast path gate saved")
+
+        ## score calibration table, for percentiles and per-db thresholds at prediction time
+        train_score_calibration(features_df, transformation.scaler, model, model_version, db_names=df['db_name'])
+        logger.info("score calibration saved")
         
     except Exception as e:
         raise CustomException(e, sys)
@@ -1,32 +1,48 @@
 import os
 import sys
+import hashlib
 import numpy as np
+import pandas as pd
 import pickle
-from sklearn.model_selection import GridSearchCV
-from sklearn.metrics import accuracy_score, precision_score, recall_score, roc_auc_score, f1_score
 import dill
 from src.exception import CustomException
-from src.logger import logging
+from src.logger import get_logger
+
+logger = get_logger('training')
 
 def save_object(file_path, obj):
     try:
         dir_path = os.path.dirname(file_path)
         os.makedirs(dir_path, exist_ok=True)
 
-        with open(file_path, "wb") as file_obj:
-            dill.dump(obj, file_obj)
+        # written next to the target and renamed over it, a crash never leaves a truncated artifact
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as file_obj:
+                dill.dump(obj, file_obj)
+                file_obj.flush()
+                os.fsync(file_obj.fileno())
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
     except Exception as e:
         raise CustomException(e, sys)
     
 def evaluate_models(X_train, y_train, X_test, y_test, models, param):
+    # imported here so that inference code loading artifacts through this module
+    # does not pay for the model selection and metrics imports
+    from sklearn.model_selection import GridSearchCV
+    from sklearn.metrics import accuracy_score, precision_score, recall_score, roc_auc_score, f1_score
+
     try:
         report = {}
 
         for i in range(len(list(models))):
             model = list(models.values())[i]
             model_name = list(models.keys())[i]
-            logging.info(f"started training of {model_name}")
+            logger.info(f"started training of {model_name}")
             para = param[model_name]
 
             gs = GridSearchCV(model, para, cv=3)
@@ -64,4 +80,49 @@ def load_object(file_path):
             return dill.load(file_pbj)
         
     except Exception as e:
-        raise CustomException(e, sys)
\ No newline at end of file
+        raise CustomException(e, sys)
+    
+def parallel_decision_function(model, X, n_jobs=-1, chunk_size=4096):
+    """ decision_function of large batches split into row chunks scored on parallel threads,
+    the tree traversal runs without the GIL so the chunks use several cores"""
+    from joblib import Parallel, delayed, effective_n_jobs
+
+    try:
+        n_chunks = min(effective_n_jobs(n_jobs), -(-len(X) // chunk_size))
+        if n_chunks <= 1:
+            return model.decision_function(X)
+
+        bounds = np.linspace(0, len(X), n_chunks + 1).astype(int)
+        scores = Parallel(n_jobs=n_chunks, prefer='threads')(
+            delayed(model.decision_function)(X[start:end]) for start, end in zip(bounds[:-1], bounds[1:])
+        )
+        return np.concatenate(scores)
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+def file_checksum(*file_paths):
+    """ sha256 hexdigest of the content of one file, or of several read one after the other, in chunks"""
+    try:
+        digest = hashlib.sha256()
+        for file_path in file_paths:
+            with open(file_path, "rb") as file_obj:
+                for chunk in iter(lambda: file_obj.read(1 << 20), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+def artifact_version(*file_paths):
+    """ short content hash of the given artifacts, changes whenever any of them is retrained"""
+    return file_checksum(*file_paths)[:12]
+
+def normalise_time(value):
+    """ report times as sortable 'YYYY-MM-DD HH:MM:SS' text whenever they can be parsed, the stores index and filter on it"""
+    if value is None:
+        return None
+    try:
+        return pd.Timestamp(value).strftime('%Y-%m-%d %H:%M:%S')
+    except (ValueError, TypeError):
+        return str(value)
@@ -1,68 +1,150 @@
 import streamlit as st
-import os
 import sys
-import tempfile
+import pandas as pd
+from concurrent.futures.process import BrokenProcessPool
 from src.exception import CustomException
 from src.unsupervised_pipeline.unsupervised_prediction_pipeline import UnsupervisedPredictPipeline
+from src.components.result_store import ResultStore
+from src.inference.upload_scoring import UPLOAD_TYPES, expand_uploads, score_uploads, upload_parse_pool
+from src.inference.cluster_scoring import CLUSTER_COLUMNS, score_clusters
 from src.logger import logging
 
 ANOMALY_SCORE_THRESHOLD = -0.025
+TABLE_COLUMNS = ['filename', 'db_name', 'instance', 'start_time', 'status', 'anomaly_score', 'anomaly_percentile', 'anomaly_threshold', 'error']
 
 st.set_page_config(page_title="AWR Anomaly detection", layout="wide")
 st.title("AWR Report Anomaly Detector")
 
+
+@st.cache_resource
+def load_predictor():
+    # loaded once per server process, reruns and other sessions reuse the warm model
+    # calibrated per-database thresholds are only used for calls that pass no threshold
+    return UnsupervisedPredictPipeline(per_db_thresholds=True)
+
+
+@st.cache_resource
+def load_parse_pool(sections):
+    return upload_parse_pool(sections)
+
+
+def results_table(results):
+    return pd.DataFrame(results).reindex(columns=TABLE_COLUMNS)
+
+
 try:
-    predictor = UnsupervisedPredictPipeline()
+    predictor = load_predictor()
+    parse_pool = load_parse_pool(predictor.parser.sections)
     logging.info("Prediction pipeline initialized successfully")
 except Exception as e:
     st.error(f"Error initializing prediction pipeline: {e}")
     logging.error(f"Initialization error: {e}")
     sys.exit(1)
 
-uploaded_file = st.file_uploader("Upload AWR HTML Report (.html)", type=["html"])
+# off by default: a per-database threshold flags about 1% of that database's own history
+per_db_thresholds = st.checkbox("Judge each database by its calibrated threshold", value=False, disabled=predictor.calibration is None)
+anomaly_threshold = None if per_db_thresholds else ANOMALY_SCORE_THRESHOLD
 
-if uploaded_file is not None:
+uploaded_files = st.file_uploader("Upload AWR HTML Reports (.html, optionally compressed) or .zip / .tar.* archives of them", type=UPLOAD_TYPES, accept_multiple_files=True)
+
+if uploaded_files:
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".html") as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_filepath = tmp_file.name
+        # streamlit reruns the script on every interaction, the same uploads are only scored once
+        upload_key = (tuple(uploaded_file.file_id for uploaded_file in uploaded_files), per_db_thresholds)
+        if st.session_state.get('upload_key') != upload_key:
+            reports = expand_uploads((uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files)
+            progress = st.progress(0.0, text=f"Analyzing {len(reports)} AWR reports and detecting Anomalies...")
+            table = st.empty()
+            rows, results = [], []
+            for batch_rows, batch_results in score_uploads(predictor, reports, parse_pool, anomaly_threshold=anomaly_threshold):
+                rows.extend(batch_rows)
+                results.extend(batch_results)
+                table.dataframe(results_table(results), hide_index=True)
+                progress.progress(len(results) / len(reports), text=f"Scored {len(results)} of {len(reports)} reports")
+            table.empty()
+            progress.empty()
+
+            # keep the verdicts so they can be looked up later without the HTML
+            with ResultStore() as store:
+                store.record(results, pipeline='unsupervised')
+            # instances of one RAC database covering the same snapshots are also judged together, by their calibrated percentiles
+            clusters = score_clusters(predictor, rows, results) if predictor.calibration is not None else None
+            st.session_state.update(upload_key=upload_key, rows=rows, results=results, clusters=clusters)
 
-        with st.spinner('Analyzing AWR report and detecting Anomalies...'):
-            status, anomaly_score = predictor.predict(html_filepath=tmp_filepath,
-                                                      anomaly_threshold=ANOMALY_SCORE_THRESHOLD)
+        rows, results = st.session_state['rows'], st.session_state['results']
+        flagged = {i for i, result in enumerate(results) if result.get('status') == "ANOMALY DETECTED"}
+        failed = sum('error' in result for result in results)
 
         st.divider()
-        col1, col2 = st.columns([1,2])
-
-        with col1:
-            st.subheader("Prediction status")
-    
-            if status == "NORMAL":
-                st.success(f"**NORMAL**")
-                st.markdown(f"The AWR report metrics are consistent with typical system behavior")
-            else:
-                st.error(f"**{status}**")
-                st.markdown("Metrices indicate a significant deviation from the normal")
-        
-        with col2:
-            st.subheader("Anomaly score (lower is more anomalous)")
-
-            st.metric(
-                label="Isolation Forest Score",
-                value= f"{anomaly_score:.4f}",
-                delta=f"Threshold: {ANOMALY_SCORE_THRESHOLD:.4f}",
-                delta_color="off"
-            )
-
-            st.caption(f"A score below **{ANOMALY_SCORE_THRESHOLD:.4f}** is flagged as an anomaly.")
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Reports scored", len(results) - failed)
+        col2.metric("Anomalies detected", len(flagged))
+        col3.metric("Failed", failed)
+        st.dataframe(results_table(results), hide_index=True)
+
+        clusters = st.session_state['clusters']
+        if clusters is None:
+            st.caption("RAC cluster scoring is off: it needs the score calibration of the current model.")
+        elif not clusters.empty:
+            st.subheader("RAC clusters")
+            st.caption("Instances of one database covering the same snapshots, judged by their combined calibrated percentile.")
+            st.dataframe(clusters[CLUSTER_COLUMNS].drop(columns=['filenames']), hide_index=True)
+
+        scored = [i for i, result in enumerate(results) if rows[i] is not None and 'error' not in result]
+        if scored:
+            # flagged reports first, the most anomalous at the top
+            scored.sort(key=lambda i: (i not in flagged, results[i]['anomaly_score']))
+            selected = st.selectbox("Report details", scored, format_func=lambda i: f"{results[i]['filename']} ({results[i]['status']})")
+            result = results[selected]
+            status, anomaly_score = result['status'], result['anomaly_score']
+            # the database's calibrated threshold when the predictor judges by one
+            threshold = result.get('anomaly_threshold', ANOMALY_SCORE_THRESHOLD)
+
+            col1, col2 = st.columns([1,2])
+
+            with col1:
+                st.subheader("Prediction status")
+
+                if status == "NORMAL":
+                    st.success(f"**NORMAL**")
+                    st.markdown(f"The AWR report metrics are consistent with typical system behavior")
+                else:
+                    st.error(f"**{status}**")
+                    st.markdown("Metrices indicate a significant deviation from the normal")
+
+                    # features that isolated the report faster than usual, from the trees' paths
+                    explained = predictor.predict_records([rows[selected]], anomaly_threshold=anomaly_threshold, explain=True)[0]
+                    st.markdown("**Top contributing features** (negative pushes towards anomaly)")
+                    st.dataframe(
+                        [{'feature': feature, 'contribution to score': round(value, 4)} for feature, value in explained['attribution'].items()]
+                        + [{'feature': "(unattributed leaf depth)", 'contribution to score': round(explained['attribution_residual'], 4)}],
+                        hide_index=True
+                    )
+                    st.caption(f"Training baseline {explained['attribution_bias']:.4f}; the baseline, all feature contributions (not only the top ones listed) and the unattributed part add up to the score.")
+
+            with col2:
+                st.subheader("Anomaly score (lower is more anomalous)")
+
+                st.metric(
+                    label="Isolation Forest Score",
+                    value= f"{anomaly_score:.4f}",
+                    delta=f"Threshold: {threshold:.4f}",
+                    delta_color="off"
+                )
+
+                st.caption(f"A score below **{threshold:.4f}** is flagged as an anomaly.")
+                if result.get('anomaly_percentile') is not None:
+                    st.caption(f"Worse than **{result['anomaly_percentile']:.1f}%** of the reports the model was trained on.")
 
+    except BrokenProcessPool:
+        # a parser process died, the cached pool is unusable until it is replaced
+        load_parse_pool.clear()
+        st.error("A report parser process crashed, the parser pool was restarted. Retry to score the uploads again.")
+        st.button("Retry")
+        logging.error("parse pool broken, restarting it")
     except CustomException as e:
         st.error(f"Prediction Error: Data processing failed. Details: {e.error_message}")
         logging.error(f"Prediction Error in App: {e}")
     except Exception as e:
         st.error(f"An unexpected error occurred: {e}")
         logging.error(f"Generic App Error: {e}")
-    finally:
-        # Clean up the temporary file
-        if tmp_filepath and os.path.exists(tmp_filepath):
-            os.remove(tmp_filepath)
\ No newline at end of file